@@ -2,19 +2,32 @@
 
 import sys
 import os
-from datetime import datetime
-import mimetypes
+from array import array
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QSettings, QFileInfo
-from PyQt6.QtGui import QIcon, QStandardItemModel, QStandardItem
+from PyQt6.QtCore import (
+    Qt, QThread, pyqtSignal, QSettings, QFileInfo, QAbstractItemModel, QModelIndex,
+    QObject, QTimer, QFileSystemWatcher
+)
+from PyQt6.QtGui import QIcon
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QTextEdit, QFileDialog, QProgressDialog,
-    QMessageBox, QTreeView, QLabel, QComboBox, QStyle, QFileIconProvider
+    QMessageBox, QTreeView, QLabel, QComboBox, QStyle, QFileIconProvider, QInputDialog,
+    QCheckBox, QSpinBox
+)
+
+from contextcap import (
+    ExcludeFilter, ScanSnapshot, SnapshotPatch, rescan_directory, scan_directory
 )
-from fpdf import FPDF
+from contextcap.archive import ArchiveSource, is_archive
+from contextcap.cache import open_cache
+from contextcap.metrics import CaptureMetrics
+from contextcap.planner import CapturePlanner
+from contextcap.pdf import PDFCapture
+from contextcap.progress import CancelToken, CaptureCancelled, ProgressInfo
 
 
 class IconConfig:
@@ -37,39 +50,86 @@ class IconConfig:
         """Get full path to icon file"""
         return self.icon_root / self.current_style / f"{icon_name}.svg"
 
+    def index_style(self, style: str) -> Dict[str, str]:
+        """
+        List the icons available for a style.
+
+        Returns:
+            Icon file paths keyed by lower-case icon name (extension, 'file' or 'folder')
+        """
+        index = {}
+        for directory in (self.icon_root, self.icon_root / style):
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        name, ext = os.path.splitext(entry.name)
+                        if ext == '.svg':
+                            index[name.lower()] = entry.path
+            except OSError:
+                continue  # Missing style directories just fall back to the defaults
+        return index
+
 class IconProvider:
-    """Provides custom icons for files and folders"""
+    """
+    Provides custom icons for files and folders.
+
+    Each style's icon directory is indexed once, so looking up an icon is a
+    dictionary lookup by extension. QIcons are shared per (style, icon) and
+    the least recently used ones are dropped beyond CACHE_SIZE.
+    """
+    CACHE_SIZE = 256
+
     def __init__(self):
         """Initialize the icon provider with custom icons"""
         self.config = IconConfig()
-        self.icon_cache = {}
-        
+        self.icon_cache: 'OrderedDict[Tuple[str, str], QIcon]' = OrderedDict()
+        self.style_indexes: Dict[str, Dict[str, str]] = {}
+        self.icon_index = self._index(self.config.current_style)
+
+    def _index(self, style: str) -> Dict[str, str]:
+        """Return the icon table of a style, reading its directory the first time"""
+        index = self.style_indexes.get(style)
+        if index is None:
+            index = self.config.index_style(style)
+            self.style_indexes[style] = index
+        return index
+
     def set_style(self, style: str):
-        """Change icon style and clear cache"""
+        """Change icon style by switching to its icon table"""
         if self.config.set_style(style):
-            self.icon_cache.clear()  # Clear cache when style changes
+            self.icon_index = self._index(style)
             return True
         return False
 
-    def get_icon(self, file_path: Path) -> QIcon:
-        """Get icon for the given file path"""
-        path_str = str(file_path)
-        if path_str in self.icon_cache:
-            return self.icon_cache[path_str]
-                
-        if file_path.is_dir():
-            icon_path = self.config.get_icon_path('folder')
-        else:
-            extension = file_path.suffix.lower().lstrip('.')
-            icon_path = self.config.get_icon_path(extension)
-            if not icon_path.exists():
-                icon_path = self.config.get_icon_path('file')
-        
-        icon = QIcon(str(icon_path))
-        self.icon_cache[path_str] = icon
+    def icon_name(self, file_path: Path, is_dir: bool) -> str:
+        """Return the name of the icon shown for a path in the current style"""
+        if is_dir:
+            return 'folder'
+        extension = file_path.suffix.lower().lstrip('.')
+        return extension if extension in self.icon_index else 'file'
+
+    def get_icon(self, file_path: Path, is_dir: Optional[bool] = None) -> QIcon:
+        """
+        Get icon for the given file path.
+
+        Pass `is_dir` when it is already known to avoid touching the filesystem.
+        """
+        if is_dir is None:
+            is_dir = file_path.is_dir()
+        key = (self.config.current_style, self.icon_name(file_path, is_dir))
+        icon = self.icon_cache.get(key)
+        if icon is not None:
+            self.icon_cache.move_to_end(key)
+            return icon
+
+        icon_path = self.icon_index.get(key[1])
+        icon = QIcon(icon_path) if icon_path else QIcon()
+        self.icon_cache[key] = icon
+        if len(self.icon_cache) > self.CACHE_SIZE:
+            self.icon_cache.popitem(last=False)
         return icon
 
-def get_file_icon(file_path: Path) -> QIcon:
+def get_file_icon(file_path: Path, is_dir: Optional[bool] = None) -> QIcon:
     """
     Return appropriate icon based on file type.
 
@@ -78,7 +138,7 @@ def get_file_icon(file_path: Path) -> QIcon:
     if ICON_PROVIDER is None:
         # Return a default icon if provider isn't initialized
         return QApplication.style().standardIcon(QStyle.StandardPixmap.SP_FileIcon)
-    return ICON_PROVIDER.get_icon(file_path)
+    return ICON_PROVIDER.get_icon(file_path, is_dir)
 
 # Global icon provider instance (will be initialized in main)
 ICON_PROVIDER = None
@@ -88,98 +148,355 @@ def initialize_icon_provider():
     global ICON_PROVIDER
     ICON_PROVIDER = IconProvider()
 
-def is_allowed_file(file_path: Path) -> bool:
+class SnapshotTreeModel(QAbstractItemModel):
     """
-    Filter files based on extension or other criteria.
-    
-    Args:
-        file_path: Path object to check
-        
-    Returns:
-        bool: True if the file should be included, False otherwise
+    Tree model that reads lazily from a ScanSnapshot.
+
+    Rows are handed to the view in batches as directories are expanded or
+    scrolled into view, and icons are only looked up for rows that are
+    painted. Node ids are allocated as rows are first listed and map to
+    snapshot indexes; they stay the same when the snapshot is patched, so
+    expanded and selected rows survive watcher updates. Node 0 is the root.
     """
-    # Always allow directories
-    if file_path.is_dir():
-        return True
-        
-    # List of excluded patterns
-    excluded = {'.git', '__pycache__', 'node_modules', '.idea', 'venv', '.pytest_cache', '.vscode'}
-    
-    # Check if any part of the path contains excluded patterns
-    if any(ex in file_path.parts for ex in excluded):
-        return False
-        
-    # Check if it's a hidden file (starts with .)
-    if file_path.name.startswith('.'):
-        return False
-        
-    return True
+    FETCH_BATCH = 500  # rows added per fetchMore call
+
+    def __init__(self, snapshot: Optional[ScanSnapshot] = None, parent=None):
+        """
+        Initialize the model.
+
+        Nothing is read from the snapshot until the view asks for rows.
+        """
+        super().__init__(parent)
+        self.snapshot = snapshot
+        self._entry = array('i', [-1])  # snapshot index of each node
+        self._parent_node = array('i', [-1])
+        self._row = array('i', [0])
+        self._node: Dict[int, int] = {}  # node of each listed snapshot index
+        self._children: Dict[int, List[int]] = {}  # child node ids, built when first needed
+        self._fetched: Dict[int, int] = {}  # rows handed to the view per node
+
+    def _new_node(self, entry: int, parent_node: int, row: int) -> int:
+        """Allocate a node id for a snapshot entry"""
+        node = len(self._entry)
+        self._entry.append(entry)
+        self._parent_node.append(parent_node)
+        self._row.append(row)
+        self._node[entry] = node
+        return node
+
+    def _child_nodes(self, node: int) -> List[int]:
+        """Return the child node ids of a node"""
+        children = self._children.get(node)
+        if children is None:
+            children = [
+                self._new_node(entry, node, row)
+                for row, entry in enumerate(self.snapshot.child_indexes(self._entry[node]))
+            ]
+            self._children[node] = children
+        return children
+
+    def _node_index(self, node: int) -> QModelIndex:
+        """Return the model index of a listed node"""
+        return self.createIndex(self._row[node], 0, node)
+
+    def entry_path(self, index: QModelIndex) -> Path:
+        """Return the filesystem path shown at an index"""
+        entry = self._entry[index.internalId()]
+        if entry < 0:
+            return Path(self.snapshot.root)
+        return Path(self.snapshot[entry].path)
+
+    def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, 0)
+        return self.createIndex(row, column, self._child_nodes(parent.internalId())[row])
+
+    def parent(self, child: Optional[QModelIndex] = None):
+        if child is None:
+            return super().parent()  # QObject.parent()
+        if not child.isValid():
+            return QModelIndex()
+        node = child.internalId()
+        if node == 0:
+            return QModelIndex()
+        return self._node_index(self._parent_node[node])
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if not parent.isValid():
+            return 1 if self.snapshot is not None else 0
+        return self._fetched.get(parent.internalId(), 0)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 1
+
+    def hasChildren(self, parent: QModelIndex = QModelIndex()) -> bool:
+        if not parent.isValid():
+            return self.snapshot is not None
+        entry = self._entry[parent.internalId()]
+        return next(self.snapshot.child_indexes(entry), None) is not None
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        if not parent.isValid():
+            return False
+        node = parent.internalId()
+        return self._fetched.get(node, 0) < len(self._child_nodes(node))
+
+    def fetchMore(self, parent: QModelIndex):
+        if not parent.isValid():
+            return
+        node = parent.internalId()
+        fetched = self._fetched.get(node, 0)
+        count = min(self.FETCH_BATCH, len(self._child_nodes(node)) - fetched)
+        if count <= 0:
+            return
+        self.beginInsertRows(parent, fetched, fetched + count - 1)
+        self._fetched[node] = fetched + count
+        self.endInsertRows()
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self._entry[index.internalId()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            if entry < 0:
+                return Path(self.snapshot.root).name
+            return self.snapshot[entry].name
+        if role == Qt.ItemDataRole.DecorationRole:
+            is_dir = entry < 0 or not self.snapshot[entry].is_file
+            return get_file_icon(self.entry_path(index), is_dir)
+        return None
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return 'File Structure'
+        return None
+
+    def refresh_icons(self):
+        """Ask the view to repaint the icons of all listed rows, e.g. after a style change"""
+        roles = [Qt.ItemDataRole.DecorationRole]
+        if self.snapshot is not None:
+            self.dataChanged.emit(self._node_index(0), self._node_index(0), roles)
+        for node, fetched in self._fetched.items():
+            if fetched:
+                parent = self._node_index(node)
+                self.dataChanged.emit(self.index(0, 0, parent), self.index(fetched - 1, 0, parent), roles)
+
+    def _renumber(self, children: List[int], first_row: int):
+        for row in range(first_row, len(children)):
+            self._row[children[row]] = row
+
+    def apply_patch(self, patch: SnapshotPatch):
+        """
+        Switch to a patched snapshot.
+
+        Only rows of the rescanned directory are removed or inserted; every
+        other node keeps its id and is simply pointed at its new snapshot index.
+        """
+        remap = {node: patch.new_index(entry) for entry, node in self._node.items()}
+        dir_node = 0 if patch.index < 0 else self._node.get(patch.index)
+        children = self._children.get(dir_node) if dir_node is not None else None
+
+        # Drop rows whose entries are gone
+        if children is not None:
+            parent = self._node_index(dir_node)
+            for row in reversed(range(len(children))):
+                if remap[children[row]] >= 0:
+                    continue
+                fetched = self._fetched.get(dir_node, 0)
+                if row < fetched:
+                    self.beginRemoveRows(parent, row, row)
+                    del children[row]
+                    self._fetched[dir_node] = fetched - 1
+                    self._renumber(children, row)
+                    self.endRemoveRows()
+                else:
+                    del children[row]
+                    self._renumber(children, row)
+
+        self._node = {}
+        for node, entry in remap.items():
+            if entry >= 0:
+                self._entry[node] = entry
+                self._node[entry] = node
+            else:
+                self._children.pop(node, None)
+                self._fetched.pop(node, None)
+        self.snapshot = patch.snapshot
+
+        # Add rows for new entries, in snapshot (name) order
+        if children is not None:
+            parent = self._node_index(dir_node)
+            for row, entry in enumerate(self.snapshot.child_indexes(patch.index)):
+                if entry in self._node:
+                    continue
+                fetched = self._fetched.get(dir_node, 0)
+                if row < fetched or fetched == len(children):
+                    self.beginInsertRows(parent, row, row)
+                    children.insert(row, self._new_node(entry, dir_node, row))
+                    self._fetched[dir_node] = fetched + 1
+                    self._renumber(children, row)
+                    self.endInsertRows()
+                else:
+                    children.insert(row, self._new_node(entry, dir_node, row))
+                    self._renumber(children, row)
+
+class SnapshotWatcher(QObject):
+    """
+    Reports directories of a snapshot that change on disk.
+
+    Directories are watched with QFileSystemWatcher (inotify on Linux) as far
+    as the platform allows; any it refuses are polled a batch at a time.
+    Events are coalesced for DEBOUNCE_MS before directories_changed is emitted.
+    """
+    directories_changed = pyqtSignal(list)  # changed directory paths
+    DEBOUNCE_MS = 300
+    POLL_INTERVAL_MS = 2000
+    POLL_BATCH = 2000  # directories stat'ed per poll
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self._on_changed)
+        self._pending = set()
+        self._debounce = QTimer(self)
+        self._debounce.setSingleShot(True)
+        self._debounce.setInterval(self.DEBOUNCE_MS)
+        self._debounce.timeout.connect(self._flush)
+        self._poll_timer = QTimer(self)
+        self._poll_timer.setInterval(self.POLL_INTERVAL_MS)
+        self._poll_timer.timeout.connect(self._poll)
+        self._polled: Dict[str, int] = {}  # polled directory -> last mtime_ns
+        self._poll_queue: List[str] = []
+
+    @staticmethod
+    def _mtime(path: str) -> int:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return -1
+
+    def watch(self, snapshot: ScanSnapshot):
+        """Watch the root and every directory of a snapshot"""
+        self.stop()
+        self.watch_paths([snapshot.root] + [entry.path for entry in snapshot.directories()])
+
+    def watch_patch(self, patch: SnapshotPatch):
+        """Start watching the directories a rescan added"""
+        snapshot = patch.snapshot
+        self.watch_paths([
+            snapshot[index].path
+            for start, end in patch.added
+            for index in range(start, end)
+            if not snapshot[index].is_file and not snapshot[index].is_symlink
+        ])
+
+    def watch_paths(self, paths: List[str]):
+        if not paths:
+            return
+        for path in self.watcher.addPaths(paths):
+            self._polled[path] = self._mtime(path)
+        if self._polled and not self._poll_timer.isActive():
+            self._poll_timer.start()
+
+    def stop(self):
+        """Stop watching everything"""
+        watched = self.watcher.directories()
+        if watched:
+            self.watcher.removePaths(watched)
+        self._poll_timer.stop()
+        self._debounce.stop()
+        self._polled.clear()
+        self._poll_queue.clear()
+        self._pending.clear()
+
+    def _on_changed(self, path: str):
+        self._pending.add(path)
+        self._debounce.start()
+
+    def _poll(self):
+        if not self._poll_queue:
+            self._poll_queue = list(self._polled)
+        batch = self._poll_queue[-self.POLL_BATCH:]
+        del self._poll_queue[-self.POLL_BATCH:]
+        for path in batch:
+            mtime = self._mtime(path)
+            if mtime != self._polled.get(path, mtime):
+                if mtime < 0:
+                    del self._polled[path]  # Removed; the parent reports the change
+                else:
+                    self._polled[path] = mtime
+                self._on_changed(path)
+
+    def _flush(self):
+        paths = sorted(self._pending)
+        self._pending.clear()
+        if paths:
+            self.directories_changed.emit(paths)
 
 class DirectoryScanner(QThread):
     """
     Worker thread for scanning directories.
 
-    This class emits signals for progress, structure ready, and error occurred.
+    This class emits signals for progress, metrics, structure ready, error occurred and cancelled.
     """
-    progress = pyqtSignal(int)
-    structure_ready = pyqtSignal(list)  # Changed from str to list
+    progress = pyqtSignal(object)  # ProgressInfo, throttled
+    metrics_ready = pyqtSignal(object)  # CaptureMetrics
+    structure_ready = pyqtSignal(object)  # ScanSnapshot
     error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal()
     
-    def __init__(self, root_path: str):
+    def __init__(
+        self,
+        root_path: str,
+        exclude_patterns: List[str] = (),
+    ):
         """
         Initialize the directory scanner.
 
-        This method sets up the root path and initializes the total and processed items.
+        This method sets up the root path and the exclusion rules for the scan.
+        If the root path is an archive, its members are listed instead.
         """
         super().__init__()
         self.root_path = root_path
-        self.total_items = 0
-        self.processed_items = 0
+        self.exclude = ExcludeFilter(exclude_patterns)
+        self.cancel_token = CancelToken()
+
+    def cancel(self):
+        """Ask the scan to stop at the next directory"""
+        self.cancel_token.cancel()
 
     def run(self):
         """
         Run the directory scanner.
 
-        This method scans the directory, generates the structure, and emits signals for progress and structure ready.
+        This method walks the directory once and emits the resulting snapshot.
         """
         try:
-            # First pass to count items for progress
-            for _ in Path(self.root_path).rglob('*'):
-                if is_allowed_file(_):
-                    self.total_items += 1
-
-            # Generate directory structure
-            structure = []
-            root = Path(self.root_path)
-            
-            # Process all files and directories
-            for current_path in sorted(root.rglob('*')):
+            # Scan metrics are a few counters, so they are always recorded
+            metrics = CaptureMetrics()
+            if is_archive(self.root_path):
+                # Each worker reads through its own source, so none is shared between threads
+                source = ArchiveSource(self.root_path)
                 try:
-                    if not is_allowed_file(current_path):
-                        continue
-                        
-                    # Get the relative path parts
-                    rel_path = current_path.relative_to(root)
-                    path_parts = list(rel_path.parts)
-                    
-                    # Create entry with full path info
-                    entry = {
-                        'name': current_path.name,
-                        'path': str(current_path),
-                        'is_file': current_path.is_file(),
-                        'parts': path_parts
-                    }
-                    structure.append(entry)
-                    
-                    self.processed_items += 1
-                    progress = int((self.processed_items / self.total_items) * 100)
-                    self.progress.emit(progress)
-                    
-                except Exception as e:
-                    self.error_occurred.emit(f"Error processing {current_path}: {str(e)}")
-                    
-            self.structure_ready.emit(structure)
+                    snapshot = source.scan(self.exclude, self.error_occurred.emit, self.cancel_token, metrics)
+                finally:
+                    source.close()
+            else:
+                snapshot = scan_directory(
+                    self.root_path,
+                    progress_callback=self.progress.emit,
+                    error_callback=self.error_occurred.emit,
+                    exclude=self.exclude,
+                    cancel=self.cancel_token,
+                    metrics=metrics,
+                )
+            self.metrics_ready.emit(metrics)
+            self.structure_ready.emit(snapshot)
             
+        except CaptureCancelled:
+            self.cancelled.emit()
         except Exception as e:
             self.error_occurred.emit(f"Error scanning directory: {str(e)}")
 
@@ -187,150 +504,77 @@ class PDFGenerator(QThread):
     """
     Worker thread for PDF generation.
 
-    This class emits signals for progress, finished, and error occurred.
+    This class emits signals for progress, metrics, finished, error occurred and cancelled.
     """
-    progress = pyqtSignal(int)
+    progress = pyqtSignal(object)  # ProgressInfo, throttled
+    metrics_ready = pyqtSignal(object)  # CaptureMetrics, only when recording metrics
     finished = pyqtSignal()
     error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal()
     
-    def __init__(self, root_path: str, output_path: str):
+    def __init__(
+        self,
+        root_path: str,
+        output_path: str,
+        snapshot: Optional[ScanSnapshot] = None,
+        exclude_patterns: List[str] = (),
+        record_metrics: bool = False,
+        token_budget: int = 0,
+    ):
         """
         Initialize the PDF generator.
 
-        This method sets up the root path, output path, and initializes the total and processed files.
+        This method sets up the headless PDFCapture that does the actual work.
+        An existing scan snapshot can be passed in to avoid walking the directory again.
+        With record_metrics, timings are written to a .metrics.json file next to the PDF.
+        A token_budget limits the PDF to the highest-ranked files that fit it.
+        An archive is read through a source of the generator's own, which lists
+        its members again rather than using the snapshot.
         """
         super().__init__()
-        self.root_path = root_path
-        self.output_path = output_path
-        self.total_files = 0
-        self.processed_files = 0
-        
-    def generate_tree_structure(self):
-        """Generate a clean tree structure for PDF."""
-        structure = []
-        root = Path(self.root_path)
-        
-        def add_to_structure(path, depth=0):
-            if not path.is_file() and not path.is_dir():
-                return
-            
-            try:
-                prefix = "    " * depth + ("└── " if depth > 0 else "")
-                structure.append(prefix + path.name)
-                
-                if path.is_dir():
-                    for child in sorted(path.iterdir()):
-                        if is_allowed_file(child):
-                            add_to_structure(child, depth + 1)
-            except Exception as e:
-                print(f"Error processing {path}: {e}")
-        
-        add_to_structure(root)
-        return structure
+        self.archive = is_archive(root_path)
+        self.capture = PDFCapture(
+            root_path, output_path, None if self.archive else snapshot,
+            exclude=ExcludeFilter(exclude_patterns),
+            planner=CapturePlanner(token_budget) if token_budget else None,
+        )
+        self.cancel_token = CancelToken()
+        self.metrics = CaptureMetrics() if record_metrics else None
+
+    def cancel(self):
+        """Ask the capture to stop after the current file; partial output is removed"""
+        self.cancel_token.cancel()
 
     def run(self):
         """Run the PDF generator."""
+        # SQLite connections belong to the thread that opened them
+        self.capture.cache = open_cache()
         try:
-            # Count total files first
-            self.total_files = 0
-            for _ in Path(self.root_path).rglob('*'):
-                if _.is_file() and is_allowed_file(_):
-                    self.total_files += 1
-
-            # Create PDF
-            pdf = FPDF()
-            pdf.set_auto_page_break(auto=True, margin=15)
-            
-            # Add first page
-            pdf.add_page()
-            pdf.set_font('Arial', 'B', 16)
-            title = f"Codebase Capture: {Path(self.root_path).name}"
-            pdf.cell(0, 10, title, ln=True, align='C')
-            
-            # Add timestamp
-            pdf.set_font('Arial', '', 10)
-            timestamp = f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            pdf.cell(0, 10, timestamp, ln=True, align='C')
-            
-            # Add directory structure
-            pdf.add_page()
-            pdf.set_font('Arial', 'B', 12)
-            pdf.cell(0, 10, "Directory Structure:", ln=True)
-            pdf.set_font('Arial', '', 10)
-            
-            # Generate and add tree structure
-            tree_structure = self.generate_tree_structure()
-            for line in tree_structure:
-                # Clean the line text
-                line_text = str(line).encode('ascii', errors='replace').decode('ascii')
-                pdf.cell(0, 5, line_text, ln=True)
-            
-            # Process each file
-            for file_path in Path(self.root_path).rglob('*'):
-                if file_path.is_file() and is_allowed_file(file_path):
-                    try:
-                        # Check if file is text-based
-                        mime_type, _ = mimetypes.guess_type(str(file_path))
-                        
-                        # Define text file extensions
-                        text_extensions = {'.txt', '.md', '.markdown', '.rst', '.log', '.ini', '.conf', '.cfg'}
-                        
-                        is_text = (
-                            # Check MIME type
-                            (mime_type and (
-                                'text' in mime_type 
-                                or 'application/json' in mime_type
-                                or 'application/xml' in mime_type
-                                or 'application/javascript' in mime_type
-                                or 'application/x-python' in mime_type
-                            )) or
-                            # Check file extension
-                            file_path.suffix.lower() in text_extensions
-                        )
-                        
-                        # Add file header
-                        pdf.add_page()
-                        pdf.set_font('Arial', 'B', 12)
-                        rel_path = str(file_path.relative_to(self.root_path))
-                        pdf.cell(0, 10, f"File: {rel_path}", ln=True)
-                        
-                        # Add file content
-                        pdf.set_font('Arial', '', 8)
-                        if is_text:
-                            try:
-                                with open(file_path, 'r', encoding='utf-8') as f:
-                                    content = f.read()
-                                    # Split content into lines and clean them
-                                    for line in content.split('\n'):
-                                        # Replace non-ASCII characters
-                                        line_text = str(line).encode('ascii', errors='replace').decode('ascii')
-                                        pdf.multi_cell(0, 5, line_text)
-                            except UnicodeDecodeError:
-                                pdf.multi_cell(0, 5, "[Binary file contents not shown]")
-                            except Exception as e:
-                                pdf.multi_cell(0, 5, f"[Error reading file: {str(e)}]")
-                        else:
-                            # For non-text files, just show file info
-                            file_size = file_path.stat().st_size
-                            size_str = f"{file_size / 1024:.2f} KB" if file_size > 1024 else f"{file_size} bytes"
-                            pdf.multi_cell(0, 5, f"[Binary file - Size: {size_str}]")
-                            
-                        self.processed_files += 1
-                        progress = int((self.processed_files / self.total_files) * 100)
-                        self.progress.emit(progress)
-                        
-                    except Exception as e:
-                        self.error_occurred.emit(f"Error processing file {file_path}: {str(e)}")
-                        continue
-
-            # Save the PDF
-            pdf.output(self.output_path)
+            if self.archive:
+                self.capture.source = ArchiveSource(self.capture.root_path)
+            self.capture.run(
+                progress_callback=self.progress.emit,
+                error_callback=self.error_occurred.emit,
+                cancel=self.cancel_token,
+                metrics=self.metrics,
+            )
+            if self.metrics is not None:
+                output_base = os.path.splitext(self.capture.output_path)[0]
+                self.metrics.write(output_base + '.metrics.json')
+                self.metrics_ready.emit(self.metrics)
             self.finished.emit()
             
+        except CaptureCancelled:
+            self.cancelled.emit()
         except Exception as e:
             import traceback
             error_details = traceback.format_exc()
             self.error_occurred.emit(f"Error generating PDF: {str(e)}\n{error_details}")
+        finally:
+            if self.capture.cache is not None:
+                self.capture.cache.close()
+            if self.capture.source is not None:
+                self.capture.source.close()
 
 class CodebaseCaptureWindow(QMainWindow):
     def __init__(self):
@@ -341,7 +585,9 @@ class CodebaseCaptureWindow(QMainWindow):
         """
         super().__init__()
         self.selected_path: Optional[str] = None
-        self.exclude_patterns = set()  # For file filtering
+        self.exclude_patterns: List[str] = []  # gitignore-style, in precedence order
+        self.snapshot: Optional[ScanSnapshot] = None  # Last completed scan
+        self.archive = False  # Whether selected_path is an archive
         self.initUI()  # Create UI elements first
         self.load_settings()  # Then load settings
 
@@ -361,7 +607,18 @@ class CodebaseCaptureWindow(QMainWindow):
 
         # Create buttons
         set_location_btn = QPushButton('Set Codebase Location')
+        open_archive_btn = QPushButton('Open Codebase Archive...')
         create_pdf_btn = QPushButton('Create PDF')
+        exclude_btn = QPushButton('Exclude Patterns...')
+        self.watch_check = QCheckBox('Watch for changes')
+        self.metrics_check = QCheckBox('Record timings')
+        budget_label = QLabel("Token budget:")
+        self.budget_spin = QSpinBox()
+        self.budget_spin.setRange(0, 10000)
+        self.budget_spin.setSingleStep(50)
+        self.budget_spin.setSuffix('k')
+        self.budget_spin.setSpecialValueText('Unlimited')
+        self.budget_spin.setToolTip('Capture only the highest-ranked files that fit; the rest are noted in the tree')
         
         # Add style selector
         style_layout = QHBoxLayout()
@@ -371,12 +628,21 @@ class CodebaseCaptureWindow(QMainWindow):
         style_layout.addWidget(style_label)
         style_layout.addWidget(self.style_combo)
         style_layout.addStretch()
+        style_layout.addWidget(self.watch_check)
+        style_layout.addWidget(self.metrics_check)
+        style_layout.addWidget(budget_label)
+        style_layout.addWidget(self.budget_spin)
+        style_layout.addWidget(exclude_btn)
         
         # Create tree view for directory structure
         self.tree_view = QTreeView()
-        self.tree_model = QStandardItemModel()
-        self.tree_model.setHorizontalHeaderLabels(['File Structure'])
+        self.tree_view.setUniformRowHeights(True)
+        self.tree_model = SnapshotTreeModel()
         self.tree_view.setModel(self.tree_model)
+
+        # Keeps the tree and snapshot current while watching is enabled
+        self.watcher = SnapshotWatcher(self)
+        self.watcher.directories_changed.connect(self.apply_changes)
         
         # Create status label
         self.status_label = QLabel()
@@ -384,6 +650,7 @@ class CodebaseCaptureWindow(QMainWindow):
 
         # Add widgets to layout
         layout.addWidget(set_location_btn)
+        layout.addWidget(open_archive_btn)
         layout.addWidget(create_pdf_btn)
         layout.addLayout(style_layout)
         layout.addWidget(self.tree_view)
@@ -391,7 +658,16 @@ class CodebaseCaptureWindow(QMainWindow):
 
         # Connect signals
         set_location_btn.clicked.connect(self.select_directory)
+        open_archive_btn.clicked.connect(self.select_archive)
         create_pdf_btn.clicked.connect(self.create_pdf)
+        exclude_btn.clicked.connect(self.edit_exclude_patterns)
+        self.watch_check.toggled.connect(self.set_watching)
+        self.metrics_check.toggled.connect(
+            lambda enabled: QSettings('CodebaseCapture', 'Settings').setValue('record_metrics', enabled)
+        )
+        self.budget_spin.valueChanged.connect(
+            lambda value: QSettings('CodebaseCapture', 'Settings').setValue('token_budget', value)
+        )
         self.style_combo.currentTextChanged.connect(self.on_style_changed)
         
     def on_style_changed(self, style: str):
@@ -400,14 +676,80 @@ class CodebaseCaptureWindow(QMainWindow):
             # Save the style preference
             settings = QSettings('CodebaseCapture', 'Settings')
             settings.setValue('icon_style', style)
-            # Refresh the tree view with new icons
-            if self.selected_path:
-                self.refresh_tree_view()
+            # Repaint the existing rows with the new icons
+            self.tree_model.refresh_icons()
+
+    def set_watching(self, enabled: bool):
+        """Turn watching the scanned directory for changes on or off"""
+        settings = QSettings('CodebaseCapture', 'Settings')
+        settings.setValue('watch_changes', enabled)
+        if enabled and self.snapshot is not None and not self.archive:
+            self.watcher.watch(self.snapshot)
+        else:
+            self.watcher.stop()
+
+    def apply_changes(self, paths: List[str]):
+        """Rescan directories reported by the watcher and patch the tree in place"""
+        if self.snapshot is None:
+            return
+        exclude = ExcludeFilter(self.exclude_patterns)
+        for path in paths:
+            rel_path = os.path.relpath(path, self.snapshot.root)
+            if rel_path == '.':
+                index = -1
+            else:
+                entry = self.snapshot.find(rel_path)
+                if entry is None or entry.is_file or entry.is_symlink:
+                    continue  # Outside the tree, excluded or already gone
+                index = entry.index
+            try:
+                patch = rescan_directory(self.snapshot, index, exclude)
+            except OSError:
+                continue  # Removed; its parent reports the change
+            self.snapshot = patch.snapshot
+            self.tree_model.apply_patch(patch)
+            self.watcher.watch_patch(patch)
                 
+    def edit_exclude_patterns(self):
+        """Let the user edit the exclude patterns and rescan with them"""
+        text, ok = QInputDialog.getMultiLineText(
+            self, "Exclude Patterns",
+            "One gitignore-style pattern per line (.gitignore files are also honored):",
+            '\n'.join(self.exclude_patterns),
+        )
+        if not ok:
+            return
+        patterns = [line.strip() for line in text.splitlines() if line.strip()]
+        if patterns != self.exclude_patterns:
+            self.exclude_patterns = patterns
+            self.save_settings()
+            self.refresh_tree_view()
+
+    def show_metrics(self, action: str, metrics: CaptureMetrics):
+        """Summarize the timings of a finished scan or capture in the status bar"""
+        total = metrics.phases.get('total', metrics.phases.get('scan', 0.0))
+        text = f"{action} {metrics.counters.get('entries', 0)} entries in {total:.2f}s"
+        slowest = metrics.slowest(1)
+        if slowest:
+            text += f"; slowest file {slowest[0].path} ({slowest[0].seconds:.3f}s)"
+        self.status_label.setText(text)
+
+    def show_progress(self, dialog: QProgressDialog, label: str, info: ProgressInfo):
+        """Show a throttled progress update with throughput and time left"""
+        dialog.setLabelText(f"{label}\n{info.describe()}")
+        dialog.setValue(info.percent)
+
+    def cancel_scan(self):
+        """Stop a scan that is still running"""
+        scanner = getattr(self, 'scanner', None)
+        if scanner is not None and scanner.isRunning():
+            scanner.cancel()
+
     def refresh_tree_view(self):
-        """Refresh the tree view to update icons"""
+        """Rescan the selected directory and rebuild the tree view"""
         if self.selected_path:
-            self.scanner = DirectoryScanner(self.selected_path)
+            self.cancel_scan()
+            self.scanner = DirectoryScanner(self.selected_path, self.exclude_patterns)
             self.scanner.structure_ready.connect(self.display_structure)
             self.scanner.error_occurred.connect(self.show_error)
             self.scanner.start()
@@ -420,19 +762,64 @@ class CodebaseCaptureWindow(QMainWindow):
         """
         directory = QFileDialog.getExistingDirectory(self, "Select Codebase Directory")
         if directory:
-            self.selected_path = directory
-            
-            # Create and configure progress dialog
-            progress = QProgressDialog("Scanning directory...", "Cancel", 0, 100, self)
-            progress.setWindowModality(Qt.WindowModality.WindowModal)
-            progress.show()
+            self.open_location(directory)
 
-            # Create and start scanner thread
-            self.scanner = DirectoryScanner(directory)
-            self.scanner.progress.connect(progress.setValue)
-            self.scanner.structure_ready.connect(self.display_structure)
-            self.scanner.error_occurred.connect(self.show_error)
-            self.scanner.start()
+    def select_archive(self):
+        """Handle selecting a zip or tar archive, which is read without extracting it."""
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Select Codebase Archive", "",
+            "Archives (*.zip *.tar *.tar.gz *.tgz *.tar.bz2 *.tbz2 *.tar.xz *.txz)"
+        )
+        if path:
+            self.open_location(path)
+
+    def set_selected_path(self, path: str):
+        """
+        Switch to a directory or archive.
+
+        Raises:
+            OSError: If the path is an archive that cannot be opened
+        """
+        if is_archive(path):
+            ArchiveSource(path).close()  # fails right away for files that are not archives
+        self.selected_path = path
+        self.archive = is_archive(path)
+
+    def open_location(self, path: str):
+        """Select a directory or archive and scan it with a progress dialog"""
+        self.snapshot = None
+        self.watcher.stop()
+        self.cancel_scan()
+        try:
+            self.set_selected_path(os.path.abspath(path))
+        except OSError as e:
+            self.selected_path = None
+            self.archive = False
+            self.show_error(f"Cannot open archive: {str(e)}")
+            return
+
+        # Create and configure progress dialog
+        label = "Reading archive..." if self.archive else "Scanning directory..."
+        progress = QProgressDialog(label, "Cancel", 0, 0 if self.archive else 100, self)
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.show()
+
+        # Create and start scanner thread
+        self.scanner = DirectoryScanner(self.selected_path, self.exclude_patterns)
+        self.scanner.progress.connect(
+            lambda info: self.show_progress(progress, label, info)
+        )
+        self.scanner.metrics_ready.connect(lambda metrics: self.show_metrics("Scanned", metrics))
+        self.scanner.structure_ready.connect(self.display_structure)
+        self.scanner.error_occurred.connect(self.show_error)
+        self.scanner.cancelled.connect(lambda: self.status_label.setText("Scan cancelled"))
+        progress.canceled.connect(self.scanner.cancel)
+        # An archive scan reports no progress, so the dialog never reaches its
+        # end by itself; close it however the scan ends, errors included
+        self.scanner.structure_ready.connect(lambda snapshot: progress.close())
+        self.scanner.cancelled.connect(progress.close)
+        self.scanner.finished.connect(progress.close)
+        self.scanner.start()
 
     def create_pdf(self):
         """
@@ -455,65 +842,67 @@ class CodebaseCaptureWindow(QMainWindow):
             progress.show()
 
             # Create and start PDF generator thread
-            self.pdf_generator = PDFGenerator(self.selected_path, output_path)
-            self.pdf_generator.progress.connect(progress.setValue)
+            self.pdf_generator = PDFGenerator(
+                self.selected_path, output_path, self.snapshot, self.exclude_patterns,
+                record_metrics=self.metrics_check.isChecked(),
+                token_budget=self.budget_spin.value() * 1000,
+            )
+            self.pdf_generator.metrics_ready.connect(
+                lambda metrics: self.show_metrics("Captured", metrics)
+            )
+            self.pdf_generator.progress.connect(
+                lambda info: self.show_progress(progress, "Generating PDF...", info)
+            )
             self.pdf_generator.finished.connect(
                 lambda: QMessageBox.information(self, "Success", "PDF generated successfully!")
             )
             self.pdf_generator.error_occurred.connect(self.show_error)
+            self.pdf_generator.cancelled.connect(
+                lambda: self.status_label.setText("PDF generation cancelled")
+            )
+            progress.canceled.connect(self.pdf_generator.cancel)
             self.pdf_generator.start()
 
-    def display_structure(self, structure: list):
+    def display_structure(self, snapshot: ScanSnapshot):
         """Display the directory structure in tree view."""
-        self.tree_model.clear()
-        self.tree_model.setHorizontalHeaderLabels(['File Structure'])
-        
-        # Create root item
-        root_path = Path(self.selected_path)
-        root_item = QStandardItem(get_file_icon(root_path), root_path.name)
-        self.tree_model.appendRow(root_item)
-        
-        # Keep track of items by their path parts
-        items = {(): root_item}
-        
-        # Sort entries to ensure parents come before children
-        for entry in sorted(structure, key=lambda x: len(x['parts'])):
-            try:
-                # Get parent path parts
-                parent_parts = tuple(entry['parts'][:-1])
-                parent_item = items.get(parent_parts, root_item)
-                
-                # Create item with appropriate icon
-                path = Path(entry['path'])
-                item = QStandardItem(get_file_icon(path), entry['name'])
-                
-                # Add item to parent
-                parent_item.appendRow(item)
-                
-                # Store item reference if it might have children
-                if not entry['is_file']:
-                    items[tuple(entry['parts'])] = item
-                    
-            except Exception as e:
-                self.show_error(f"Error adding item {entry['name']}: {str(e)}")
-        
-        self.tree_view.expandAll()
+        if snapshot.root != self.selected_path:
+            return  # A newer directory was selected while this scan ran
+        self.snapshot = snapshot
+        self.tree_model = SnapshotTreeModel(snapshot, self)
+        self.tree_view.setModel(self.tree_model)
+
+        # Only the top levels are expanded; deeper rows load on demand
+        self.tree_view.expand(self.tree_model.index(0, 0))
+
+        if self.watch_check.isChecked() and not self.archive:
+            self.watcher.watch(snapshot)
         
     def load_settings(self):
         """
         Load application settings.
 
-        This method loads the last directory, exclude patterns, and icon style from the settings.
+        This method loads the last directory, exclude patterns, icon style, watch mode,
+        metrics recording and token budget from the settings.
         """
         settings = QSettings('CodebaseCapture', 'Settings')
-        self.selected_path = settings.value('last_directory', None)
-        self.exclude_patterns = set(settings.value('exclude_patterns', []))
+        last_directory = settings.value('last_directory', None)
+        if last_directory:
+            try:
+                self.set_selected_path(last_directory)
+            except OSError:
+                pass  # The archive was moved or replaced since
+        patterns = settings.value('exclude_patterns', [], type=list)
+        self.exclude_patterns = list(dict.fromkeys(str(pattern) for pattern in patterns))
         
         # Load and apply icon style
         style = settings.value('icon_style', IconConfig.DEFAULT_STYLE)
         if ICON_PROVIDER and style in IconConfig.STYLES:
             ICON_PROVIDER.set_style(style)
             self.style_combo.setCurrentText(style)
+
+        self.watch_check.setChecked(settings.value('watch_changes', False, type=bool))
+        self.metrics_check.setChecked(settings.value('record_metrics', False, type=bool))
+        self.budget_spin.setValue(settings.value('token_budget', 0, type=int))
         
     def save_settings(self):
         """
@@ -525,7 +914,6 @@ class CodebaseCaptureWindow(QMainWindow):
         if self.selected_path:
             settings.setValue('last_directory', self.selected_path)
         
-        # Convert exclude patterns set to list for storage
         settings.setValue('exclude_patterns', list(self.exclude_patterns))
         
     def closeEvent(self, event):
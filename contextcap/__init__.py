@@ -0,0 +1,27 @@
+"""
+ConTextCap core: headless scanning and capture rendering.
+
+Nothing in this package imports PyQt6, and heavy dependencies such as FPDF
+are only imported when a capture runs.
+"""
+
+from .ignore import EXCLUDED_DIRS, ExcludeFilter
+from .scanner import (
+    ScanEntry,
+    ScanSnapshot,
+    SnapshotPatch,
+    is_allowed_file,
+    rescan_directory,
+    scan_directory,
+)
+
+__all__ = [
+    'EXCLUDED_DIRS',
+    'ExcludeFilter',
+    'ScanEntry',
+    'ScanSnapshot',
+    'SnapshotPatch',
+    'is_allowed_file',
+    'rescan_directory',
+    'scan_directory',
+]
@@ -0,0 +1,8 @@
+"""Allow running the headless capture with ``python -m contextcap``."""
+
+import sys
+
+from .cli import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,402 @@
+"""
+Archive capture source for ConTextCap.
+
+Captures a .zip or .tar(.gz/.bz2/.xz) archive without extracting it. Zip
+archives and uncompressed tarballs are indexed from their headers and
+members are read in place when the capture needs them. A compressed tarball
+can only be read front to back, so it is read in a single sequential pass
+while scanning: members that can end up in the capture are kept in a
+spooled buffer (in memory up to a limit, then in a temporary file), only the
+head and tail of large ones, and everything else is skipped as it streams
+past. Members are always read as streams, so no more of a member than the
+capture keeps is held in memory.
+"""
+
+import os
+import stat
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .content import (
+    BINARY, DEFAULT_MAX_FILE_BYTES, SNIFF_SIZE, FileContent, content_from_bytes, content_from_stream,
+    extension_kind,
+)
+from .ignore import IGNORE_FILES, ExcludeFilter
+from .metrics import CaptureMetrics
+from .progress import CancelToken
+from .scanner import DEFAULT_FILTER, ListingEntry, ScanEntry, ScanSnapshot, snapshot_from_listing
+from .sources import CaptureSource
+
+# Extensions recognized as archives, longest first
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.tbz2', '.txz', '.tar', '.zip')
+
+# Magic numbers of the compressions tarfile supports
+COMPRESSION_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')
+
+# Member data of compressed tarballs kept in memory before spilling to disk
+SPOOL_MEMORY_BYTES = 64 * 1024 * 1024
+
+# Bytes read at a time when copying a member into the spool
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def is_archive(path: str) -> bool:
+    """Check whether a path names a supported archive by its extension"""
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def archive_title(path: str) -> str:
+    """Return an archive's file name without its archive extension"""
+    name = os.path.basename(path)
+    for extension in ARCHIVE_EXTENSIONS:
+        if name.lower().endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def member_path(name: str) -> Optional[str]:
+    """
+    Normalize a member name to a '/'-separated relative path.
+
+    Returns:
+        The path ('' for the archive root), or None for names that would
+        point outside the archive
+    """
+    parts = [part for part in name.replace('\\', '/').split('/') if part and part != '.']
+    if '..' in parts:
+        return None
+    return '/'.join(parts)
+
+
+class ArchiveSource(CaptureSource):
+    """
+    Reads a capture from a zip or tar archive.
+
+    The same exclusion rules apply as for a directory, including ignore files
+    inside the archive.
+    """
+
+    def __init__(self, archive_path: str, max_file_bytes: int = DEFAULT_MAX_FILE_BYTES):
+        """
+        Open an archive.
+
+        Args:
+            archive_path: Path of a .zip, .tar, .tar.gz, .tar.bz2 or .tar.xz file
+            max_file_bytes: Largest text a capture shows in full; of larger
+                members of a compressed tarball only the head and tail that
+                such a capture shows are kept while scanning
+
+        Raises:
+            OSError: If the archive cannot be opened or is not a zip or tar file
+        """
+        self.archive_path = archive_path
+        self.max_file_bytes = max_file_bytes
+        if zipfile.is_zipfile(archive_path):
+            self.kind = 'zip'
+        elif tarfile.is_tarfile(archive_path):
+            with open(archive_path, 'rb') as f:
+                magic = f.read(6)
+            compressed = any(magic.startswith(prefix) for prefix in COMPRESSION_MAGIC)
+            self.kind = 'tar-stream' if compressed else 'tar'
+        else:
+            raise OSError(f"Not a zip or tar archive: {archive_path}")
+
+        self.snapshot: Optional[ScanSnapshot] = None
+        self._members: List[object] = []  # how to read each snapshot entry
+        self._lock = threading.Lock()
+        self._local = threading.local()  # per-thread zip archive or tarball handles
+        self._handles: List[object] = []
+        self._spool = None  # member data of a compressed tarball
+
+    @property
+    def title(self) -> str:
+        return archive_title(self.archive_path)
+
+    def scan(
+        self,
+        exclude: Optional[ExcludeFilter] = None,
+        error_callback: Optional[Callable[[str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+        metrics: Optional[CaptureMetrics] = None,
+    ) -> ScanSnapshot:
+        started = time.perf_counter()
+        if exclude is None:
+            exclude = DEFAULT_FILTER
+        self.close()
+        root = ListingEntry('', os.path.abspath(self.archive_path), is_dir=True)
+        try:
+            if self.kind == 'zip':
+                self._list_zip(root, error_callback)
+            else:
+                self._list_tar(root, exclude, error_callback, cancel)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, ValueError) as e:
+            raise OSError(f"Cannot read {self.archive_path}: {str(e)}")
+
+        snapshot, self._members = snapshot_from_listing(
+            root, exclude,
+            lambda entry: self._read(entry.key, entry.st_size).decode('utf-8', errors='replace').splitlines(True),
+            cancel, scanned_at=os.path.getmtime(self.archive_path),
+        )
+        self.snapshot = snapshot
+        if metrics is not None:
+            metrics.add_phase('scan', time.perf_counter() - started)
+            metrics.count('entries', len(snapshot))
+            metrics.count('directories', len(snapshot) - len(snapshot.files()))
+        return snapshot
+
+    def _list_zip(self, root: ListingEntry, error_callback: Optional[Callable[[str], None]]):
+        """Index a zip archive from its central directory"""
+        with zipfile.ZipFile(self.archive_path) as archive:
+            for info in archive.infolist():
+                path = member_path(info.filename)
+                if path is None:
+                    if error_callback:
+                        error_callback(f"Skipping unsafe member path {info.filename}")
+                    continue
+                if not path:
+                    continue
+                if info.is_dir():
+                    root.add(path, is_dir=True)
+                    continue
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                symlink = stat.S_ISLNK(info.external_attr >> 16)
+                root.add(path, size=info.file_size, mtime=mtime, key=info.filename, symlink=symlink)
+
+    def _list_tar(
+        self,
+        root: ListingEntry,
+        exclude: ExcludeFilter,
+        error_callback: Optional[Callable[[str], None]],
+        cancel: Optional[CancelToken],
+    ):
+        """
+        Index a tarball.
+
+        An uncompressed tarball is indexed by seeking from header to header.
+        A compressed one is read in one pass, spooling the members the
+        capture may need.
+        """
+        streaming = self.kind == 'tar-stream'
+        if streaming:
+            self._spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES, prefix='contextcap-')
+        located: Dict[str, Tuple[object, int]] = {}  # keys and sizes of regular files, for hard links
+        with tarfile.open(self.archive_path, 'r|*' if streaming else 'r:') as archive:
+            for number, member in enumerate(archive):
+                if cancel is not None and number % 1000 == 0:
+                    cancel.raise_if_cancelled()
+                path = member_path(member.name)
+                if path is None:
+                    if error_callback:
+                        error_callback(f"Skipping unsafe member path {member.name}")
+                    continue
+                if not path:
+                    continue
+                if member.isdir():
+                    root.add(path, is_dir=True)
+                    continue
+                if member.issym():
+                    # The link target is shown, as git does
+                    target = member.linkname.encode('utf-8', errors='surrogateescape')
+                    root.add(path, size=len(target), mtime=member.mtime, key=target, symlink=True)
+                    continue
+                if member.islnk():
+                    # Hard links share the data of an earlier member
+                    key, size = located.get(member_path(member.linkname) or '', (None, 0))
+                    root.add(path, size=size, mtime=member.mtime, key=key)
+                    continue
+                if not member.isreg():
+                    continue
+
+                if not streaming:
+                    key = (member.offset_data, member.size)
+                elif member.size == 0:
+                    key = b''
+                elif self._may_capture(path, exclude):
+                    key = self._spool_member(archive, member)
+                else:
+                    # Excluded or only shown as a placeholder: never read
+                    key = None
+                if key is not None:
+                    located[path] = key, member.size
+                root.add(path, size=member.size, mtime=member.mtime, key=key)
+
+    @staticmethod
+    def _may_capture(path: str, exclude: ExcludeFilter) -> bool:
+        """
+        Decide while streaming whether a member's data may be needed.
+
+        Ignore files are not known yet, so only members that the defaults or
+        user patterns exclude outright are dropped; hidden files are kept in
+        case an ignore file re-includes them. Ignore files themselves are
+        always kept.
+        """
+        parts = path.split('/')
+        name = parts[-1]
+        if name in IGNORE_FILES:
+            return True
+        if extension_kind(os.path.splitext(name)[1].lower()) == BINARY:
+            return False
+        for depth in range(1, len(parts) + 1):
+            is_dir = depth < len(parts)
+            for rules in reversed(exclude.base_rules):
+                decision = rules.match('/'.join(parts[:depth]), parts[depth - 1], is_dir)
+                if decision is not None:
+                    if decision:
+                        return False
+                    break
+        return True
+
+    def _spool_member(self, archive: tarfile.TarFile, member: tarfile.TarInfo) -> Tuple[int, int, int]:
+        """
+        Copy what a capture can use of a member's data to the spool.
+
+        Text larger than max_file_bytes is cut to its head and tail, so of a
+        large member only those windows are kept, next to each other; the
+        head also covers the sample that classifies the member.
+
+        Returns:
+            The key: the spool offset and the lengths of the head and tail
+            kept, which add up to the member's size if it was kept whole
+        """
+        source = archive.extractfile(member)
+        half = self.max_file_bytes // 2
+        head, tail = max(half, SNIFF_SIZE + 1), half
+        if member.size <= head + tail:
+            head, tail = member.size, 0
+        self._spool.seek(0, os.SEEK_END)
+        offset = self._spool.tell()
+        self._copy(source, head)
+        if tail:
+            self._copy(source, member.size - head - tail, keep=False)
+            self._copy(source, tail)
+        return offset, head, tail
+
+    def _copy(self, source, count: int, keep: bool = True):
+        """Copy count bytes of a member to the spool, or pass over them"""
+        while count > 0:
+            chunk = source.read(min(COPY_CHUNK_SIZE, count))
+            if not chunk:
+                raise EOFError(f"unexpected end of data in {self.archive_path}")
+            if keep:
+                self._spool.write(chunk)
+            count -= len(chunk)
+
+    def _handle(self):
+        """Return this thread's own handle on the zip archive or uncompressed tarball"""
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            handle = zipfile.ZipFile(self.archive_path) if self.kind == 'zip' else open(self.archive_path, 'rb')
+            self._local.handle = handle
+            with self._lock:
+                self._handles.append(handle)
+        return handle
+
+    @contextmanager
+    def _open_member(self, key, size: int):
+        """
+        Open a member's data by its key.
+
+        Yields a read(n) function that returns up to n more bytes of the
+        member, and a skip(n) function that passes over n bytes, or None if
+        skipping means reading.
+        """
+        if key is None:
+            raise OSError("Member was not read from the archive")
+        if isinstance(key, bytes):
+            # Symlink target, or an empty member
+            position = 0
+
+            def read_bytes(count: int) -> bytes:
+                nonlocal position
+                position += count
+                return key[position - count:position]
+
+            yield read_bytes, None
+        elif self.kind == 'zip':
+            try:
+                with self._handle().open(key) as member:
+                    yield member.read, None
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                # Corrupt, encrypted or unsupported members
+                raise OSError(str(e))
+        elif self.kind == 'tar':
+            handle = self._handle()
+            handle.seek(key[0])
+            yield handle.read, lambda count: handle.seek(count, os.SEEK_CUR)
+        else:
+            offset, head, tail = key
+            position = 0
+
+            def read_spool(count: int) -> bytes:
+                nonlocal position
+                if position < head:
+                    start, end = offset + position, offset + min(head, position + count)
+                elif position >= size - tail:
+                    start = offset + head + position - (size - tail)
+                    end = start + min(count, size - position)
+                else:
+                    return b''  # the middle of a large member was not kept
+                with self._lock:
+                    self._spool.seek(start)
+                    data = self._spool.read(end - start)
+                position += len(data)
+                return data
+
+            def skip_spool(count: int):
+                nonlocal position
+                position += count
+
+            yield read_spool, skip_spool
+
+    def _read(self, key, size: int) -> bytes:
+        """Read a small member, such as an ignore file, whole"""
+        parts = []
+        with self._open_member(key, size) as (read, skip):
+            while size > 0:
+                chunk = read(size)
+                if not chunk:
+                    break
+                parts.append(chunk)
+                size -= len(chunk)
+        return b''.join(parts)
+
+    def load(
+        self,
+        entry: ScanEntry,
+        cache=None,
+        max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+    ) -> FileContent:
+        """
+        Load a member's content.
+
+        Archive members have no stable path on disk, so the content cache is
+        not used. Members of a compressed tarball larger than the source's
+        max_file_bytes only have their head and tail, so a larger max_bytes
+        does not show more of them.
+        """
+        if entry.snapshot is not self.snapshot:
+            raise ValueError("Entry does not belong to this source's snapshot")
+        key = self._members[entry.index]
+        if not entry.size:
+            return content_from_bytes(entry.name, b'', max_bytes)
+        if key is None and extension_kind(os.path.splitext(entry.name)[1].lower()) == BINARY:
+            return FileContent(BINARY)
+        if self.kind == 'tar-stream' and not isinstance(key, bytes):
+            max_bytes = min(max_bytes, self.max_file_bytes)
+        with self._open_member(key, entry.size) as (read, skip):
+            return content_from_stream(entry.name, read, entry.size, max_bytes, skip)
+
+    def close(self):
+        with self._lock:
+            for handle in self._handles:
+                handle.close()
+            self._handles = []
+            self._local = threading.local()
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
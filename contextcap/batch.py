@@ -0,0 +1,596 @@
+"""
+Batch capture for ConTextCap.
+
+Runs the captures listed in a manifest on a pool of worker processes. Each
+worker is started once and runs job after job, so imports, in-process
+memos and its connection to the shared content cache stay warm between
+jobs; the cache itself is shared by all workers. Jobs expected to take
+longest are started first, so one big repository does not start last and
+hold up the whole batch. A job that fails, crashes its worker or runs past its timeout is
+recorded and the batch carries on, and an aggregate report with every
+job's duration and output size is written at the end.
+
+A manifest is a JSON list of jobs, or an object with the jobs and defaults
+shared by all of them. Each job names a root (directory, archive or git
+repository) and an output; its other keys are the long options of the
+capture command, with dashes replaced by underscores. Relative paths are
+resolved against the manifest's directory:
+
+    {
+      "defaults": {"format": "md", "budget": "200k", "exclude": ["*.min.js"]},
+      "jobs": [
+        {"root": "repos/api", "output": "out/api.md"},
+        {"root": "repos/web.tar.gz", "output": "out/web.pdf", "format": "pdf"},
+        {"name": "sdk-review", "root": "repos/sdk", "output": "out/sdk.md", "diff_base": "main"}
+      ]
+    }
+
+Usage:
+    python -m contextcap batch manifest.json -p 4 --timeout 600
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .archive import is_archive
+from .ignore import EXCLUDED_DIRS
+from .pipeline import DEFAULT_WORKERS
+from .progress import CancelToken, CaptureCancelled, format_duration
+from .renderers import format_size, remove_file
+
+BATCH_REPORT_VERSION = 1
+
+# Worker processes run at once by default
+DEFAULT_PROCESSES = min(8, os.cpu_count() or 1)
+
+# Seconds a job may run past its timeout to stop cleanly before its worker is killed
+TIMEOUT_GRACE = 30.0
+
+# Bytes each file adds to a job's estimated size, so trees of many small
+# files rank by their count as well
+FILE_COST_BYTES = 4096
+
+# Roots walked at once to estimate job sizes
+ESTIMATE_THREADS = 8
+
+# File errors of a job kept in the report; the count is always kept
+MAX_REPORTED_ERRORS = 20
+
+# Job statuses
+OK = 'ok'
+PARTIAL = 'partial'  # written, but some files could not be processed
+FAILED = 'failed'
+TIMED_OUT = 'timed-out'
+
+# Capture options that belong to the batch as a whole rather than to a job
+BATCH_OPTIONS = frozenset({
+    'json', 'quiet', 'no_cache', 'cache_dir', 'cache_size', 'metrics', 'top', 'profile', 'trace_memory',
+})
+
+
+class ManifestError(ValueError):
+    """Raised when a batch manifest cannot be read or describes invalid jobs"""
+
+
+class BatchJob(NamedTuple):
+    """A capture to run, with its options parsed as for the capture command"""
+    name: str
+    args: argparse.Namespace
+
+
+class PastRun(NamedTuple):
+    """How long a job ran in an earlier batch"""
+    elapsed: float
+    finished: bool = True  # False if it timed out, so elapsed is only a lower bound
+    input_bytes: int = 0  # estimated size of the root, 0 if the report did not record it
+
+
+class JobResult(NamedTuple):
+    """Outcome of one job"""
+    name: str
+    root: str
+    output: str
+    status: str
+    elapsed: float
+    entries: int = 0
+    files: int = 0
+    output_bytes: int = 0
+    errors: int = 0  # files that could not be processed
+    messages: Tuple[str, ...] = ()  # the first file errors, or why the job failed
+    cache_hits: int = 0
+    cache_misses: int = 0
+    input_bytes: int = 0  # estimated size of the root, for scheduling later batches
+
+    def to_dict(self) -> dict:
+        """Return the result as a JSON-serializable dict"""
+        return self._asdict()
+
+
+class _JobParser(argparse.ArgumentParser):
+    """Parses a job's options, reporting mistakes as ManifestError instead of exiting"""
+
+    def error(self, message: str):
+        raise ManifestError(message)
+
+
+def _job_argv(spec: dict) -> List[str]:
+    """Turn the keys of a manifest job into capture command line arguments"""
+    argv = [str(spec['root']), f"--output={spec['output']}"]
+    for key, value in spec.items():
+        if key in ('name', 'root', 'output') or value is None or value is False:
+            continue
+        if key in BATCH_OPTIONS:
+            raise ManifestError(f"{key} applies to the whole batch, not to a job")
+        flag = '--' + key.replace('_', '-')
+        if value is True:
+            argv.append(flag)
+        elif isinstance(value, list):
+            argv.extend(f"{flag}={item}" for item in value)
+        else:
+            argv.append(f"{flag}={value}")
+    return argv
+
+
+def job_parser() -> argparse.ArgumentParser:
+    """Return a parser for the options of one job"""
+    from .cli import add_capture_arguments
+
+    parser = _JobParser(prog='job', allow_abbrev=False)
+    add_capture_arguments(parser)
+    return parser
+
+
+def parse_job_options(spec: dict, parser: Optional[argparse.ArgumentParser] = None) -> argparse.Namespace:
+    """
+    Parse the root, output and capture options of a job.
+
+    Raises:
+        ManifestError: If the job has unknown or invalid options
+    """
+    return (parser or job_parser()).parse_args(_job_argv(spec))
+
+
+def load_manifest(path: str) -> List[BatchJob]:
+    """
+    Read a batch manifest.
+
+    Returns:
+        The jobs in manifest order
+
+    Raises:
+        ManifestError: If the manifest cannot be read, a job has unknown or
+            invalid options, or two jobs share a name or output
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ManifestError(f"Cannot read manifest {path}: {str(e)}")
+    if isinstance(document, list):
+        document = {'jobs': document}
+    if not isinstance(document, dict) or not isinstance(document.get('jobs'), list):
+        raise ManifestError("A manifest is a list of jobs or an object with a jobs list")
+    defaults = document.get('defaults', {})
+    if not isinstance(defaults, dict):
+        raise ManifestError("Manifest defaults must be an object")
+
+    parser = job_parser()
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    names = set()
+    outputs = set()
+    for number, job in enumerate(document['jobs'], 1):
+        if not isinstance(job, dict) or 'root' not in job or 'output' not in job:
+            raise ManifestError(f"Job {number} needs a root and an output")
+        spec = dict(defaults, **job)
+        spec['root'] = os.path.join(base_dir, os.path.expanduser(str(spec['root'])))
+        spec['output'] = os.path.join(base_dir, os.path.expanduser(str(spec['output'])))
+        name = str(spec.get('name') or os.path.splitext(os.path.relpath(spec['output'], base_dir))[0])
+        try:
+            args = parse_job_options(spec, parser)
+        except ManifestError as e:
+            raise ManifestError(f"Job {name}: {str(e)}")
+        if name in names:
+            raise ManifestError(f"Two jobs are named {name}")
+        if args.output in outputs:
+            raise ManifestError(f"Two jobs write {args.output}")
+        names.add(name)
+        outputs.add(args.output)
+        jobs.append(BatchJob(name, args))
+    return jobs
+
+
+def estimate_size(root: str) -> int:
+    """
+    Estimate the bytes a job reads, for scheduling.
+
+    Archives count their compressed size; directories are walked without
+    descending into the directories every capture excludes, and every file
+    adds FILE_COST_BYTES to its size.
+    """
+    if is_archive(root):
+        return os.path.getsize(root)
+    total = 0
+    pending = [root]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in EXCLUDED_DIRS:
+                                pending.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size + FILE_COST_BYTES
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def read_history(report_path: str) -> Dict[str, PastRun]:
+    """Return how long the jobs of an earlier report ran, by name; failed jobs are left out"""
+    try:
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        return {job['name']: PastRun(job['elapsed'], job['status'] != TIMED_OUT, job.get('input_bytes') or 0)
+                for job in report['results'] if job['status'] in (OK, PARTIAL, TIMED_OUT)}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def estimate_sizes(jobs: List[BatchJob], history: Optional[Dict[str, PastRun]] = None) -> Dict[str, int]:
+    """
+    Estimate the bytes each job reads, by name.
+
+    Jobs whose earlier run recorded its size keep that size; only the other
+    roots are walked, several at once.
+    """
+    history = history or {}
+    sizes = {}
+    pending = []
+    for job in jobs:
+        run = history.get(job.name)
+        if run is not None and run.input_bytes:
+            sizes[job.name] = run.input_bytes
+        else:
+            pending.append(job)
+    if pending:
+        with ThreadPoolExecutor(min(ESTIMATE_THREADS, len(pending))) as executor:
+            walked = executor.map(estimate_size, [job.args.directory for job in pending])
+            sizes.update(zip((job.name for job in pending), walked))
+    return sizes
+
+
+def _seconds_per_byte(history: Dict[str, PastRun]) -> float:
+    """
+    Work out the throughput of the earlier runs that recorded their size.
+
+    Jobs that timed out only count if none finished, and without any such
+    history every byte costs the same one second.
+    """
+    for finished in (True, False):
+        runs = [run for run in history.values() if run.input_bytes and run.finished == finished]
+        total = sum(run.input_bytes for run in runs)
+        if total:
+            return sum(run.elapsed for run in runs) / total
+    return 1.0
+
+
+def schedule(
+    jobs: List[BatchJob],
+    history: Optional[Dict[str, PastRun]] = None,
+    sizes: Optional[Dict[str, int]] = None,
+) -> List[BatchJob]:
+    """
+    Order jobs longest first.
+
+    All jobs are ranked by their estimated duration. A job that finished in
+    the history takes as long as it did then. Any other job takes its
+    estimated size at the throughput of the earlier runs, but a job that
+    timed out takes at least as long as it ran then.
+
+    Args:
+        jobs: The jobs to order
+        history: Earlier runs of the jobs, by name
+        sizes: The jobs' estimated sizes, by name, as from estimate_sizes
+    """
+    history = history or {}
+    if sizes is None:
+        sizes = estimate_sizes(jobs, history)
+    seconds_per_byte = _seconds_per_byte(history)
+    durations = {}
+    for job in jobs:
+        run = history.get(job.name)
+        guess = sizes[job.name] * seconds_per_byte
+        if run is None:
+            durations[job.name] = guess
+        else:
+            durations[job.name] = run.elapsed if run.finished else max(run.elapsed, guess)
+    return sorted(jobs, key=lambda job: -durations[job.name])
+
+
+def _output_bytes(summary) -> int:
+    paths = list(summary.volumes) + [summary.output_path]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def run_job(job: BatchJob, cache=None, timeout: Optional[float] = None, workers: Optional[int] = None) -> JobResult:
+    """
+    Run one job and report how it went; errors are recorded, never raised.
+
+    Args:
+        job: The job to run
+        cache: Content cache shared with other jobs
+        timeout: Seconds after which the capture is cancelled
+        workers: Ingestion threads, unless the job sets its own
+    """
+    from .cli import build_capture, check_capture_args, open_source
+
+    args = job.args
+    started = time.perf_counter()
+
+    def failed(status: str, message: str) -> JobResult:
+        return JobResult(job.name, args.directory, args.output, status, time.perf_counter() - started,
+                         messages=(message,))
+
+    problem = check_capture_args(args)
+    if problem is not None:
+        return failed(FAILED, problem)
+
+    cancel = CancelToken()
+    timer = threading.Timer(timeout, cancel.cancel) if timeout else None
+    source = None
+    try:
+        if timer is not None:
+            timer.start()
+        source = open_source(args)
+        summary = build_capture(args, cache, source, workers).run(cancel=cancel)
+    except CaptureCancelled:
+        return failed(TIMED_OUT, f"Cancelled after {timeout:g}s")
+    except Exception as e:
+        return failed(FAILED, str(e))
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if source is not None:
+            source.close()
+        if cache is not None:
+            cache.flush()
+
+    return JobResult(
+        job.name, args.directory, summary.output_path,
+        status=PARTIAL if summary.errors else OK,
+        elapsed=time.perf_counter() - started,
+        entries=summary.entries,
+        files=summary.files,
+        output_bytes=_output_bytes(summary),
+        errors=len(summary.errors),
+        messages=tuple(summary.errors[:MAX_REPORTED_ERRORS]),
+        cache_hits=summary.cache_hits,
+        cache_misses=summary.cache_misses,
+    )
+
+
+def _remove_partial_output(args: argparse.Namespace):
+    """Delete what a killed job may have written; it had no chance to clean up"""
+    remove_file(args.output)
+    base, ext = os.path.splitext(args.output)
+    for path in glob.glob(glob.escape(base) + '.[0-9][0-9][0-9]' + glob.escape(ext or '.pdf')):
+        remove_file(path)
+    remove_file(base + '.manifest.json')
+
+
+def _worker_main(connection, cache_dir: Optional[str], cache_bytes: int):
+    """Run jobs sent by the scheduler until it sends None or goes away"""
+    from .cache import open_cache
+
+    cache = open_cache(cache_dir, cache_bytes) if cache_bytes else None
+    try:
+        while True:
+            try:
+                task = connection.recv()
+            except EOFError:
+                break
+            if task is None:
+                break
+            job, timeout, workers = task
+            connection.send(run_job(job, cache, timeout, workers))
+    except KeyboardInterrupt:
+        pass  # The scheduler was interrupted too and cleans up
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+class _Worker:
+    """A worker process and the job it is running"""
+
+    def __init__(self, context, cache_dir: Optional[str], cache_bytes: int):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child, cache_dir, cache_bytes), daemon=True)
+        self.process.start()
+        child.close()
+        self.job: Optional[BatchJob] = None
+        self.started = 0.0
+        self.deadline: Optional[float] = None
+
+    def assign(self, job: BatchJob, timeout: Optional[float], workers: Optional[int]):
+        self.job = job
+        self.started = time.perf_counter()
+        self.deadline = self.started + timeout + TIMEOUT_GRACE if timeout else None
+        self.connection.send((job, timeout, workers))
+
+    def stop(self):
+        """Let the worker finish and exit"""
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+def run_batch(
+    jobs: List[BatchJob],
+    processes: int = DEFAULT_PROCESSES,
+    timeout: Optional[float] = None,
+    cache_dir: Optional[str] = None,
+    cache_bytes: int = 0,
+    workers: Optional[int] = None,
+    history: Optional[Dict[str, PastRun]] = None,
+    result_callback: Optional[Callable[[JobResult, int, int], None]] = None,
+) -> List[JobResult]:
+    """
+    Run jobs on a pool of worker processes.
+
+    Args:
+        jobs: The jobs, in manifest order
+        processes: Number of jobs run at once
+        timeout: Seconds after which a job is cancelled; a job that does not
+            stop within TIMEOUT_GRACE more seconds has its worker killed
+        cache_dir: Directory of the shared content cache
+        cache_bytes: Size limit of the content cache, 0 to run without it
+        workers: Ingestion threads per job (default: the CPU count split
+            between the processes)
+        history: Earlier runs of the jobs, by name, for scheduling
+        result_callback: Called with each result and the number of jobs
+            done and in total, as jobs finish
+
+    Returns:
+        One result per job, in manifest order
+    """
+    if workers is None:
+        workers = max(2, DEFAULT_WORKERS // max(1, processes))
+    context = multiprocessing.get_context('spawn')
+    sizes = estimate_sizes(jobs, history)
+    queue = schedule(jobs, history, sizes)
+    queue.reverse()  # popped from the end
+    results: Dict[str, JobResult] = {}
+    idle: List[_Worker] = []
+    busy: List[_Worker] = []
+
+    def finish(worker: _Worker, result: JobResult):
+        busy.remove(worker)
+        worker.job = None
+        results[result.name] = result._replace(input_bytes=sizes[result.name])
+        if result_callback:
+            result_callback(result, len(results), len(jobs))
+
+    def lost(worker: _Worker, status: str, message: str):
+        job = worker.job
+        elapsed = time.perf_counter() - worker.started
+        worker.kill()
+        _remove_partial_output(job.args)
+        finish(worker, JobResult(job.name, job.args.directory, job.args.output, status, elapsed,
+                                 messages=(message,)))
+
+    try:
+        while queue or busy:
+            while queue and len(busy) < processes:
+                worker = idle.pop() if idle else _Worker(context, cache_dir, cache_bytes)
+                worker.assign(queue.pop(), timeout, workers)
+                busy.append(worker)
+
+            deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+            wait = max(0.0, min(deadlines) - time.perf_counter()) if deadlines else None
+            multiprocessing.connection.wait(
+                [worker.connection for worker in busy] + [worker.process.sentinel for worker in busy], wait)
+
+            for worker in list(busy):
+                if worker.connection.poll():
+                    try:
+                        result = worker.connection.recv()
+                    except (EOFError, OSError):
+                        lost(worker, FAILED, f"Worker exited with status {worker.process.exitcode}")
+                        continue
+                    finish(worker, result)
+                    idle.append(worker)
+                elif not worker.process.is_alive():
+                    lost(worker, FAILED, f"Worker exited with status {worker.process.exitcode}")
+                elif worker.deadline is not None and time.perf_counter() >= worker.deadline:
+                    lost(worker, TIMED_OUT, f"Killed after {timeout + TIMEOUT_GRACE:g}s")
+    finally:
+        for worker in busy:
+            worker.kill()
+            _remove_partial_output(worker.job.args)
+        for worker in idle:
+            worker.stop()
+
+    return [results[job.name] for job in jobs]
+
+
+def build_report(
+    results: List[JobResult],
+    elapsed: float,
+    processes: int,
+    timeout: Optional[float] = None,
+    manifest: str = '',
+) -> Dict:
+    """Aggregate job results into the batch report document"""
+    counts = {status: 0 for status in (OK, PARTIAL, FAILED, TIMED_OUT)}
+    for result in results:
+        counts[result.status] += 1
+    return {
+        'version': BATCH_REPORT_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'manifest': manifest,
+        'processes': processes,
+        'timeout': timeout,
+        'elapsed': elapsed,
+        'job_seconds': sum(result.elapsed for result in results),
+        'jobs': len(results),
+        'statuses': counts,
+        'files': sum(result.files for result in results),
+        'output_bytes': sum(result.output_bytes for result in results),
+        'cache_hits': sum(result.cache_hits for result in results),
+        'cache_misses': sum(result.cache_misses for result in results),
+        'results': [result.to_dict() for result in results],
+    }
+
+
+def format_result(result: JobResult) -> str:
+    """Describe one job's outcome in a line"""
+    line = f"{result.name}: {result.status} in {result.elapsed:.2f}s"
+    if result.status in (OK, PARTIAL):
+        line += f", {result.files} files, {format_size(result.output_bytes)}"
+        if result.errors:
+            line += f", {result.errors} errors"
+    elif result.messages:
+        line += f": {result.messages[0]}"
+    return line
+
+
+def format_report(report: Dict, top: int = 5) -> List[str]:
+    """Summarize a batch report as text lines, with its slowest jobs"""
+    statuses = report['statuses']
+    done = statuses[OK] + statuses[PARTIAL]
+    problems = [f"{count} {status}" for status, count in statuses.items() if count and status != OK]
+    lines = [
+        f"Captured {done} of {report['jobs']} jobs in {format_duration(report['elapsed'])} "
+        f"on {report['processes']} processes ({report['job_seconds']:.1f}s of job time, "
+        f"{format_size(report['output_bytes'])} written)"
+        + (f"; {', '.join(problems)}" if problems else "")
+    ]
+    slowest = sorted(report['results'], key=lambda job: -job['elapsed'])[:top]
+    if slowest:
+        lines.append("Slowest jobs:")
+        lines.extend(f"  {job['elapsed']:8.2f}s  {job['name']}" for job in slowest)
+    return lines
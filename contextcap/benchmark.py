@@ -0,0 +1,417 @@
+"""
+Benchmark harness for ConTextCap.
+
+Generates synthetic repositories of a given size and shape, times the scan,
+tree, content and capture phases headless and records the peak resident set
+size. Each case runs in a fresh process so peaks are not inherited from
+earlier cases. Results are JSON and can be compared against a stored
+baseline with a regression threshold.
+
+Usage:
+    python -m contextcap bench --scales 1k,10k -o results.json
+    python -m contextcap bench --scales 1k,10k --baseline results.json
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+BENCH_FORMAT_VERSION = 1
+
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+SHAPES = ('wide', 'deep', 'mixed')
+PHASES = ('scan', 'tree', 'content', 'capture')
+DEFAULT_SCALES = ('1k', '10k')
+DEFAULT_THRESHOLD = 0.10  # fraction slower than the baseline that counts as a regression
+MIN_DELTA = 0.005  # seconds; smaller differences are noise
+
+# Run settings that must match for two results documents to be compared
+RUN_SETTINGS = ('version', 'format', 'repeat')
+# Case parameters that must match for two cases to be compared
+CASE_SETTINGS = ('shape', 'entries', 'seed', 'files', 'bytes')
+
+# Marker describing a generated tree so it can be reused; hidden, so never scanned
+TREE_MARKER = '.bench-tree.json'
+
+BIG_FILE_SIZE = 2 * 1024 * 1024  # above the default text size cap
+MAX_BIG_FILES = 20
+
+
+class TreeSpec(NamedTuple):
+    """Parameters of a synthetic tree"""
+    shape: str
+    entries: int
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        for label, count in SCALES.items():
+            if count == self.entries:
+                return f"{self.shape}-{label}"
+        return f"{self.shape}-{self.entries}"
+
+
+def _text_bodies(rng: random.Random) -> List[bytes]:
+    """A pool of source-like file bodies from ~200 bytes to ~16 KB"""
+    words = ['value', 'index', 'result', 'config', 'item', 'count', 'buffer', 'node', 'path', 'name']
+    bodies = []
+    for size in (4, 16, 60, 150, 400):
+        lines = []
+        for number in range(size):
+            indent = '    ' * rng.randint(0, 3)
+            a, b = rng.choice(words), rng.choice(words)
+            lines.append(f"{indent}{a}_{number} = compute({b}, {rng.randint(0, 999)})  # {b} {a}")
+        bodies.append(('\n'.join(lines) + '\n').encode('utf-8'))
+    return bodies
+
+
+def _binary_body(rng: random.Random) -> bytes:
+    return b'\x89PNG\r\n\x1a\n\x00\x00' + bytes(rng.getrandbits(8) for _ in range(2048))
+
+
+class _TreeWriter:
+    """Writes files and directories while counting entries"""
+
+    def __init__(self, root: str, spec: TreeSpec):
+        self.root = root
+        self.rng = random.Random(spec.seed)
+        self.remaining = spec.entries
+        self.texts = _text_bodies(self.rng)
+        self.binary = _binary_body(self.rng)
+        self.big_files = min(MAX_BIG_FILES, spec.entries // 500)
+        self.files = 0
+        self.bytes = 0
+
+    def mkdir(self, *parts: str) -> str:
+        path = os.path.join(self.root, *parts)
+        os.makedirs(path, exist_ok=True)
+        self.remaining -= 1
+        return path
+
+    def write(self, directory: str, name: str, data: bytes):
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(data)
+        self.remaining -= 1
+        self.files += 1
+        self.bytes += len(data)
+
+    def source_file(self, directory: str, number: int):
+        """Write a text file, or occasionally a binary or an oversized file"""
+        roll = self.rng.random()
+        if roll < 0.05:
+            self.write(directory, f"asset_{number}.png", self.binary)
+        elif roll < 0.07:
+            self.write(directory, f"blob_{number}", self.binary)  # binary without an extension
+        elif self.big_files and roll < 0.08:
+            self.big_files -= 1
+            body = self.texts[-1]
+            self.write(directory, f"big_{number}.log.txt", body * (BIG_FILE_SIZE // len(body) + 1))
+        else:
+            ext = self.rng.choice(('.py', '.js', '.ts', '.go', '.md', '.json', '.toml'))
+            self.write(directory, f"module_{number}{ext}", self.rng.choice(self.texts))
+
+
+def _generate_wide(writer: _TreeWriter):
+    """Two levels of directories holding about a hundred files each"""
+    top = 0
+    while writer.remaining > 0:
+        for sub in range(10):
+            if writer.remaining <= 0:
+                break
+            directory = writer.mkdir(f"pkg_{top:04d}", f"sub_{sub:02d}")
+            for number in range(min(100, writer.remaining)):
+                writer.source_file(directory, number)
+        writer.remaining -= 1  # pkg_NNNN itself
+        top += 1
+
+
+def _generate_deep(writer: _TreeWriter):
+    """Chains of nested directories, 40 levels deep, with a few files per level"""
+    chain = 0
+    while writer.remaining > 0:
+        parts = [f"chain_{chain:04d}"]
+        writer.mkdir(*parts)
+        for level in range(40):
+            if writer.remaining <= 0:
+                break
+            parts.append(f"level_{level:02d}")
+            directory = writer.mkdir(*parts)
+            for number in range(min(4, writer.remaining)):
+                writer.source_file(directory, number)
+        chain += 1
+
+
+def _generate_mixed(writer: _TreeWriter):
+    """
+    A repository-like layout.
+
+    Nested source packages, plus node_modules, .git and an ignored build
+    directory that together hold about a fifth of the entries and must be
+    pruned by the scanner.
+    """
+    total = writer.remaining
+    writer.write(writer.root, '.gitignore', b"build/\n*.tmp\n")
+    writer.write(writer.root, 'README.md', writer.texts[2])
+
+    for excluded, share in (('node_modules', 0.1), ('.git', 0.05), ('build', 0.05)):
+        budget = int(total * share)
+        writer.remaining -= budget
+        remaining, writer.remaining = writer.remaining, budget
+        writer.mkdir(excluded)
+        package = 0
+        while writer.remaining > 0:
+            sub = writer.mkdir(excluded, f"dep_{package:04d}")
+            for number in range(min(50, writer.remaining)):
+                writer.write(sub, f"file_{number}.js", writer.texts[0])
+            package += 1
+        writer.remaining = remaining
+
+    package = 0
+    while writer.remaining > 0:
+        for sub in range(writer.rng.randint(2, 6)):
+            depth = writer.rng.randint(1, 4)
+            parts = ['src', f"package_{package:04d}"] + [f"mod_{sub}_{level}" for level in range(depth)]
+            directory = writer.mkdir(*parts)
+            for number in range(min(writer.rng.randint(5, 60), max(writer.remaining, 0))):
+                writer.source_file(directory, number)
+        package += 1
+
+
+GENERATORS: Dict[str, Callable[[_TreeWriter], None]] = {
+    'wide': _generate_wide,
+    'deep': _generate_deep,
+    'mixed': _generate_mixed,
+}
+
+
+def generate_tree(path: str, spec: TreeSpec) -> Dict:
+    """
+    Create a synthetic tree, or reuse one generated earlier with the same spec.
+
+    Args:
+        path: Directory to create the tree in
+        spec: Shape, approximate number of entries and random seed
+
+    Returns:
+        The tree's description: the spec plus the files and bytes written
+    """
+    marker = os.path.join(path, TREE_MARKER)
+    try:
+        with open(marker, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get('spec') == list(spec):
+            return info
+    except (OSError, ValueError):
+        pass
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    writer = _TreeWriter(path, spec)
+    GENERATORS[spec.shape](writer)
+    info = {'spec': list(spec), 'files': writer.files, 'bytes': writer.bytes}
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    return info
+
+
+def _peak_rss() -> Optional[int]:
+    """Peak resident set size of this process in bytes, None where unsupported"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _time_phase(function: Callable, repeat: int):
+    """Run a phase `repeat` times and return (best seconds, last result)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_case(root: str, phases: Tuple[str, ...], repeat: int, output_format: str) -> Dict:
+    """
+    Time the phases of a capture of one tree in this process.
+
+    The content phase loads every file through the ingestion pipeline
+    without rendering; the capture phase runs a complete uncached capture
+    from the existing snapshot into a temporary file.
+    """
+    from .capture import Capture
+    from .pipeline import ingest_files
+    from .renderers import generate_tree_structure, renderer_for
+    from .scanner import scan_directory
+
+    results: Dict[str, Dict] = {}
+
+    def record(phase: str, seconds: float):
+        results[phase] = {'seconds': round(seconds, 6), 'peak_rss': _peak_rss()}
+
+    seconds, snapshot = _time_phase(lambda: scan_directory(root), repeat)
+    record('scan', seconds)
+    if 'tree' in phases:
+        def tree():
+            for _ in generate_tree_structure(os.path.basename(root), snapshot):
+                pass
+        seconds, _ = _time_phase(tree, repeat)
+        record('tree', seconds)
+    if 'content' in phases:
+        def ingest():
+            for _ in ingest_files(snapshot.files()):
+                pass
+        seconds, _ = _time_phase(ingest, repeat)
+        record('content', seconds)
+    if 'capture' in phases:
+        output_dir = tempfile.mkdtemp(prefix='contextcap-bench-')
+        try:
+            output_path = os.path.join(output_dir, f"capture.{output_format}")
+            seconds, _ = _time_phase(
+                lambda: Capture(root, renderer_for(output_format, output_path), snapshot).run(),
+                repeat,
+            )
+            record('capture', seconds)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+    if 'scan' not in phases:
+        del results['scan']
+
+    return {
+        'entries_scanned': len(snapshot),
+        'files_scanned': len(snapshot.files()),
+        'phases': results,
+        'peak_rss': _peak_rss(),
+    }
+
+
+def run_benchmarks(
+    work_dir: str,
+    specs: List[TreeSpec],
+    phases: Tuple[str, ...] = PHASES,
+    repeat: int = 3,
+    output_format: str = 'pdf',
+    progress_callback: Optional[Callable[[str], None]] = None,
+) -> Dict:
+    """
+    Generate the trees and time every case in a fresh process.
+
+    Returns:
+        The results document: environment details and one record per case
+    """
+    context = multiprocessing.get_context('spawn')
+    cases = []
+    for spec in specs:
+        root = os.path.join(work_dir, spec.name)
+        if progress_callback:
+            progress_callback(f"generating {spec.name}")
+        tree = generate_tree(root, spec)
+        if progress_callback:
+            progress_callback(f"timing {spec.name}")
+        with context.Pool(1) as pool:
+            case = pool.apply(run_case, (root, phases, repeat, output_format))
+        case.update(name=spec.name, shape=spec.shape, entries=spec.entries, seed=spec.seed,
+                    files=tree['files'], bytes=tree['bytes'])
+        cases.append(case)
+
+    return {
+        'version': BENCH_FORMAT_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': repeat,
+        'format': output_format,
+        'cases': cases,
+    }
+
+
+class Regression(NamedTuple):
+    """A phase that got slower than the baseline allows"""
+    case: str
+    phase: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float('inf')
+
+
+def compare_results(
+    baseline: Dict,
+    current: Dict,
+    threshold: float = DEFAULT_THRESHOLD,
+    min_delta: float = MIN_DELTA,
+) -> Tuple[List[str], List[Regression]]:
+    """
+    Compare two results documents case by case and phase by phase.
+
+    A phase regresses when it is more than `threshold` (a fraction) slower
+    than the baseline and the difference exceeds `min_delta` seconds. Cases
+    whose trees differ from the baseline's are reported and skipped.
+
+    Returns:
+        (report lines, regressions)
+
+    Raises:
+        ValueError: If the runs used a different format, repeat count or
+            results version
+    """
+    mismatched = [f"{key} {baseline.get(key)!r} vs {current.get(key)!r}"
+                  for key in RUN_SETTINGS if baseline.get(key) != current.get(key)]
+    if mismatched:
+        raise ValueError(f"baseline is not comparable: {', '.join(mismatched)}")
+    previous = {case['name']: case for case in baseline.get('cases', [])}
+    lines = []
+    regressions = []
+    for case in current.get('cases', []):
+        old = previous.get(case['name'])
+        if old is None:
+            lines.append(f"{case['name']}: no baseline")
+            continue
+        differing = [key for key in CASE_SETTINGS
+                     if key in old and key in case and old[key] != case[key]]
+        if differing:
+            lines.append(f"{case['name']}: not comparable, {', '.join(differing)} differ from the baseline")
+            continue
+        for phase, result in case['phases'].items():
+            old_result = old['phases'].get(phase)
+            if old_result is None:
+                continue
+            before, after = old_result['seconds'], result['seconds']
+            change = (after - before) / before if before else 0.0
+            flag = ''
+            if change > threshold and after - before > min_delta:
+                regressions.append(Regression(case['name'], phase, before, after))
+                flag = '  REGRESSION'
+            lines.append(f"{case['name']:>14} {phase:<8} {before:9.4f}s -> {after:9.4f}s "
+                         f"({change:+.1%}){flag}")
+        if old.get('peak_rss') and case.get('peak_rss'):
+            lines.append(f"{case['name']:>14} {'peak rss':<8} {old['peak_rss'] / 2**20:8.1f}M -> "
+                         f"{case['peak_rss'] / 2**20:8.1f}M")
+    return lines, regressions
+
+
+def format_results(results: Dict) -> List[str]:
+    """Summarize a results document as text lines"""
+    lines = []
+    for case in results['cases']:
+        phases = ', '.join(f"{phase} {result['seconds']:.4f}s"
+                           for phase, result in case['phases'].items())
+        rss = f", peak {case['peak_rss'] / 2**20:.1f} MB" if case.get('peak_rss') else ''
+        lines.append(f"{case['name']}: {case['entries_scanned']} entries scanned; {phases}{rss}")
+    return lines
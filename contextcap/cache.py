@@ -0,0 +1,303 @@
+"""
+Persistent content cache for incremental captures.
+
+Stores each file's classification and decoded lines in a SQLite database.
+Entries are found by path, size and mtime, falling back to a content hash
+when a file was touched without changing, and the least recently used
+entries are evicted once the cache grows past its size limit. Writes are
+buffered and committed in short transactions, so several processes (e.g.
+the jobs of a batch) can share one cache without holding each other up.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from .content import TEXT, FileContent
+from .scanner import ScanEntry
+
+# Bump whenever classification or decoding changes
+CACHE_FORMAT_VERSION = 3
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+# Decoded contents a MemoryCache keeps by default
+DEFAULT_MEMORY_CACHE_SIZE = 256 * 1024 * 1024
+
+# Buffered payload bytes that trigger a write to the database
+FLUSH_BYTES = 16 * 1024 * 1024
+
+
+def open_cache(cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_CACHE_SIZE):
+    """
+    Open a ContentCache, or return None if it cannot be created.
+
+    Captures still work without a cache, just without reuse between runs.
+    """
+    try:
+        return ContentCache(cache_dir, max_bytes)
+    except (OSError, sqlite3.Error):
+        return None
+
+
+def default_cache_dir() -> str:
+    """Return the per-user directory used for the content cache"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'contextcap')
+
+
+class ContentCache:
+    """
+    Size-bounded on-disk cache of file contents.
+
+    Use as a context manager, or call close() to write pending entries and
+    apply the eviction policy; flush() does the same and keeps the cache
+    open. Lookups and stores may come from several ingestion threads at once.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_CACHE_SIZE):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            cache_dir: Directory for the database, default_cache_dir() if None
+            max_bytes: Upper bound on stored content before eviction
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._pending: Dict[str, tuple] = {}  # rows to write, by path
+        self._pending_bytes = 0
+        self._used: Set[str] = set()  # paths whose last_used time is to be updated
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(
+            os.path.join(self.cache_dir, 'content.sqlite3'), timeout=30, check_same_thread=False
+        )
+        self._init_schema()
+
+    def _init_schema(self):
+        """Create the tables, discarding a cache written by another format version"""
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != CACHE_FORMAT_VERSION:
+            self.db.execute('DROP TABLE IF EXISTS files')
+            self.db.execute(f'PRAGMA user_version = {CACHE_FORMAT_VERSION}')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' path TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT,'
+            ' size_limit INTEGER, kind TEXT, payload BLOB, nbytes INTEGER, last_used REAL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS files_digest ON files (digest)')
+        self.db.commit()
+
+    def lookup(self, entry: ScanEntry, size_limit: int) -> Optional[FileContent]:
+        """
+        Return cached content if the file is unchanged since it was stored.
+
+        Content stored under a different size limit is only reused if neither
+        limit would have truncated the file.
+        """
+        with self._lock:
+            row = self.db.execute(
+                'SELECT kind, payload FROM files WHERE path = ? AND size = ? AND mtime = ?'
+                ' AND (size_limit = ? OR (size <= size_limit AND size <= ?))',
+                (entry.path, entry.size, entry.mtime, size_limit, size_limit),
+            ).fetchone()
+            if row is None:
+                return None
+            self._used.add(entry.path)
+            self.hits += 1
+        return self._decode(*row)
+
+    def lookup_digest(self, entry: ScanEntry, digest: str, size_limit: int) -> Optional[FileContent]:
+        """Return cached content with the same hash and remember it for this path"""
+        with self._lock:
+            row = self.db.execute(
+                'SELECT kind, payload FROM files WHERE digest = ?'
+                ' AND (size_limit = ? OR (size <= size_limit AND size <= ?)) LIMIT 1',
+                (digest, size_limit, size_limit),
+            ).fetchone()
+            if row is None:
+                return None
+            self.hits += 1
+            self._put(entry, size_limit, digest, row[0], row[1])
+        return self._decode(*row)
+
+    def store(
+        self,
+        entry: ScanEntry,
+        content: FileContent,
+        size_limit: int,
+        digest: Optional[str] = None,
+    ):
+        """Remember the content of a file loaded under the given size limit"""
+        payload = zlib.compress('\n'.join(content.lines).encode('utf-8'))
+        with self._lock:
+            self.misses += 1
+            self._put(entry, size_limit, digest, content.kind, payload)
+
+    def _put(self, entry: ScanEntry, size_limit: int, digest: Optional[str], kind: str, payload: bytes):
+        self._pending[entry.path] = (entry.path, entry.size, entry.mtime, digest, size_limit, kind,
+                                     payload, len(payload), time.time())
+        self._pending_bytes += len(payload)
+        if self._pending_bytes >= FLUSH_BYTES:
+            self._write_pending()
+
+    def _write_pending(self):
+        """Write buffered entries and access times in one transaction"""
+        now = time.time()
+        self.db.executemany('UPDATE files SET last_used = ? WHERE path = ?',
+                            [(now, path) for path in self._used])
+        self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            list(self._pending.values()))
+        self.db.commit()
+        self._pending = {}
+        self._pending_bytes = 0
+        self._used = set()
+
+    @staticmethod
+    def _decode(kind: str, payload: bytes) -> FileContent:
+        if kind != TEXT:
+            return FileContent(kind)
+        return FileContent(kind, tuple(zlib.decompress(payload).decode('utf-8').split('\n')))
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        total = 0
+        stale = []
+        rows = self.db.execute('SELECT path, nbytes FROM files ORDER BY last_used DESC')
+        for path, nbytes in rows:
+            total += nbytes or 0
+            if total > self.max_bytes:
+                stale.append((path,))
+        self.db.executemany('DELETE FROM files WHERE path = ?', stale)
+
+    def flush(self):
+        """Write pending changes and apply the eviction policy, keeping the cache open"""
+        with self._lock:
+            if self.db is None:
+                return
+            self._write_pending()
+            self.evict()
+            self.db.commit()
+
+    def close(self):
+        """Apply the eviction policy and write pending changes"""
+        self.flush()
+        with self._lock:
+            if self.db is None:
+                return
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MemoryCache:
+    """
+    In-memory layer over a ContentCache for long-running processes.
+
+    Keeps the decoded contents of recently used files, so warm captures skip
+    the database and decompression entirely. Misses fall through to the
+    backing cache, if any, and stores go to both. Has the same interface as
+    ContentCache.
+    """
+
+    def __init__(self, backing: Optional[ContentCache] = None, max_bytes: int = DEFAULT_MEMORY_CACHE_SIZE):
+        """
+        Args:
+            backing: On-disk cache consulted on misses, or None
+            max_bytes: Approximate bound on the decoded text kept in memory
+        """
+        self.backing = backing
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries: 'OrderedDict[tuple, Tuple[FileContent, int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(entry: ScanEntry, size_limit: int) -> tuple:
+        return entry.path, entry.size, entry.mtime, size_limit
+
+    def _remember(self, key: tuple, content: FileContent, hit: bool):
+        nbytes = sum(len(line) for line in content.lines) + 64
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            self._entries[key] = (content, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes and self._entries:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+
+    def lookup(self, entry: ScanEntry, size_limit: int) -> Optional[FileContent]:
+        """Return the content of an unchanged file from memory or the backing cache"""
+        key = self._key(entry, size_limit)
+        with self._lock:
+            found = self._entries.get(key)
+            if found is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return found[0]
+        content = self.backing.lookup(entry, size_limit) if self.backing is not None else None
+        if content is not None:
+            self._remember(key, content, hit=True)
+        return content
+
+    def lookup_digest(self, entry: ScanEntry, digest: str, size_limit: int) -> Optional[FileContent]:
+        """Return content with the same hash from the backing cache"""
+        content = self.backing.lookup_digest(entry, digest, size_limit) if self.backing is not None else None
+        if content is not None:
+            self._remember(self._key(entry, size_limit), content, hit=True)
+        return content
+
+    def store(
+        self,
+        entry: ScanEntry,
+        content: FileContent,
+        size_limit: int,
+        digest: Optional[str] = None,
+    ):
+        """Remember the content of a file loaded under the given size limit"""
+        self._remember(self._key(entry, size_limit), content, hit=False)
+        if self.backing is not None:
+            self.backing.store(entry, content, size_limit, digest)
+
+    def flush(self):
+        """Write pending changes of the backing cache"""
+        if self.backing is not None:
+            self.backing.flush()
+
+    def close(self):
+        """Drop the contents kept in memory and close the backing cache"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        if self.backing is not None:
+            self.backing.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,284 @@
+"""
+Capture driver for ConTextCap.
+
+Scans a codebase, loads file contents through the ingestion pipeline and
+feeds them in order to a Renderer, which decides the output format.
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from .content import DEFAULT_MAX_FILE_BYTES, TEXT, load_file_content
+from .dedup import EXACT, Deduplicator
+from .pipeline import DEFAULT_WORKERS, ingest_files
+from .progress import CancelToken, ProgressInfo, ProgressThrottle
+from .renderers import Renderer, generate_tree_structure
+from .ignore import ExcludeFilter
+from .metrics import CaptureMetrics, FileMetrics, Stopwatch
+from .planner import CapturePlanner
+from .scanner import ScanEntry, ScanSnapshot, scan_directory
+from .sources import CaptureSource
+
+
+class CaptureSummary(NamedTuple):
+    """Outcome of a finished capture"""
+    root_path: str
+    output_path: str
+    entries: int
+    files: int
+    text_files: int
+    binary_files: int
+    errors: List[str]
+    elapsed: float
+    cache_hits: int = 0
+    cache_misses: int = 0
+    volumes: Tuple[str, ...] = ()
+    duplicates: int = 0
+    skipped: int = 0  # files left out to fit the token budget
+    estimated_tokens: int = 0  # planned size of the capture, if it had a budget
+
+    def to_dict(self) -> dict:
+        """Return the summary as a JSON-serializable dict"""
+        return self._asdict()
+
+
+def capture_time() -> datetime:
+    """
+    Return the time recorded in a capture.
+
+    Honors SOURCE_DATE_EPOCH so that repeated captures of the same tree are
+    byte-identical.
+    """
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        return datetime.fromtimestamp(int(epoch), tz=timezone.utc)
+    return datetime.now()
+
+
+class Capture:
+    """
+    Captures a codebase with a given renderer.
+
+    This class has no Qt dependency; the GUI runs it on a worker thread and
+    the command line runs it directly.
+    """
+
+    def __init__(
+        self,
+        root_path: str,
+        renderer: Renderer,
+        snapshot: Optional[ScanSnapshot] = None,
+        cache=None,
+        workers: int = DEFAULT_WORKERS,
+        max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+        exclude: Optional[ExcludeFilter] = None,
+        dedup: Optional[str] = EXACT,
+        planner: Optional[CapturePlanner] = None,
+        source: Optional[CaptureSource] = None,
+    ):
+        """
+        Initialize the capture.
+
+        An existing scan snapshot can be passed in to avoid walking the directory again,
+        and a ContentCache to reuse file contents from earlier captures. Files are
+        loaded by `workers` ingestion threads ahead of the renderer, and text files
+        larger than `max_file_bytes` are reduced to their head and tail. `exclude`
+        applies when the capture scans the directory itself. Unless `dedup` is None,
+        files whose content already appeared in the capture are written as a
+        reference to the first copy (see contextcap.dedup for the modes). With a
+        `planner`, only the files that fit its token budget are captured and the
+        others are noted in the directory tree. A `source` replaces scanning
+        root_path and reading files from disk, e.g. with a git ref; the caller
+        closes it.
+        """
+        self.root_path = root_path
+        self.renderer = renderer
+        self.snapshot = snapshot
+        self.cache = cache
+        self.workers = workers
+        self.max_file_bytes = max_file_bytes
+        self.exclude = exclude
+        self.dedup = dedup
+        self.planner = planner
+        self.source = source
+        self.total_files = 0
+        self.processed_files = 0
+
+    @property
+    def output_path(self) -> str:
+        """Path the renderer writes to"""
+        return self.renderer.output_path
+
+    def run(
+        self,
+        progress_callback: Optional[Callable[[ProgressInfo], None]] = None,
+        error_callback: Optional[Callable[[str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+        metrics: Optional[CaptureMetrics] = None,
+    ) -> CaptureSummary:
+        """
+        Run the capture and write the output.
+
+        If the capture fails or is cancelled, whatever the renderer already
+        wrote is removed.
+
+        Args:
+            progress_callback: Called with throttled updates as files are written
+            error_callback: Called with a message for files that fail
+            cancel: Token checked between files
+            metrics: Collects phase timings and per-file measurements if given
+
+        Returns:
+            CaptureSummary: Counts, errors and timing for the capture
+
+        Raises:
+            CaptureCancelled: If the capture was cancelled
+        """
+        started = time.perf_counter()
+        errors = []
+        text_files = 0
+
+        def report_error(message: str):
+            errors.append(message)
+            if error_callback:
+                error_callback(message)
+
+        # The cache may outlive this capture, so only its hits from here on count
+        cache_hits, cache_misses = (self.cache.hits, self.cache.misses) if self.cache is not None else (0, 0)
+        watch = load_times = None
+        if metrics is not None:
+            watch = Stopwatch()
+            load_times = {}
+            metrics.start_profiling()
+
+        try:
+            source = self.source
+            snapshot = self.snapshot
+            if snapshot is None:
+                if source is not None:
+                    snapshot = source.scan(self.exclude, report_error, cancel, metrics)
+                else:
+                    snapshot = scan_directory(
+                        self.root_path, error_callback=report_error, exclude=self.exclude,
+                        cancel=cancel, metrics=metrics,
+                    )
+                if metrics is not None:
+                    watch.lap()  # scanning records its own phase
+            files = source.files(snapshot) if source is not None else snapshot.files()
+            notes = dict(source.notes(snapshot)) if source is not None else {}
+            plan = None
+            if self.planner is not None:
+                plan = self.planner.plan(snapshot, self.max_file_bytes, files)
+                files = plan.files
+                notes.update(plan.notes)
+                if metrics is not None:
+                    metrics.add_phase('plan', watch.lap())
+            self.total_files = len(files)
+            self.processed_files = 0
+            progress = ProgressThrottle(progress_callback, self.total_files, 'files')
+
+            renderer = self.renderer
+            renderer.cancel = cancel
+            dedup = Deduplicator(self.dedup, max_bytes=self.max_file_bytes) if self.dedup else None
+            results = ingest_files(
+                files, self.cache, self.workers, max_file_bytes=self.max_file_bytes,
+                load_times=load_times, dedup=dedup,
+                loader=source.load if source is not None else load_file_content,
+            )
+            try:
+                title = source.title if source is not None else Path(self.root_path).name
+                # The tree is laid out as it is generated, so both count towards begin
+                tree = generate_tree_structure(title, snapshot, notes)
+                renderer.begin(title, capture_time(), tree)
+                if metrics is not None:
+                    metrics.add_phase('begin', watch.lap())
+
+                for entry, content in results:
+                    if cancel is not None:
+                        cancel.raise_if_cancelled()
+                    if metrics is not None:
+                        metrics.add_phase('wait', watch.lap())
+                        pages = renderer.pages
+                    # Counted before dedup, which turns repeated text into references
+                    is_text = not isinstance(content, Exception) and content.kind == TEXT
+                    if dedup is not None:
+                        content = dedup.resolve(entry, content)
+                    try:
+                        renderer.write_file(entry, entry.rel_path, content)
+                        if is_text:
+                            text_files += 1
+
+                        self.processed_files += 1
+                        progress.update(self.processed_files)
+
+                    except Exception as e:
+                        report_error(f"Error processing file {entry.path}: {str(e)}")
+                        continue
+                    finally:
+                        if metrics is not None:
+                            self._record_file(metrics, entry, content, renderer.pages - pages,
+                                              load_times.pop(entry.index, 0.0), watch.lap())
+
+                output_path = renderer.finish()
+                if metrics is not None:
+                    metrics.add_phase('finish', watch.lap())
+                progress.update(self.total_files)
+            except BaseException:
+                renderer.abort()
+                raise
+            finally:
+                # Stop the ingestion workers right away rather than when collected
+                results.close()
+        finally:
+            if metrics is not None:
+                metrics.stop_profiling()
+
+        elapsed = time.perf_counter() - started
+        if metrics is not None:
+            metrics.add_phase('total', elapsed)
+            metrics.count('entries', len(snapshot))
+            metrics.count('files', self.total_files)
+            if dedup is not None:
+                metrics.count('duplicates', dedup.duplicates)
+                metrics.count('duplicate_bytes', dedup.saved_bytes)
+            if plan is not None:
+                metrics.count('skipped', plan.skipped)
+                metrics.count('estimated_tokens', plan.tokens)
+
+        return CaptureSummary(
+            root_path=self.root_path,
+            output_path=output_path,
+            entries=len(snapshot),
+            files=self.total_files,
+            text_files=text_files,
+            binary_files=self.processed_files - text_files,
+            errors=errors,
+            elapsed=elapsed,
+            cache_hits=self.cache.hits - cache_hits if self.cache is not None else 0,
+            cache_misses=self.cache.misses - cache_misses if self.cache is not None else 0,
+            volumes=renderer.volumes,
+            duplicates=dedup.duplicates if dedup is not None else 0,
+            skipped=plan.skipped if plan is not None else 0,
+            estimated_tokens=plan.tokens if plan is not None else 0,
+        )
+
+    @staticmethod
+    def _record_file(
+        metrics: CaptureMetrics,
+        entry: ScanEntry,
+        content,
+        pages: int,
+        load_seconds: float,
+        render_seconds: float,
+    ):
+        if isinstance(content, Exception):
+            kind, lines = 'error', 0
+        else:
+            kind, lines = content.kind, len(content.lines)
+        metrics.add_phase('render', render_seconds)
+        metrics.add_file(FileMetrics(
+            entry.rel_path, entry.size, kind, lines, pages, load_seconds, render_seconds,
+        ))
@@ -0,0 +1,487 @@
+"""
+Headless command line interface for ConTextCap.
+
+Usage:
+    python -m contextcap capture <directory> -o out.pdf [--json]
+    python -m contextcap capture <directory> -o out.md [--format md]
+    python -m contextcap capture <repository> -o out.md --ref v1.2 [--diff-base main]
+    python -m contextcap capture <archive.zip|archive.tar.gz> -o out.md
+    python -m contextcap batch manifest.json [-p 4] [--timeout 600] [--report report.json]
+    python -m contextcap serve (--socket PATH | --port N) [--max-captures 4]
+    python -m contextcap bench [--scales 1k,10k] [--baseline old.json] [-o new.json]
+
+Exit status:
+    0  capture written without errors
+    1  capture failed and no output was written
+    2  invalid command line arguments
+    3  capture written but some files could not be processed
+    130  capture interrupted; partial output was removed
+
+The batch command exits with 1 if a job failed or timed out, 2 for an
+invalid manifest and 3 if some jobs could not process every file. The
+bench command exits with 1 if a phase regressed beyond the threshold.
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional
+
+from .dedup import DEDUP_MODES, EXACT
+from .renderers import FORMATS, format_for_path
+
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+EXIT_PARTIAL = 3
+EXIT_CANCELLED = 130
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser for the command line interface"""
+    parser = argparse.ArgumentParser(
+        prog='contextcap',
+        description='Capture a codebase into a single document for LLM context.',
+    )
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    capture = subparsers.add_parser('capture', help='capture a directory into a document')
+    add_capture_arguments(capture)
+
+    batch = subparsers.add_parser('batch', help='run the captures listed in a manifest in parallel')
+    batch.add_argument('manifest', help='JSON manifest of jobs, each with a root, an output and capture options')
+    batch.add_argument('-p', '--processes', type=int, default=None, metavar='N',
+                       help='jobs run at once (default: CPU count, max 8)')
+    batch.add_argument('--timeout', type=float, metavar='SECONDS',
+                       help='cancel jobs that run longer than this')
+    batch.add_argument('--report', metavar='FILE',
+                       help='where to write the JSON report; an earlier report there orders the jobs '
+                            '(default: MANIFEST.report.json)')
+    batch.add_argument('-j', '--workers', type=int, default=None, metavar='N',
+                       help='file ingestion threads per job (default: CPU count split between processes)')
+    batch.add_argument('--no-cache', action='store_true',
+                       help='do not read or update the content cache')
+    batch.add_argument('--cache-dir', help='directory of the content cache shared by the jobs')
+    batch.add_argument('--cache-size', type=int, default=256, metavar='MB',
+                       help='maximum size of the content cache (default: 256)')
+    batch.add_argument('--top', type=int, default=5, metavar='N',
+                       help='number of slowest jobs to report (default: 5)')
+    batch.add_argument('--json', action='store_true',
+                       help='print the report to stdout instead of text')
+    batch.add_argument('-q', '--quiet', action='store_true',
+                       help='do not report jobs on stderr as they finish')
+
+    serve = subparsers.add_parser('serve', help='run a capture service with warm caches')
+    address = serve.add_mutually_exclusive_group(required=True)
+    address.add_argument('--socket', metavar='PATH', help='listen on a Unix socket')
+    address.add_argument('--port', type=int, metavar='N', help='listen on a localhost TCP port (0: any free port)')
+    serve.add_argument('--token-file', metavar='PATH',
+                       help='with --port, where to write the token requests must send '
+                            '(default: serve-PORT.token in the cache directory)')
+    serve.add_argument('--max-captures', type=int, default=None, metavar='N',
+                       help='captures run at once (default: CPU count, max 4)')
+    serve.add_argument('-j', '--workers', type=int, default=None, metavar='N',
+                       help='file ingestion threads per capture (default: CPU count, max 8)')
+    serve.add_argument('--memory-cache', type=int, default=256, metavar='MB',
+                       help='decoded file contents kept in memory (default: 256)')
+    serve.add_argument('--no-cache', action='store_true',
+                       help='do not read or update the on-disk content cache')
+    serve.add_argument('--cache-dir', help='directory of the content cache')
+    serve.add_argument('--cache-size', type=int, default=256, metavar='MB',
+                       help='maximum size of the content cache (default: 256)')
+
+    bench = subparsers.add_parser('bench', help='time scanning and capturing synthetic trees')
+    bench.add_argument('--scales', default='1k,10k',
+                       help='comma-separated tree sizes: 1k, 10k, 100k, 1m or a number (default: 1k,10k)')
+    bench.add_argument('--shapes', default='wide,deep,mixed',
+                       help='comma-separated tree shapes: wide, deep, mixed (default: all)')
+    bench.add_argument('--phases', default='scan,tree,content,capture',
+                       help='comma-separated phases to time (default: all)')
+    bench.add_argument('--format', default='pdf', choices=FORMATS,
+                       help='output format of the capture phase (default: pdf)')
+    bench.add_argument('--repeat', type=int, default=3, metavar='N',
+                       help='runs per phase; the fastest is kept (default: 3)')
+    bench.add_argument('--seed', type=int, default=0, help='random seed of the generated trees')
+    bench.add_argument('--work-dir', help='where generated trees are kept between runs '
+                       '(default: contextcap-bench in the temporary directory)')
+    bench.add_argument('-o', '--output', help='write the results as JSON to this file')
+    bench.add_argument('--baseline', help='compare against results from an earlier run')
+    bench.add_argument('--threshold', type=float, default=10.0, metavar='PCT',
+                       help='slowdown that counts as a regression (default: 10)')
+    return parser
+
+
+def add_capture_arguments(parser: argparse.ArgumentParser):
+    """Add the options of the capture command; batch manifests reuse them for their jobs"""
+    parser.add_argument('directory', help='root directory of the codebase, or a .zip or .tar(.gz) archive of it')
+    parser.add_argument('-o', '--output', required=True, help='path of the document to write')
+    parser.add_argument('-f', '--format', choices=FORMATS,
+                        help='output format (default: from the output extension, else pdf)')
+    parser.add_argument('--json', action='store_true',
+                        help='print a JSON summary to stdout instead of text')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or update the content cache')
+    parser.add_argument('--cache-dir', help='directory of the content cache')
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MB',
+                        help='maximum size of the content cache (default: 256)')
+    parser.add_argument('--volume-pages', type=int, metavar='N',
+                        help='split the output into volumes of about N pages')
+    parser.add_argument('--volume-size', type=int, metavar='MB',
+                        help='split the output into volumes of about MB megabytes of text')
+    parser.add_argument('--max-file-size', type=int, default=1024, metavar='KB',
+                        help='show only the head and tail of larger text files (default: 1024)')
+    parser.add_argument('--no-monospace', action='store_true',
+                        help='wrap file contents in a proportional font (much slower)')
+    parser.add_argument('--ref', metavar='REF',
+                        help='capture a commit, branch or tag of the git repository at DIRECTORY '
+                             'without checking it out')
+    parser.add_argument('--diff-base', metavar='BASE',
+                        help='capture only the files added or modified on --ref (default: HEAD) since '
+                             'its merge base with BASE; the directory tree still lists every file')
+    parser.add_argument('-x', '--exclude', action='append', default=[], metavar='PATTERN',
+                        help='skip paths matching a gitignore-style pattern (repeatable)')
+    parser.add_argument('--no-ignore-files', action='store_true',
+                        help='do not read .gitignore and .ignore files')
+    parser.add_argument('--dedup', choices=DEDUP_MODES + ('off',), default=EXACT,
+                        help='write repeated file contents once and refer back to them; whitespace '
+                             'also matches files that differ only in whitespace (default: exact)')
+    parser.add_argument('--budget', type=_token_count, metavar='TOKENS',
+                        help='capture only the highest-ranked files that fit about TOKENS tokens '
+                             '(e.g. 200k); the others are noted in the directory tree')
+    parser.add_argument('--prefer', action='append', default=[], metavar='PATTERN',
+                        help='with --budget, keep files matching a gitignore-style pattern first (repeatable)')
+    parser.add_argument('--avoid', action='append', default=[], metavar='PATTERN',
+                        help='with --budget, skip files matching a gitignore-style pattern first (repeatable)')
+    parser.add_argument('-j', '--workers', type=int, default=None, metavar='N',
+                        help='number of file ingestion threads (default: CPU count, max 8)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not report per-file errors on stderr')
+    parser.add_argument('--metrics', nargs='?', const='', metavar='FILE',
+                        help='record phase timings and per-file metrics and write them as JSON '
+                             '(default: OUTPUT.metrics.json)')
+    parser.add_argument('--top', type=int, default=10, metavar='N',
+                        help='number of slowest files to report with --metrics (default: 10)')
+    parser.add_argument('--profile', action='store_true',
+                        help='run the capture under cProfile; implies --metrics and writes a .prof file')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='track allocations with tracemalloc; implies --metrics')
+
+
+def _token_count(value: str) -> int:
+    """Parse a token count such as 150000, 200k or 1m"""
+    multiplier = {'k': 1000, 'm': 1000 * 1000}.get(value[-1:].lower(), 1)
+    try:
+        count = float(value[:-1] if multiplier > 1 else value) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid token count: {value}")
+    if count <= 0:
+        raise argparse.ArgumentTypeError(f"token count must be positive: {value}")
+    return int(count)
+
+
+def _split_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def run_bench(args: argparse.Namespace) -> int:
+    """Run the benchmark suite for parsed arguments and return the exit status"""
+    import tempfile
+
+    from .benchmark import PHASES, SCALES, SHAPES, TreeSpec, compare_results, format_results, run_benchmarks
+
+    try:
+        entries = [SCALES[scale.lower()] if scale.lower() in SCALES else int(scale)
+                   for scale in _split_list(args.scales)]
+    except ValueError:
+        print(f"contextcap: error: invalid --scales: {args.scales}", file=sys.stderr)
+        return EXIT_USAGE
+    shapes = _split_list(args.shapes)
+    phases = tuple(_split_list(args.phases))
+    unknown = [name for name in shapes if name not in SHAPES] + [name for name in phases if name not in PHASES]
+    if unknown:
+        print(f"contextcap: error: unknown shape or phase: {', '.join(unknown)}", file=sys.stderr)
+        return EXIT_USAGE
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"contextcap: error: cannot read baseline: {str(e)}", file=sys.stderr)
+            return EXIT_USAGE
+
+    work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), 'contextcap-bench')
+    specs = [TreeSpec(shape, count, args.seed) for count in entries for shape in shapes]
+    results = run_benchmarks(
+        work_dir, specs, phases, max(1, args.repeat), args.format,
+        progress_callback=lambda message: print(message, file=sys.stderr),
+    )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    for line in format_results(results):
+        print(line)
+
+    if baseline is not None:
+        try:
+            lines, regressions = compare_results(baseline, results, args.threshold / 100)
+        except ValueError as e:
+            print(f"contextcap: error: {str(e)}", file=sys.stderr)
+            return EXIT_USAGE
+        print()
+        for line in lines:
+            print(line)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:g}%")
+            return EXIT_FAILURE
+    return EXIT_OK
+
+
+def check_capture_args(args: argparse.Namespace) -> Optional[str]:
+    """Return why parsed capture arguments cannot run, or None if they can"""
+    from .archive import is_archive
+
+    archive = is_archive(args.directory)
+    if not archive and not os.path.isdir(args.directory):
+        return f"not a directory or archive: {args.directory}"
+    if archive and (args.ref or args.diff_base):
+        return "--ref and --diff-base need a git repository, not an archive"
+    return None
+
+
+def open_source(args: argparse.Namespace):
+    """
+    Open the capture source that parsed capture arguments ask for.
+
+    Returns:
+        An ArchiveSource or GitSource, or None to capture the directory itself
+
+    Raises:
+        OSError: If an archive cannot be opened
+        GitError: If a ref cannot be resolved
+    """
+    from .archive import ArchiveSource, is_archive
+    from .git import GitSource
+
+    if is_archive(args.directory):
+        return ArchiveSource(args.directory, args.max_file_size * 1024)
+    if args.ref or args.diff_base:
+        return GitSource(args.directory, args.ref or 'HEAD', args.diff_base)
+    return None
+
+
+def build_capture(
+    args: argparse.Namespace,
+    cache=None,
+    source=None,
+    workers: Optional[int] = None,
+    snapshot=None,
+):
+    """Build the Capture that parsed capture arguments describe, optionally from an existing scan"""
+    from .capture import Capture
+    from .ignore import ExcludeFilter
+    from .pipeline import DEFAULT_WORKERS
+    from .planner import CapturePlanner
+    from .renderers import renderer_for
+
+    output_format = args.format or format_for_path(args.output)
+    pdf_options = {}
+    if output_format == 'pdf':
+        pdf_options = dict(
+            volume_pages=args.volume_pages,
+            volume_bytes=args.volume_size * 1024 * 1024 if args.volume_size else None,
+            monospace=not args.no_monospace,
+        )
+    if args.workers is not None:
+        workers = args.workers
+    return Capture(
+        args.directory, renderer_for(output_format, args.output, **pdf_options), snapshot, cache=cache,
+        workers=workers if workers is not None else DEFAULT_WORKERS,
+        max_file_bytes=args.max_file_size * 1024,
+        exclude=ExcludeFilter(args.exclude, use_ignore_files=not args.no_ignore_files),
+        dedup=None if args.dedup == 'off' else args.dedup,
+        planner=CapturePlanner(args.budget, prefer=args.prefer, avoid=args.avoid) if args.budget else None,
+        source=source,
+    )
+
+
+def run_batch_command(args: argparse.Namespace) -> int:
+    """Run a batch for parsed arguments and return the exit status"""
+    import time
+
+    from .batch import (
+        DEFAULT_PROCESSES, FAILED, PARTIAL, TIMED_OUT, ManifestError, build_report, format_report,
+        format_result, load_manifest, read_history, run_batch,
+    )
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except ManifestError as e:
+        print(f"contextcap: error: {str(e)}", file=sys.stderr)
+        return EXIT_USAGE
+    processes = max(1, args.processes or DEFAULT_PROCESSES)
+    report_path = args.report or os.path.splitext(args.manifest)[0] + '.report.json'
+
+    def report_result(result, done: int, total: int):
+        if not args.quiet:
+            print(f"[{done}/{total}] {format_result(result)}", file=sys.stderr)
+
+    started = time.perf_counter()
+    try:
+        results = run_batch(
+            jobs, processes, args.timeout,
+            cache_dir=args.cache_dir,
+            cache_bytes=0 if args.no_cache else args.cache_size * 1024 * 1024,
+            workers=args.workers,
+            history=read_history(report_path),
+            result_callback=report_result,
+        )
+    except KeyboardInterrupt:
+        print("contextcap: interrupted", file=sys.stderr)
+        return EXIT_CANCELLED
+    report = build_report(results, time.perf_counter() - started, processes, args.timeout,
+                          os.path.abspath(args.manifest))
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    if args.json:
+        json.dump(report, sys.stdout)
+        sys.stdout.write('\n')
+    else:
+        for line in format_report(report, args.top):
+            print(line)
+        print(f"Report written to {report_path}")
+    statuses = report['statuses']
+    if statuses[FAILED] or statuses[TIMED_OUT]:
+        return EXIT_FAILURE
+    return EXIT_PARTIAL if statuses[PARTIAL] else EXIT_OK
+
+
+def run_serve(args: argparse.Namespace) -> int:
+    """Run the capture service for parsed arguments until it is stopped"""
+    from .cache import MemoryCache, open_cache
+    from .server import DEFAULT_MAX_CAPTURES, CaptureService, serve
+
+    backing = None
+    if not args.no_cache:
+        backing = open_cache(args.cache_dir, args.cache_size * 1024 * 1024)
+        if backing is None:
+            print("contextcap: warning: content cache unavailable, continuing without it", file=sys.stderr)
+    cache = MemoryCache(backing, args.memory_cache * 1024 * 1024)
+    service = CaptureService(cache, max(1, args.max_captures or DEFAULT_MAX_CAPTURES), args.workers)
+
+    def ready(address: str, token_file: Optional[str]):
+        print(f"Serving captures on {address}", file=sys.stderr)
+        if token_file is not None:
+            print(f"Requests must send the token in {token_file} as Authorization: Bearer <token>",
+                  file=sys.stderr)
+
+    try:
+        serve(service, args.socket, args.port, ready_callback=ready, token_file=args.token_file)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"contextcap: error: {str(e)}", file=sys.stderr)
+        return EXIT_FAILURE
+    finally:
+        cache.close()
+    return EXIT_OK
+
+
+def run_capture(args: argparse.Namespace) -> int:
+    """Run a capture for parsed arguments and return the exit status"""
+    problem = check_capture_args(args)
+    if problem is not None:
+        print(f"contextcap: error: {problem}", file=sys.stderr)
+        return EXIT_USAGE
+
+    from .cache import open_cache
+    from .metrics import CaptureMetrics
+
+    def report_error(message: str):
+        if not args.quiet:
+            print(message, file=sys.stderr)
+
+    cache = None
+    if not args.no_cache:
+        cache = open_cache(args.cache_dir, args.cache_size * 1024 * 1024)
+        if cache is None:
+            report_error("contextcap: warning: content cache unavailable, continuing without it")
+
+    metrics = None
+    metrics_path = args.metrics
+    if metrics_path is not None or args.profile or args.trace_memory:
+        metrics = CaptureMetrics(profile=args.profile, trace_memory=args.trace_memory)
+        if not metrics_path:
+            metrics_path = os.path.splitext(args.output)[0] + '.metrics.json'
+
+    source = None
+    try:
+        source = open_source(args)
+        capture = build_capture(args, cache, source)
+        summary = capture.run(error_callback=report_error, metrics=metrics)
+        if metrics is not None:
+            metrics.write(metrics_path, args.top)
+            if args.profile:
+                metrics.dump_profile(os.path.splitext(metrics_path)[0] + '.prof')
+    except KeyboardInterrupt:
+        if args.json:
+            json.dump({'status': 'cancelled'}, sys.stdout)
+            sys.stdout.write('\n')
+        print("contextcap: interrupted", file=sys.stderr)
+        return EXIT_CANCELLED
+    except Exception as e:
+        if args.json:
+            json.dump({'status': 'failed', 'error': str(e)}, sys.stdout)
+            sys.stdout.write('\n')
+        print(f"contextcap: error: {str(e)}", file=sys.stderr)
+        return EXIT_FAILURE
+    finally:
+        if source is not None:
+            source.close()
+        if cache is not None:
+            cache.close()
+
+    status = EXIT_PARTIAL if summary.errors else EXIT_OK
+    if args.json:
+        result = summary.to_dict()
+        result['status'] = 'partial' if summary.errors else 'ok'
+        if metrics is not None:
+            result['metrics'] = metrics.to_dict(args.top, include_files=False)
+            result['metrics_path'] = metrics_path
+        json.dump(result, sys.stdout)
+        sys.stdout.write('\n')
+    else:
+        volumes = f" ({len(summary.volumes)} volumes)" if summary.volumes else ""
+        print(f"Captured {summary.files} files ({summary.text_files} text, "
+              f"{summary.binary_files} binary"
+              + (f", {summary.duplicates} duplicates" if summary.duplicates else "")
+              + f") to {summary.output_path}{volumes} "
+              f"in {summary.elapsed:.2f}s"
+              + (f" with {len(summary.errors)} errors" if summary.errors else ""))
+        if args.budget:
+            print(f"Planned ~{summary.estimated_tokens} of {args.budget} tokens; "
+                  f"{summary.skipped} files skipped")
+        if metrics is not None:
+            for line in metrics.report(args.top):
+                print(line)
+            print(f"Metrics written to {metrics_path}")
+    return status
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point for ``python -m contextcap``"""
+    args = build_parser().parse_args(argv)
+    if args.command == 'capture':
+        return run_capture(args)
+    if args.command == 'batch':
+        return run_batch_command(args)
+    if args.command == 'serve':
+        return run_serve(args)
+    if args.command == 'bench':
+        return run_bench(args)
+    return EXIT_USAGE
@@ -0,0 +1,315 @@
+"""
+File classification and content loading for ConTextCap.
+
+Turns a scanned file into the lines a renderer writes out, so the result can
+be cached and reused between captures.
+
+Files are classified by sniffing their first few kilobytes rather than by
+name: NUL bytes or invalid UTF-8 mean binary, and very long lines or
+generator markers mean minified or generated output. Text files larger than
+the size cap are read through mmap and only their head and tail are kept.
+"""
+
+import codecs
+import hashlib
+import mimetypes
+import mmap
+import os
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from .scanner import ScanEntry
+
+# Content kinds
+TEXT = 'text'
+BINARY = 'binary'
+GENERATED = 'generated'
+UNDECODABLE = 'undecodable'
+# Set by the capture, never by loading: the content was already captured
+DUPLICATE = 'duplicate'
+NEAR_DUPLICATE = 'near-duplicate'  # same apart from whitespace
+
+# Bytes read from the start of a file to classify it
+SNIFF_SIZE = 8192
+
+# Text files larger than this are truncated to their head and tail
+DEFAULT_MAX_FILE_BYTES = 1024 * 1024
+
+# Largest read when passing over the middle of a streamed file
+SKIP_CHUNK_SIZE = 1024 * 1024
+
+# A line this long in the sniffed sample marks minified output
+MINIFIED_LINE_LENGTH = 1000
+
+# Markers in the first lines of a file that flag generated code
+GENERATED_MARKERS = ('@generated', 'DO NOT EDIT', 'auto-generated', 'autogenerated')
+GENERATED_MARKER_LINES = 5
+
+# MIME types that are never worth sniffing
+BINARY_MIME_PREFIXES = ('image/', 'audio/', 'video/', 'font/')
+BINARY_MIME_TYPES = frozenset({
+    'application/zip', 'application/gzip', 'application/x-tar', 'application/x-bzip2',
+    'application/x-7z-compressed', 'application/x-rar-compressed', 'application/pdf',
+    'application/octet-stream', 'application/java-archive', 'application/x-sqlite3',
+    'application/vnd.ms-excel', 'application/msword', 'application/x-msdownload',
+})
+
+
+class FileContent(NamedTuple):
+    """Classification and decoded lines of a single file"""
+    kind: str
+    lines: Tuple[str, ...] = ()
+    duplicate_of: str = ''  # relative path of the first copy, for (near) duplicates
+
+
+@lru_cache(maxsize=None)
+def extension_kind(suffix: str) -> Optional[str]:
+    """
+    Classify a file by extension alone, where that is safe.
+
+    Args:
+        suffix: Lower-case file extension including the dot
+
+    Returns:
+        BINARY for media and archive types, None if the content must be sniffed
+    """
+    mime_type, _ = mimetypes.guess_type('file' + suffix)
+    if mime_type and (mime_type.startswith(BINARY_MIME_PREFIXES) or mime_type in BINARY_MIME_TYPES):
+        return BINARY
+    return None
+
+
+def classify_sample(sample: bytes, complete: bool) -> str:
+    """
+    Classify a file from the first bytes of its content.
+
+    Args:
+        sample: Up to SNIFF_SIZE bytes from the start of the file
+        complete: True if the sample is the whole file
+
+    Returns:
+        TEXT, BINARY or GENERATED
+    """
+    if b'\0' in sample:
+        return BINARY
+    try:
+        text = codecs.getincrementaldecoder('utf-8')().decode(sample, final=complete)
+    except UnicodeDecodeError:
+        return BINARY
+
+    lines = text.split('\n')
+    if not complete:
+        # The last line may continue past the sample
+        if len(lines) == 1 and len(sample) >= MINIFIED_LINE_LENGTH:
+            return GENERATED
+        lines.pop()
+    if any(len(line) > MINIFIED_LINE_LENGTH for line in lines):
+        return GENERATED
+    head = '\n'.join(lines[:GENERATED_MARKER_LINES])
+    if any(marker in head for marker in GENERATED_MARKERS):
+        return GENERATED
+    return TEXT
+
+
+def decode_text(data: bytes) -> FileContent:
+    """
+    Decode raw file bytes into lines.
+
+    Newlines are translated the same way as reading in text mode.
+    """
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return FileContent(UNDECODABLE)
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return FileContent(TEXT, tuple(text.split('\n')))
+
+
+def cut_head_tail(data, size: int, max_bytes: int) -> Tuple[bytes, bytes]:
+    """
+    Take roughly max_bytes from the start and end of a large buffer.
+
+    Both parts are cut at line boundaries, so multi-byte characters are never
+    split.
+    """
+    half = max_bytes // 2
+    return trim_head_tail(data[:half], data[size - half:])
+
+
+def trim_head_tail(head: bytes, tail: bytes) -> Tuple[bytes, bytes]:
+    """Cut a head after its last newline and a tail after its first"""
+    head = head[:head.rfind(b'\n') + 1] or head
+    newline = tail.find(b'\n')
+    if newline >= 0:
+        tail = tail[newline + 1:]
+    return head, tail
+
+
+def read_head_tail(fileno: int, size: int, max_bytes: int) -> Tuple[bytes, bytes]:
+    """Read roughly max_bytes from the start and end of a large file via mmap"""
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mm:
+        return cut_head_tail(mm, size, max_bytes)
+
+
+def decode_head_tail(size: int, head: bytes, tail: bytes) -> FileContent:
+    """Decode the head and tail of a large file, with a marker for the bytes left out"""
+    content = decode_text(head)
+    if content.kind != TEXT:
+        return content
+    tail_content = decode_text(tail)
+    if tail_content.kind != TEXT:
+        return tail_content
+    omitted = size - len(head) - len(tail)
+    marker = f"[... {omitted} bytes omitted ...]"
+    # The head ends with a newline, so its last line is empty
+    return FileContent(TEXT, content.lines[:-1] + (marker,) + tail_content.lines)
+
+
+def content_digest(data: bytes) -> str:
+    """Hash file contents for cache lookups"""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def load_file_content(
+    entry: ScanEntry,
+    cache=None,
+    max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+) -> FileContent:
+    """
+    Classify a file and load its lines.
+
+    Args:
+        entry: Scanned file to load
+        cache: Optional ContentCache consulted before doing any work
+        max_bytes: Text files larger than this keep only their head and tail
+
+    Returns:
+        FileContent: The file's kind and, for text files, its lines
+
+    Raises:
+        OSError: If the file cannot be read
+    """
+    if cache is not None:
+        # A snapshot kept open in the GUI may be older than the file
+        stat = os.stat(entry.path)
+        if stat.st_size == entry.size and stat.st_mtime == entry.mtime:
+            cached = cache.lookup(entry, max_bytes)
+            if cached is not None:
+                return cached
+
+    def remember(content: FileContent, digest: Optional[str] = None) -> FileContent:
+        if cache is not None:
+            cache.store(entry, content, max_bytes, digest)
+        return content
+
+    if extension_kind(os.path.splitext(entry.name)[1].lower()) == BINARY:
+        return remember(FileContent(BINARY))
+
+    with open(entry.path, 'rb') as f:
+        # One byte past the sample tells whether the sample is the whole file
+        sample = f.read(SNIFF_SIZE + 1)
+        kind = classify_sample(sample[:SNIFF_SIZE], complete=len(sample) <= SNIFF_SIZE)
+        if kind != TEXT:
+            return remember(FileContent(kind))
+
+        size = os.fstat(f.fileno()).st_size
+        if size <= max_bytes:
+            data, tail = sample + f.read(), None
+        else:
+            data, tail = read_head_tail(f.fileno(), size, max_bytes)
+
+    digest: Optional[str] = None
+    if cache is not None:
+        if tail is None:
+            digest = content_digest(data)
+        else:
+            digest = content_digest(b'%d\0%s\0%s' % (size, data, tail))
+        cached = cache.lookup_digest(entry, digest, max_bytes)
+        if cached is not None:
+            return cached
+
+    if tail is None:
+        content = decode_text(data)
+    else:
+        content = decode_head_tail(size, data, tail)
+    return remember(content, digest)
+
+
+def content_from_bytes(name: str, data: bytes, max_bytes: int = DEFAULT_MAX_FILE_BYTES) -> FileContent:
+    """
+    Classify and decode a file that is already in memory.
+
+    Used for sources other than the file system, such as git objects and
+    archive members; the result is the same as load_file_content would give
+    for a file with this name and content.
+    """
+    if extension_kind(os.path.splitext(name)[1].lower()) == BINARY:
+        return FileContent(BINARY)
+    sample = data[:SNIFF_SIZE]
+    kind = classify_sample(sample, complete=len(data) <= SNIFF_SIZE)
+    if kind != TEXT:
+        return FileContent(kind)
+    if len(data) <= max_bytes:
+        return decode_text(data)
+    return decode_head_tail(len(data), *cut_head_tail(data, len(data), max_bytes))
+
+
+def content_from_stream(
+    name: str,
+    read: Callable[[int], bytes],
+    size: int,
+    max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+    skip: Optional[Callable[[int], None]] = None,
+) -> FileContent:
+    """
+    Classify and decode a file read front to back from a stream.
+
+    Gives the same result as content_from_bytes, but holds no more than the
+    sample and the head and tail that are kept: `read(n)` returns up to n more
+    bytes of the file, which is `size` bytes long, and the middle of a large
+    file is passed over with `skip(n)`, or read in chunks and dropped. Nothing
+    past `size` is read, so the caller can drain a shared stream afterwards.
+
+    Raises:
+        EOFError: If the stream ends before `size` bytes
+    """
+    if extension_kind(os.path.splitext(name)[1].lower()) == BINARY:
+        return FileContent(BINARY)
+    position = 0
+
+    def take(count: int) -> bytes:
+        nonlocal position
+        count = min(count, size - position)
+        parts = []
+        while count > 0:
+            chunk = read(count)
+            if not chunk:
+                raise EOFError(f"{name} ends after {position} of {size} bytes")
+            parts.append(chunk)
+            position += len(chunk)
+            count -= len(chunk)
+        return b''.join(parts)
+
+    sample = take(SNIFF_SIZE + 1)
+    kind = classify_sample(sample[:SNIFF_SIZE], complete=len(sample) <= SNIFF_SIZE)
+    if kind != TEXT:
+        return FileContent(kind)
+    if size <= max_bytes:
+        return decode_text(sample + take(size))
+
+    half = max_bytes // 2
+    data = sample + take(half - len(sample))
+    head = data[:half]
+    tail_start = size - half
+    if len(data) >= tail_start:
+        tail = data[tail_start:] + take(size)
+    else:
+        del data
+        if skip is not None:
+            skip(tail_start - position)
+            position = tail_start
+        else:
+            while position < tail_start:
+                take(min(SKIP_CHUNK_SIZE, tail_start - position))
+        tail = take(half)
+    return decode_head_tail(size, *trim_head_tail(head, tail))
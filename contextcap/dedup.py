@@ -0,0 +1,94 @@
+"""
+Duplicate detection for ConTextCap.
+
+Vendored copies, duplicated configs and generated stubs often appear many
+times in one codebase. The ingestion workers hash every text file as it is
+loaded; the capture then renders the first file with a given content in
+full and every later copy as a one-line reference to it.
+"""
+
+from typing import Dict, Optional, Tuple
+
+from .content import DUPLICATE, NEAR_DUPLICATE, TEXT, FileContent, content_digest
+from .renderers import FileResult
+from .scanner import ScanEntry
+
+# Matching modes
+EXACT = 'exact'
+WHITESPACE = 'whitespace'  # also match files that differ only in whitespace
+DEDUP_MODES = (EXACT, WHITESPACE)
+
+# Smaller files are always rendered; a reference would not be any shorter
+MIN_DUPLICATE_BYTES = 128
+
+
+def normalize_whitespace(lines: Tuple[str, ...]) -> str:
+    """Collapse runs of whitespace and drop blank lines"""
+    return '\n'.join(' '.join(line.split()) for line in lines if line and not line.isspace())
+
+
+class Deduplicator:
+    """
+    Finds files whose content was already captured.
+
+    digest() is called on the ingestion threads, in any order; resolve() is
+    called by the capture in snapshot order, so the first copy in the output
+    is always the one rendered in full.
+    """
+
+    def __init__(self, mode: str = EXACT, min_bytes: int = MIN_DUPLICATE_BYTES, max_bytes: Optional[int] = None):
+        """
+        Create an empty duplicate index.
+
+        Args:
+            mode: EXACT, or WHITESPACE to also treat files that differ only in
+                whitespace as duplicates
+            min_bytes: Files smaller than this are never deduplicated
+            max_bytes: The size cap the files were loaded with; larger files
+                kept only their head and tail, so two of them can match
+                without being the same and they are never deduplicated
+        """
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown deduplication mode: {mode}")
+        self.mode = mode
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.duplicates = 0
+        self.saved_bytes = 0
+        # Hashes by snapshot index, from digest() until resolve()
+        self._digests: Dict[int, Tuple[str, str]] = {}
+        # First file for each content: key -> (relative path, exact hash)
+        self._first: Dict[str, Tuple[str, str]] = {}
+
+    def digest(self, entry: ScanEntry, content: FileResult):
+        """Hash a loaded file; only whole text files of at least min_bytes are considered"""
+        if isinstance(content, Exception) or content.kind != TEXT or entry.size < self.min_bytes:
+            return
+        if self.max_bytes is not None and entry.size > self.max_bytes:
+            return
+        exact = content_digest('\n'.join(content.lines).encode('utf-8'))
+        key = exact
+        if self.mode == WHITESPACE:
+            key = content_digest(normalize_whitespace(content.lines).encode('utf-8'))
+        self._digests[entry.index] = (key, exact)
+
+    def resolve(self, entry: ScanEntry, content: FileResult) -> FileResult:
+        """
+        Return the content to render for a file.
+
+        Returns:
+            A DUPLICATE or NEAR_DUPLICATE reference if an earlier file had the
+            same content, otherwise the content unchanged
+        """
+        digests = self._digests.pop(entry.index, None)
+        if digests is None:
+            return content
+        key, exact = digests
+        first = self._first.get(key)
+        if first is None:
+            self._first[key] = (entry.rel_path, exact)
+            return content
+        self.duplicates += 1
+        self.saved_bytes += entry.size
+        kind = DUPLICATE if first[1] == exact else NEAR_DUPLICATE
+        return FileContent(kind, duplicate_of=first[0])
@@ -0,0 +1,249 @@
+"""
+Git capture source for ConTextCap.
+
+Captures a commit, branch or tag straight from a local repository's object
+database: the tree comes from `git ls-tree` and file contents are streamed
+from one long-running `git cat-file --batch` process, so nothing is checked
+out. In diff mode only the files added or modified since a base ref are
+captured, while the directory tree still shows the whole commit.
+"""
+
+import os
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .content import (
+    BINARY, DEFAULT_MAX_FILE_BYTES, SKIP_CHUNK_SIZE, FileContent, content_from_stream, extension_kind,
+)
+from .ignore import ExcludeFilter
+from .metrics import CaptureMetrics
+from .progress import CancelToken
+from .scanner import ListingEntry, ScanEntry, ScanSnapshot, snapshot_from_listing
+from .sources import CaptureSource
+
+# Tree entry modes
+MODE_TREE = '040000'
+MODE_SYMLINK = '120000'
+MODE_SUBMODULE = '160000'
+
+# Notes shown in the directory tree in diff mode, by diff status letter
+CHANGE_NOTES = {'A': '[added]', 'M': '[modified]', 'T': '[type changed]'}
+
+
+class GitError(Exception):
+    """Raised when a git command fails"""
+
+
+class GitSource(CaptureSource):
+    """
+    Reads a capture from a git ref without a checkout.
+
+    If repo_path is a subdirectory of the work tree, only that subdirectory
+    is captured, as with a directory capture. Ignore files committed in the
+    tree are honored; .git/info/exclude is not, since it describes the work
+    tree rather than the commit.
+    """
+
+    def __init__(self, repo_path: str, ref: str = 'HEAD', base: Optional[str] = None, git: str = 'git'):
+        """
+        Resolve the refs to capture.
+
+        Args:
+            repo_path: Repository, or a directory inside its work tree
+            ref: Commit, branch or tag to capture
+            base: In diff mode, the ref to compare with; files are compared
+                against the merge base of base and ref, like `git diff base...ref`
+            git: The git executable
+
+        Raises:
+            GitError: If git is missing or a ref does not name a commit
+        """
+        self.repo_path = repo_path
+        self.ref = ref
+        self.base = base
+        self.git = git
+        self._run('rev-parse', '--git-dir')  # fails with git's own message outside a repository
+        self.commit = self._resolve(ref)
+        self.commit_time = float(self._run('show', '-s', '--format=%ct', self.commit).strip())
+        self.base_commit: Optional[str] = None
+        if base is not None:
+            try:
+                self.base_commit = self._run('merge-base', self._resolve(base), self.commit).strip()
+            except GitError:
+                raise GitError(f"{base} and {ref} have no common history")
+
+        self.snapshot: Optional[ScanSnapshot] = None
+        self._objects: List[Optional[str]] = []  # object id of each snapshot entry
+        self._changes: Dict[int, str] = {}  # diff status of changed files, by snapshot index
+        self._batch: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    @property
+    def title(self) -> str:
+        name = os.path.basename(os.path.abspath(self.repo_path))
+        if self.base is not None:
+            return f"{name}@{self.base}...{self.ref}"
+        return f"{name}@{self.ref}"
+
+    def _run(self, *args: str) -> str:
+        """Run a git command in the repository and return its output"""
+        try:
+            result = subprocess.run(
+                [self.git, '-C', self.repo_path, *args],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False,
+            )
+        except OSError as e:
+            raise GitError(f"Cannot run git: {str(e)}")
+        if result.returncode != 0:
+            message = result.stderr.decode('utf-8', errors='replace').strip()
+            raise GitError(message or f"git {args[0]} failed with status {result.returncode}")
+        return result.stdout.decode('utf-8', errors='surrogateescape')
+
+    def _resolve(self, ref: str) -> str:
+        """Return the commit id a ref names"""
+        try:
+            return self._run('rev-parse', '--verify', '--quiet', f'{ref}^{{commit}}').strip()
+        except GitError:
+            raise GitError(f"Not a commit in {self.repo_path}: {ref}")
+
+    def _list_tree(self, commit: str) -> ListingEntry:
+        """Read the full tree of a commit below repo_path"""
+        root = ListingEntry('', f"{os.path.abspath(self.repo_path)}@{self.ref}", is_dir=True)
+        output = self._run('ls-tree', '-r', '-t', '-l', '-z', commit)
+        for record in output.split('\0'):
+            if not record:
+                continue
+            info, path = record.split('\t', 1)
+            mode, _, object_id, size = info.split()
+            if mode == MODE_SUBMODULE:
+                continue
+            if mode == MODE_TREE:
+                root.add(path, is_dir=True)
+            else:
+                root.add(path, size=int(size), mtime=self.commit_time, key=object_id,
+                         symlink=mode == MODE_SYMLINK)
+        return root
+
+    def _changed_paths(self) -> Dict[str, str]:
+        """Map the paths added or modified since the merge base to their diff status"""
+        output = self._run(
+            'diff-tree', '-r', '-z', '--no-renames', '--relative', '--diff-filter=AMT',
+            self.base_commit, self.commit,
+        )
+        fields = output.split('\0')
+        # Records are ":<modes> <ids> <status>" followed by the path
+        return {path: info.split()[-1][0] for info, path in zip(fields[0::2], fields[1::2]) if path}
+
+    def scan(
+        self,
+        exclude: Optional[ExcludeFilter] = None,
+        error_callback: Optional[Callable[[str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+        metrics: Optional[CaptureMetrics] = None,
+    ) -> ScanSnapshot:
+        started = time.perf_counter()
+        root = self._list_tree(self.commit)
+
+        def read_lines(entry: ListingEntry) -> List[str]:
+            return self._read_object(entry.key).decode('utf-8', errors='replace').splitlines(True)
+
+        snapshot, self._objects = snapshot_from_listing(
+            root, exclude, read_lines, cancel, scanned_at=self.commit_time)
+        self.snapshot = snapshot
+
+        self._changes = {}
+        if self.base_commit is not None:
+            changed = self._changed_paths()
+            for entry in snapshot.files():
+                status = changed.get('/'.join(entry.parts))
+                if status is not None:
+                    self._changes[entry.index] = status
+
+        if metrics is not None:
+            metrics.add_phase('scan', time.perf_counter() - started)
+            metrics.count('entries', len(snapshot))
+            metrics.count('directories', len(snapshot) - len(snapshot.files()))
+        return snapshot
+
+    def files(self, snapshot: ScanSnapshot) -> List[ScanEntry]:
+        if self.base_commit is None:
+            return snapshot.files()
+        return [snapshot[index] for index in sorted(self._changes)]
+
+    def notes(self, snapshot: ScanSnapshot) -> Dict[int, str]:
+        return {index: CHANGE_NOTES[status] for index, status in self._changes.items()}
+
+    def _request(self, object_id: str) -> int:
+        """Ask the shared cat-file process for an object and return its size; needs the lock"""
+        if self._batch is None:
+            try:
+                self._batch = subprocess.Popen(
+                    [self.git, '-C', self.repo_path, 'cat-file', '--batch'],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                )
+            except OSError as e:
+                raise GitError(f"Cannot run git: {str(e)}")
+        self._batch.stdin.write(object_id.encode('ascii') + b'\n')
+        self._batch.stdin.flush()
+        header = self._batch.stdout.readline().split()
+        if len(header) != 3:
+            raise OSError(f"Object {object_id} is missing from the repository")
+        return int(header[2])
+
+    def _read_object(self, object_id: str) -> bytes:
+        """Read a whole object, such as an ignore file, through the shared cat-file process"""
+        with self._lock:
+            size = self._request(object_id)
+            data = self._batch.stdout.read(size)
+            self._batch.stdout.read(1)  # newline after the content
+            return data
+
+    def _load_object(self, object_id: str, name: str, max_bytes: int) -> FileContent:
+        """Classify and decode a blob as it is read, keeping at most max_bytes of it"""
+        with self._lock:
+            size = self._request(object_id)
+            stdout = self._batch.stdout
+            remaining = size
+
+            def read(count: int) -> bytes:
+                nonlocal remaining
+                data = stdout.read(count)
+                remaining -= len(data)
+                return data
+
+            try:
+                return content_from_stream(name, read, size, max_bytes)
+            finally:
+                # Whatever was not needed must still be consumed before the next request
+                while remaining > 0 and read(min(SKIP_CHUNK_SIZE, remaining)):
+                    pass
+                stdout.read(1)  # newline after the content
+
+    def load(
+        self,
+        entry: ScanEntry,
+        cache=None,
+        max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+    ) -> FileContent:
+        """
+        Load a file from its blob.
+
+        Blobs never change and are cheap to read, so the content cache is not
+        used. Only the head and tail of a large blob are kept while it streams
+        from git.
+        """
+        if entry.snapshot is not self.snapshot:
+            raise ValueError("Entry does not belong to this source's snapshot")
+        if extension_kind(os.path.splitext(entry.name)[1].lower()) == BINARY:
+            return FileContent(BINARY)  # not worth reading from git at all
+        return self._load_object(self._objects[entry.index], entry.name, max_bytes)
+
+    def close(self):
+        with self._lock:
+            if self._batch is not None:
+                self._batch.stdin.close()
+                self._batch.wait()
+                self._batch.stdout.close()
+                self._batch = None
@@ -0,0 +1,313 @@
+"""
+Exclusion rules for ConTextCap.
+
+Compiles the built-in defaults, user-supplied patterns and any .gitignore /
+.ignore files found while scanning into regular expressions, so a whole
+directory can be rejected before it is ever listed. Patterns use gitignore
+syntax: `*`, `?`, `[...]`, `**`, a leading `/` to anchor, a trailing `/`
+for directories only and `!` to re-include.
+"""
+
+import os
+import re
+from typing import Callable, Iterable, List, Optional, Pattern, Sequence, Tuple
+
+# Directory names that are never descended into
+EXCLUDED_DIRS = frozenset({
+    '.git', '__pycache__', 'node_modules', '.idea', 'venv', '.pytest_cache', '.vscode'
+})
+
+# Per-directory ignore files, in increasing order of precedence
+IGNORE_FILES = ('.gitignore', '.ignore')
+
+
+class IgnoreRule:
+    """A single compiled gitignore pattern"""
+    __slots__ = ('regex', 'negate', 'dir_only', 'anchored')
+
+    def __init__(self, regex: str, negate: bool, dir_only: bool, anchored: bool):
+        self.regex = re.compile(regex)
+        self.negate = negate
+        self.dir_only = dir_only
+        self.anchored = anchored
+
+    def matches(self, rel_path: str, name: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        return self.regex.match(rel_path if self.anchored else name) is not None
+
+
+def _segment_regex(segment: str) -> str:
+    """Translate one path segment of a glob into a regular expression"""
+    out = []
+    i, n = 0, len(segment)
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '\\' and i < n:
+            out.append(re.escape(segment[i]))
+            i += 1
+        elif c == '[':
+            end = segment.find(']', i + 1 if segment[i:i + 1] in ('!', '^') else i)
+            if end < 0:
+                out.append(re.escape(c))
+                continue
+            body = segment[i:end]
+            i = end + 1
+            if body[:1] in ('!', '^'):
+                body = '^' + body[1:]
+            out.append('[' + body.replace('\\', '\\\\') + ']')
+        else:
+            out.append(re.escape(c))
+    return ''.join(out)
+
+
+def glob_to_regex(pattern: str) -> str:
+    """Translate a slash-separated glob (with ** support) into a regular expression"""
+    segments = pattern.split('/')
+    out = []
+    for k, segment in enumerate(segments):
+        last = k == len(segments) - 1
+        if segment == '**':
+            out.append('.*' if last else '(?:[^/]*/)*')
+            continue
+        out.append(_segment_regex(segment))
+        if not last:
+            out.append('/')
+    return r'\A' + ''.join(out) + r'\Z'
+
+
+def parse_pattern(line: str) -> Optional[IgnoreRule]:
+    """
+    Compile one line of a gitignore file.
+
+    Returns:
+        The rule, or None for blank lines and comments
+    """
+    line = line.rstrip('\r\n')
+    # Trailing spaces are ignored unless escaped
+    stripped = line.rstrip(' ')
+    if stripped.endswith('\\') and len(stripped) < len(line):
+        stripped += ' '
+    line = stripped
+    if not line or line.startswith('#'):
+        return None
+
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    elif line.startswith(('\\!', '\\#')):
+        line = line[1:]
+
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    anchored = '/' in line
+    line = line.lstrip('/')
+    return IgnoreRule(glob_to_regex(line), negate, dir_only, anchored)
+
+
+class IgnoreRules:
+    """
+    The compiled patterns of one source, relative to a base directory.
+
+    Sources without `!` patterns are merged into a handful of combined
+    expressions, so checking an entry is a few regex calls however many
+    patterns there are.
+    """
+    __slots__ = ('base', 'rules', '_combined')
+
+    def __init__(self, patterns: Iterable[str], base: str = ''):
+        """
+        Compile patterns.
+
+        Args:
+            patterns: Lines in gitignore syntax
+            base: Directory the patterns are relative to, '/'-separated,
+                '' for the scan root
+        """
+        self.base = base
+        self.rules: List[IgnoreRule] = [
+            rule for rule in map(parse_pattern, patterns) if rule is not None
+        ]
+        self._combined: Optional[Tuple[Optional[Pattern], ...]] = None
+        if not any(rule.negate for rule in self.rules):
+            self._combined = tuple(
+                self._combine(rule for rule in self.rules
+                              if rule.anchored == anchored and rule.dir_only == dir_only)
+                for anchored in (False, True)
+                for dir_only in (False, True)
+            )
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    @staticmethod
+    def _combine(rules: Iterable[IgnoreRule]) -> Optional[Pattern]:
+        expressions = [rule.regex.pattern for rule in rules]
+        if not expressions:
+            return None
+        return re.compile('|'.join(f'(?:{expression})' for expression in expressions))
+
+    def match(self, rel_path: str, name: str, is_dir: bool) -> Optional[bool]:
+        """
+        Check an entry against these rules.
+
+        Args:
+            rel_path: '/'-separated path relative to the scan root
+            name: Final path component
+            is_dir: Whether the entry is a directory
+
+        Returns:
+            True if ignored, False if re-included by a `!` pattern, None if no
+            pattern matches
+        """
+        if self.base:
+            if not rel_path.startswith(self.base + '/'):
+                return None
+            rel_path = rel_path[len(self.base) + 1:]
+
+        if self._combined is not None:
+            name_any, name_dir, path_any, path_dir = self._combined
+            if ((name_any and name_any.match(name))
+                    or (path_any and path_any.match(rel_path))
+                    or (is_dir and ((name_dir and name_dir.match(name))
+                                    or (path_dir and path_dir.match(rel_path))))):
+                return True
+            return None
+
+        # Last matching pattern wins
+        for rule in reversed(self.rules):
+            if rule.matches(rel_path, name, is_dir):
+                return not rule.negate
+        return None
+
+
+def read_ignore_file(path: str, base: str = '') -> IgnoreRules:
+    """Compile an ignore file; unreadable files yield no rules"""
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return IgnoreRules(f.readlines(), base)
+    except OSError:
+        return IgnoreRules((), base)
+
+
+class ExcludeFilter:
+    """
+    Decides which entries a scan skips.
+
+    Precedence, from highest to lowest: ignore files in deeper directories,
+    ignore files in their parents, the repository's .git/info/exclude, user
+    patterns and finally the built-in defaults. Hidden files are always
+    skipped unless a pattern re-includes them.
+    """
+
+    def __init__(self, patterns: Iterable[str] = (), use_ignore_files: bool = True):
+        """
+        Compile the fixed part of the filter.
+
+        Args:
+            patterns: User exclude patterns in gitignore syntax
+            use_ignore_files: Whether to read .gitignore/.ignore files
+        """
+        self.patterns = tuple(patterns)
+        self.use_ignore_files = use_ignore_files
+        self.base_rules: Tuple[IgnoreRules, ...] = tuple(
+            rules for rules in (
+                IgnoreRules(f'{name}/' for name in sorted(EXCLUDED_DIRS)),
+                IgnoreRules(self.patterns),
+            ) if rules
+        )
+
+    def root_rules(self, root_path: str) -> Tuple[IgnoreRules, ...]:
+        """Return the rules in force at the scan root"""
+        rules = self.base_rules
+        if self.use_ignore_files:
+            info_exclude = read_ignore_file(os.path.join(root_path, '.git', 'info', 'exclude'))
+            if info_exclude:
+                rules += (info_exclude,)
+        return rules
+
+    def directory_rules(
+        self,
+        dir_path: str,
+        rel_dir: str,
+        child_names: Iterable[str],
+        inherited: Tuple[IgnoreRules, ...],
+    ) -> Tuple[IgnoreRules, ...]:
+        """
+        Extend the inherited rules with a directory's own ignore files.
+
+        Args:
+            dir_path: Directory on disk
+            rel_dir: '/'-separated path of the directory relative to the root
+            child_names: Names listed in the directory
+            inherited: Rules in force in the parent directory
+        """
+        def read_lines(name: str) -> List[str]:
+            with open(os.path.join(dir_path, name), 'r', encoding='utf-8', errors='replace') as f:
+                return f.readlines()
+
+        return self.listing_rules(rel_dir, child_names, inherited, read_lines)
+
+    def listing_rules(
+        self,
+        rel_dir: str,
+        child_names: Iterable[str],
+        inherited: Tuple[IgnoreRules, ...],
+        read_lines: Callable[[str], List[str]],
+    ) -> Tuple[IgnoreRules, ...]:
+        """
+        Extend the inherited rules with ignore files read through a callback.
+
+        Like directory_rules, for listings that do not come from the file
+        system, such as git trees and archives.
+
+        Args:
+            rel_dir: '/'-separated path of the directory relative to the root
+            child_names: Names listed in the directory
+            inherited: Rules in force in the parent directory
+            read_lines: Returns the lines of an ignore file in the directory
+                by name; may raise OSError
+        """
+        if not self.use_ignore_files:
+            return inherited
+        present = [name for name in IGNORE_FILES if name in child_names]
+        if not present:
+            return inherited
+        # .ignore is read after .gitignore so its patterns take precedence
+        lines: List[str] = []
+        for name in present:
+            try:
+                lines.extend(read_lines(name))
+            except OSError:
+                continue
+        rules = IgnoreRules(lines, rel_dir)
+        return inherited + (rules,) if rules else inherited
+
+    @staticmethod
+    def is_excluded(
+        rules: Sequence[IgnoreRules],
+        rel_path: str,
+        name: str,
+        is_dir: bool,
+    ) -> bool:
+        """
+        Decide whether an entry is skipped.
+
+        Args:
+            rules: Rules in force in the entry's directory, lowest precedence first
+            rel_path: '/'-separated path relative to the scan root
+            name: Final path component
+            is_dir: Whether the entry is a directory
+        """
+        for source in reversed(rules):
+            decision = source.match(rel_path, name, is_dir)
+            if decision is not None:
+                return decision
+        return not is_dir and name.startswith('.')
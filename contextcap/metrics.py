@@ -0,0 +1,173 @@
+"""
+Capture instrumentation for ConTextCap.
+
+A CaptureMetrics object passed to a scan or capture collects wall-clock time
+per phase and, for every file, its size, lines, pages, load time (read,
+classify and decode on an ingestion thread) and render time. Nothing is
+measured when no metrics object is passed.
+
+For deeper digging, CaptureMetrics can also run the capture under cProfile
+and tracemalloc. Both only see the capture thread, not the ingestion
+workers, and slow the capture down considerably.
+"""
+
+import json
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+# Functions listed from the profile in the JSON output
+PROFILE_TOP = 25
+# Allocation sites listed from tracemalloc in the JSON output
+MEMORY_TOP = 15
+
+
+class FileMetrics(NamedTuple):
+    """Measurements for one captured file"""
+    path: str
+    bytes: int
+    kind: str  # content kind, or 'error'
+    lines: int
+    pages: int
+    load_seconds: float
+    render_seconds: float
+
+    @property
+    def seconds(self) -> float:
+        return self.load_seconds + self.render_seconds
+
+
+class CaptureMetrics:
+    """
+    Per-phase timings and per-file measurements of a scan or capture.
+
+    Phases of a capture: scan (only if no snapshot was given), plan (fitting
+    a token budget, only if one was given), begin (title and tree layout),
+    wait (blocked on ingestion), render, finish (serializing the output) and
+    total.
+    """
+
+    def __init__(self, profile: bool = False, trace_memory: bool = False):
+        """
+        Create an empty metrics collector.
+
+        Args:
+            profile: Run the capture under cProfile
+            trace_memory: Track allocations with tracemalloc
+        """
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.files: List[FileMetrics] = []
+        self.profiler = None
+        self.memory_peak: Optional[int] = None
+        self.memory_top: List[str] = []
+
+    def add_phase(self, name: str, seconds: float):
+        """Add time to a phase"""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int):
+        """Record a counter, e.g. the number of entries scanned"""
+        self.counters[name] = value
+
+    def add_file(self, metrics: FileMetrics):
+        self.files.append(metrics)
+
+    def slowest(self, count: int = 10) -> List[FileMetrics]:
+        """Return the files that took longest to load and render"""
+        return sorted(self.files, key=lambda file: file.seconds, reverse=True)[:count]
+
+    def start_profiling(self):
+        """Start the opt-in profilers for the calling thread"""
+        if self.profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    def stop_profiling(self):
+        """Stop the profilers and keep their results"""
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.trace_memory:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                self.memory_peak = tracemalloc.get_traced_memory()[1]
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                self.memory_top = [
+                    str(statistic) for statistic in snapshot.statistics('lineno')[:MEMORY_TOP]
+                ]
+
+    def dump_profile(self, path: str):
+        """Write the cProfile data for pstats or snakeviz"""
+        if self.profiler is not None:
+            self.profiler.dump_stats(path)
+
+    def _profile_summary(self) -> List[str]:
+        import io
+        import pstats
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+        return [line for line in stream.getvalue().splitlines() if line.strip()]
+
+    def report(self, top: int = 10) -> List[str]:
+        """Summarize the phases and the slowest files as text lines"""
+        lines = ['Phases: ' + ', '.join(f"{name} {seconds:.3f}s" for name, seconds in self.phases.items())]
+        slowest = self.slowest(top)
+        if slowest:
+            lines.append(f"Slowest {len(slowest)} files:")
+            for file in slowest:
+                lines.append(
+                    f"  {file.seconds:8.3f}s  load {file.load_seconds:.3f}s  render "
+                    f"{file.render_seconds:.3f}s  {file.bytes:>10} B  {file.lines:>7} lines  "
+                    f"{file.pages:>4} pages  {file.path}"
+                )
+        if self.memory_peak is not None:
+            lines.append(f"Peak traced memory: {self.memory_peak / 2**20:.1f} MB")
+        return lines
+
+    def to_dict(self, top: int = 10, include_files: bool = True) -> Dict:
+        """Return the metrics as JSON-serializable data"""
+        def file_dict(file: FileMetrics) -> Dict:
+            data = file._asdict()
+            data['load_seconds'] = round(file.load_seconds, 6)
+            data['render_seconds'] = round(file.render_seconds, 6)
+            return data
+
+        result = {
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'counters': dict(self.counters),
+            'slowest': [file_dict(file) for file in self.slowest(top)],
+        }
+        if include_files:
+            result['files'] = [file_dict(file) for file in self.files]
+        if self.profiler is not None:
+            result['profile'] = self._profile_summary()
+        if self.memory_peak is not None:
+            result['memory'] = {'peak': self.memory_peak, 'top': self.memory_top}
+        return result
+
+    def write(self, path: str, top: int = 10):
+        """Write the metrics as a JSON sidecar file"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(top), f, indent=2)
+
+
+class Stopwatch:
+    """Measures consecutive laps with time.perf_counter"""
+    __slots__ = ('mark',)
+
+    def __init__(self):
+        self.mark = time.perf_counter()
+
+    def lap(self) -> float:
+        """Return the time since the previous lap and start a new one"""
+        now = time.perf_counter()
+        elapsed, self.mark = now - self.mark, now
+        return elapsed
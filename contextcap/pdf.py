@@ -0,0 +1,361 @@
+"""
+PDF rendering for ConTextCap.
+
+FPDF is imported when a capture actually runs so that importing this module
+(and the command line entry point) stays cheap.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from .capture import Capture
+from .content import DEFAULT_MAX_FILE_BYTES
+from .dedup import EXACT
+from .ignore import ExcludeFilter
+from .pipeline import DEFAULT_WORKERS
+from .planner import CapturePlanner
+from .renderers import FileResult, Renderer, describe_content, remove_file
+from .scanner import ScanEntry, ScanSnapshot
+from .sources import CaptureSource
+
+# Fixed-width layout used for file contents in monospace mode
+CODE_FONT = 'Courier'
+CODE_FONT_SIZE = 8
+LINE_HEIGHT = 5
+TAB_SIZE = 4
+
+
+class VolumeInfo(NamedTuple):
+    """A single PDF part written in volume mode"""
+    path: str
+    pages: int
+    files: List[str]
+
+
+def normalize_line(line: str) -> str:
+    """Replace characters the PDF core fonts cannot show"""
+    return line.encode('ascii', errors='replace').decode('ascii')
+
+
+def wrap_code_lines(lines: Iterable[str], width: int) -> Iterator[str]:
+    """
+    Hard-wrap lines of a fixed-width font at a precomputed column count.
+
+    Tabs are expanded first so the wrapped rows line up.
+    """
+    for line in lines:
+        if '\t' in line:
+            line = line.expandtabs(TAB_SIZE)
+        if len(line) <= width:
+            yield line
+        else:
+            for start in range(0, len(line), width):
+                yield line[start:start + width]
+
+
+class PDFRenderer(Renderer):
+    """
+    Renders a capture into a single PDF document.
+
+    With a page or byte budget the capture is written as a series of volumes
+    instead: each finished part is flushed to disk and released, so memory
+    stays flat however large the codebase is, and a JSON manifest ties the
+    volumes together.
+    """
+
+    name = 'pdf'
+
+    def __init__(
+        self,
+        output_path: str,
+        volume_pages: Optional[int] = None,
+        volume_bytes: Optional[int] = None,
+        monospace: bool = True,
+    ):
+        """
+        Initialize the PDF renderer.
+
+        Setting `volume_pages` or `volume_bytes` (of rendered text) enables volume
+        mode. With `monospace` file contents are laid out in a fixed-width font a
+        page at a time instead of wrapping every line with multi_cell.
+        """
+        super().__init__(output_path)
+        self.volume_pages = volume_pages
+        self.volume_bytes = volume_bytes
+        self.monospace = monospace
+        self.written: List[VolumeInfo] = []
+
+        self._pdf = None
+        self._title = ''
+        self._created: Optional[datetime] = None
+        self._file_count = 0
+        self._volume_files: List[str] = []
+        self._volume_tree = False  # whether the current volume holds part of the tree
+        self._volume_size = 0
+        self._wrap_width = 0
+        self._manifest_written = False
+
+    @property
+    def volume_mode(self) -> bool:
+        """Whether the capture is split into volumes"""
+        return bool(self.volume_pages or self.volume_bytes)
+
+    @property
+    def volumes(self) -> Tuple[str, ...]:
+        if not self.volume_mode:
+            return ()
+        return tuple(volume.path for volume in self.written)
+
+    @property
+    def pages(self) -> int:
+        current = self._pdf.pages_count if self._pdf is not None else 0
+        return sum(volume.pages for volume in self.written) + current
+
+    def volume_path(self, number: int) -> str:
+        """Return the path of a volume, e.g. out.001.pdf for out.pdf"""
+        base, ext = os.path.splitext(self.output_path)
+        return f"{base}.{number:03d}{ext or '.pdf'}"
+
+    def manifest_path(self) -> str:
+        """Return the path of the volume manifest, e.g. out.manifest.json"""
+        return os.path.splitext(self.output_path)[0] + '.manifest.json'
+
+    def _start_volume(self):
+        """Begin a new in-memory document"""
+        from fpdf import FPDF
+
+        pdf = FPDF()
+        pdf.set_creation_date(self._created)
+        pdf.set_auto_page_break(auto=True, margin=15)
+        self._pdf = pdf
+        self._volume_files = []
+        self._volume_tree = False
+        self._volume_size = 0
+
+        if self.written:
+            pdf.add_page()
+            pdf.set_font('Arial', 'B', 16)
+            title = f"Codebase Capture: {self._title} (volume {len(self.written) + 1})"
+            pdf.cell(0, 10, normalize_line(title), ln=True, align='C')
+
+    def _finish_volume(self):
+        """Write the current document to disk and release it"""
+        if self.volume_mode:
+            path = self.volume_path(len(self.written) + 1)
+        else:
+            path = self.output_path
+        self._pdf.output(path)
+        self.written.append(VolumeInfo(path, self._pdf.pages_count, self._volume_files))
+        self._pdf = None
+
+    def _volume_full(self, next_height: Optional[float] = None) -> bool:
+        """
+        Check whether the current volume has used up its budget.
+
+        Args:
+            next_height: Height of the next line, or None at a file boundary
+                (which always starts a new page)
+        """
+        if not self._volume_files and not self._volume_tree:
+            return False
+        if self.volume_bytes and self._volume_size >= self.volume_bytes:
+            return True
+        if self.volume_pages and self._pdf.page >= self.volume_pages:
+            return next_height is None or self._pdf.will_page_break(next_height)
+        return False
+
+    def _write_tree_header(self, continued: bool = False):
+        """Start the directory structure on a new page"""
+        pdf = self._pdf
+        pdf.add_page()
+        pdf.set_font('Arial', 'B', 12)
+        pdf.cell(0, 10, "Directory Structure (continued):" if continued else "Directory Structure:", ln=True)
+        pdf.set_font('Arial', '', 10)
+
+    def _write_file_header(self, rel_path: str, continued: bool = False):
+        """Start a file on a new page"""
+        pdf = self._pdf
+        pdf.add_page()
+        pdf.set_font('Arial', 'B', 12)
+        suffix = " (continued)" if continued else ""
+        pdf.cell(0, 10, normalize_line(f"File: {rel_path}{suffix}"), ln=True)
+        pdf.set_font('Arial', '', 8)
+        self._volume_files.append(rel_path)
+
+    def _write_block(self, text: str):
+        """Write a (possibly wrapping) block of text"""
+        text = normalize_line(text)
+        self._pdf.multi_cell(0, 5, text, new_x='LMARGIN', new_y='NEXT')
+        self._volume_size += len(text) + 1
+
+    def _write_code(self, lines: Tuple[str, ...], rel_path: str):
+        """
+        Write file contents in the fixed-width code font.
+
+        Rows are wrapped at the precomputed column count, then emitted as one
+        run per page, so no per-line layout is done.
+        """
+        rows = list(wrap_code_lines(map(normalize_line, lines), self._wrap_width))
+        pdf = self._pdf
+        pdf.set_font(CODE_FONT, '', CODE_FONT_SIZE)
+        start = 0
+        while start < len(rows):
+            fit = int((pdf.page_break_trigger - pdf.y) // LINE_HEIGHT)
+            if fit <= 0:
+                if self.volume_mode and self._volume_full():
+                    self._finish_volume()
+                    self._start_volume()
+                    self._write_file_header(rel_path, continued=True)
+                    pdf = self._pdf
+                    pdf.set_font(CODE_FONT, '', CODE_FONT_SIZE)
+                else:
+                    pdf.add_page()
+                continue
+
+            run = rows[start:start + fit]
+            x = pdf.l_margin
+            y = pdf.y + 0.5 * LINE_HEIGHT + 0.3 * pdf.font_size
+            for row in run:
+                pdf.text(x, y, row)
+                y += LINE_HEIGHT
+            pdf.set_y(pdf.y + len(run) * LINE_HEIGHT)
+            self._volume_size += sum(len(row) + 1 for row in run)
+            start += len(run)
+
+    def _write_manifest(self):
+        """Write the JSON index of all volumes"""
+        manifest = {
+            'title': self._title,
+            'created': self._created.isoformat(),
+            'files': self._file_count,
+            'volumes': [
+                {
+                    'path': os.path.basename(volume.path),
+                    'pages': volume.pages,
+                    'files': volume.files,
+                }
+                for volume in self.written
+            ],
+        }
+        self._manifest_written = True
+        with open(self.manifest_path(), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    def begin(self, title: str, created: datetime, tree: Iterable[str]):
+        self._title = title
+        self._created = created
+        self._file_count = 0
+        self.written = []
+        self._manifest_written = False
+
+        # Create PDF
+        self._start_volume()
+        pdf = self._pdf
+
+        # Columns of the code font that fit between the margins
+        pdf.set_font(CODE_FONT, '', CODE_FONT_SIZE)
+        self._wrap_width = max(1, int(pdf.epw // pdf.get_string_width('M')))
+
+        # Add first page
+        pdf.add_page()
+        pdf.set_font('Arial', 'B', 16)
+        pdf.cell(0, 10, normalize_line(f"Codebase Capture: {title}"), ln=True, align='C')
+
+        # Add timestamp
+        pdf.set_font('Arial', '', 10)
+        timestamp = f"Generated on: {created.strftime('%Y-%m-%d %H:%M:%S')}"
+        pdf.cell(0, 10, timestamp, ln=True, align='C')
+
+        # Add directory structure, which counts towards the volume budget like a file
+        self._write_tree_header()
+        for number, line in enumerate(tree):
+            # Laying out a large tree takes a while; stay responsive to cancellation
+            if self.cancel is not None and number % 1000 == 0:
+                self.cancel.raise_if_cancelled()
+            if self.volume_mode and self._volume_full(5):
+                self._finish_volume()
+                self._start_volume()
+                self._write_tree_header(continued=True)
+            # Clean the line text
+            line = normalize_line(line)
+            self._pdf.cell(0, 5, line, ln=True)
+            self._volume_size += len(line) + 1
+            self._volume_tree = True
+
+    def write_file(self, entry: ScanEntry, rel_path: str, content: FileResult):
+        if self.volume_mode and self._volume_full():
+            self._finish_volume()
+            self._start_volume()
+
+        # Add file header
+        self._file_count += 1
+        self._write_file_header(rel_path)
+
+        # Add file content
+        placeholder = describe_content(entry, content)
+        if placeholder is not None:
+            self._write_block(placeholder)
+        elif self.monospace:
+            self._write_code(content.lines, rel_path)
+        else:
+            for line_text in content.lines:
+                if self.volume_mode and self._volume_full(5):
+                    self._finish_volume()
+                    self._start_volume()
+                    self._write_file_header(rel_path, continued=True)
+                self._write_block(line_text)
+
+    def finish(self) -> str:
+        """
+        Save the PDF.
+
+        In volume mode the parts are written next to the output path and the
+        manifest path is returned.
+        """
+        self._finish_volume()
+        if self.volume_mode:
+            self._write_manifest()
+            return self.manifest_path()
+        return self.output_path
+
+    def abort(self):
+        """Drop the document in memory and delete any volumes already written"""
+        self._pdf = None
+        for volume in self.written:
+            remove_file(volume.path)
+        self.written = []
+        if self._manifest_written:
+            remove_file(self.manifest_path())
+            self._manifest_written = False
+
+
+class PDFCapture(Capture):
+    """Captures a codebase into a PDF document (or volumes of one)"""
+
+    def __init__(
+        self,
+        root_path: str,
+        output_path: str,
+        snapshot: Optional[ScanSnapshot] = None,
+        cache=None,
+        workers: int = DEFAULT_WORKERS,
+        volume_pages: Optional[int] = None,
+        volume_bytes: Optional[int] = None,
+        max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+        monospace: bool = True,
+        exclude: Optional[ExcludeFilter] = None,
+        dedup: Optional[str] = EXACT,
+        planner: Optional[CapturePlanner] = None,
+        source: Optional[CaptureSource] = None,
+    ):
+        """
+        Initialize the PDF capture.
+
+        See Capture and PDFRenderer for the meaning of the arguments.
+        """
+        renderer = PDFRenderer(output_path, volume_pages, volume_bytes, monospace)
+        super().__init__(
+            root_path, renderer, snapshot, cache, workers, max_file_bytes, exclude, dedup, planner,
+            source)
@@ -0,0 +1,101 @@
+"""
+Parallel file ingestion for ConTextCap.
+
+Reading, classifying and decoding files runs on a thread pool ahead of the
+renderer. Results are handed back strictly in snapshot order through a
+bounded window, so the output does not depend on the number of workers.
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from .content import DEFAULT_MAX_FILE_BYTES, FileContent, load_file_content
+from .dedup import Deduplicator
+from .scanner import ScanEntry
+
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Files in flight per worker before the producer waits for the renderer
+PREFETCH_PER_WORKER = 4
+
+IngestResult = Tuple[ScanEntry, Union[FileContent, Exception]]
+
+# Signature of load_file_content and CaptureSource.load
+Loader = Callable[[ScanEntry, object, int], FileContent]
+
+
+def ingest_files(
+    files: Iterable[ScanEntry],
+    cache=None,
+    workers: int = DEFAULT_WORKERS,
+    prefetch: Optional[int] = None,
+    max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+    load_times: Optional[Dict[int, float]] = None,
+    dedup: Optional[Deduplicator] = None,
+    loader: Loader = load_file_content,
+) -> Iterator[IngestResult]:
+    """
+    Load file contents in parallel and yield them in input order.
+
+    Args:
+        files: Scanned files in the order they should be rendered
+        cache: Optional ContentCache shared by the workers
+        workers: Number of ingestion threads; 1 or less loads serially
+        prefetch: Maximum number of files loaded ahead of the consumer
+        max_file_bytes: Size cap above which text files are truncated
+        load_times: If given, receives the seconds spent loading each file,
+            keyed by snapshot index
+        dedup: If given, hashes every loaded file for duplicate detection
+        loader: Reads a file, for captures that do not come from the file system
+
+    Yields:
+        (entry, content) pairs, where content is the exception raised while
+        loading if the file could not be read
+    """
+    if workers <= 1:
+        for entry in files:
+            yield entry, _load(entry, cache, max_file_bytes, load_times, dedup, loader)
+        return
+
+    window = prefetch or workers * PREFETCH_PER_WORKER
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='contextcap-ingest') as pool:
+        try:
+            for entry in files:
+                pending.append((entry, pool.submit(_load, entry, cache, max_file_bytes, load_times, dedup, loader)))
+                if len(pending) >= window:
+                    yield _result(*pending.popleft())
+            while pending:
+                yield _result(*pending.popleft())
+        finally:
+            # Stop loading files nobody will consume
+            for _, future in pending:
+                future.cancel()
+
+
+def _load(
+    entry: ScanEntry,
+    cache,
+    max_file_bytes: int,
+    load_times: Optional[Dict[int, float]] = None,
+    dedup: Optional[Deduplicator] = None,
+    loader: Loader = load_file_content,
+) -> Union[FileContent, Exception]:
+    started = time.perf_counter() if load_times is not None else 0.0
+    try:
+        content = loader(entry, cache, max_file_bytes)
+        if dedup is not None:
+            dedup.digest(entry, content)
+        return content
+    except Exception as e:
+        return e
+    finally:
+        if load_times is not None:
+            load_times[entry.index] = time.perf_counter() - started
+
+
+def _result(entry: ScanEntry, future: Future) -> IngestResult:
+    return entry, future.result()
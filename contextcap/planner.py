@@ -0,0 +1,244 @@
+"""
+Token-budget planning for ConTextCap.
+
+Captures are fed to LLMs with a fixed context window. The planner estimates
+the tokens each file will take from its size and type alone, without reading
+it, ranks the files by priority and picks the set that fits the budget before
+anything is rendered. Files left out appear in the directory tree with a
+one-line note instead.
+"""
+
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from .content import BINARY, DEFAULT_MAX_FILE_BYTES, extension_kind
+from .ignore import IgnoreRules
+from .renderers import format_size
+from .scanner import ScanEntry, ScanSnapshot
+
+# File categories; the names match the PlanPriorities fields
+ENTRY_POINT = 'entry_point'
+SOURCE = 'source'
+DOCS = 'docs'
+CONFIG = 'config'
+TEST = 'test'
+DATA = 'data'
+LOCKFILE = 'lockfile'
+BINARY_FILE = 'binary'
+
+ENTRY_POINT_NAMES = frozenset({
+    'README', 'README.md', 'README.rst', 'README.txt', 'pyproject.toml', 'setup.py', 'setup.cfg',
+    'package.json', 'Cargo.toml', 'go.mod', 'pom.xml', 'build.gradle', 'Makefile', 'Dockerfile',
+    'CMakeLists.txt', 'Gemfile', 'composer.json',
+})
+# Source files with these names start a program
+ENTRY_POINT_STEMS = frozenset({'main', '__main__', '__init__', 'index', 'app', 'cli', 'server', 'manage'})
+
+SOURCE_EXTENSIONS = frozenset({
+    '.py', '.pyi', '.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx', '.go', '.rs', '.java', '.kt',
+    '.scala', '.c', '.h', '.cc', '.cpp', '.hpp', '.cs', '.rb', '.php', '.swift', '.m', '.sh',
+    '.bash', '.ps1', '.lua', '.pl', '.r', '.jl', '.ex', '.exs', '.erl', '.hs', '.ml', '.clj',
+    '.dart', '.vue', '.svelte', '.sql', '.html', '.css', '.scss', '.proto', '.graphql',
+})
+DOCS_EXTENSIONS = frozenset({'.md', '.rst', '.txt', '.adoc', '.org'})
+CONFIG_EXTENSIONS = frozenset({
+    '.toml', '.ini', '.cfg', '.conf', '.yml', '.yaml', '.json', '.xml', '.properties', '.env',
+})
+DATA_EXTENSIONS = frozenset({'.csv', '.tsv', '.svg', '.map', '.log', '.snap', '.ndjson', '.jsonl'})
+DATA_SUFFIXES = ('.min.js', '.min.css', '.bundle.js')
+LOCKFILE_NAMES = frozenset({
+    'package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock', 'pnpm-lock.yaml', 'poetry.lock',
+    'Pipfile.lock', 'Cargo.lock', 'composer.lock', 'Gemfile.lock', 'go.sum', 'uv.lock',
+})
+TEST_DIRECTORIES = frozenset({'test', 'tests', '__tests__', 'spec', 'specs', 'testing'})
+
+# Average bytes per token; punctuation-heavy content packs fewer bytes into each token
+BYTES_PER_TOKEN = {
+    ENTRY_POINT: 3.5, SOURCE: 3.5, TEST: 3.5, DOCS: 4.5, CONFIG: 3.0, DATA: 2.5, LOCKFILE: 2.5,
+}
+# Tokens taken by a file's header and fences, or by a placeholder line
+FILE_OVERHEAD_TOKENS = 12
+# Tokens taken by the note of a skipped file in the tree
+SKIPPED_NOTE_TOKENS = 12
+# Indentation and names of the directory tree compress well
+TREE_BYTES_PER_TOKEN = 4.0
+
+
+class PlanPriorities(NamedTuple):
+    """Weights that rank files; higher-scoring files are kept first"""
+    entry_point: float = 8.0
+    source: float = 6.0
+    docs: float = 4.0
+    config: float = 3.0
+    test: float = 3.0
+    binary: float = 2.0  # only a placeholder line is written
+    data: float = 1.0
+    lockfile: float = 0.0
+    recency: float = 2.0  # added in full for the most recently modified file
+    depth: float = 0.25  # subtracted per directory level
+    pattern: float = 10.0  # added for preferred paths, subtracted for avoided ones
+
+
+class CapturePlan(NamedTuple):
+    """Files selected to fit a token budget"""
+    budget: int
+    files: List[ScanEntry]  # in snapshot order
+    notes: Dict[int, str]  # tree notes of skipped files, by snapshot index
+    tokens: int  # estimated tokens of the planned capture
+
+    @property
+    def skipped(self) -> int:
+        return len(self.notes)
+
+
+def format_tokens(tokens: int) -> str:
+    """Format a token count compactly, e.g. 12.3k"""
+    if tokens >= 1_000_000:
+        return f"{tokens / 1_000_000:.1f}M"
+    if tokens >= 1000:
+        return f"{tokens / 1000:.1f}k"
+    return str(tokens)
+
+
+def classify_file(entry: ScanEntry) -> str:
+    """Categorize a file by its name and location"""
+    name = entry.name
+    lower = name.lower()
+    stem, extension = os.path.splitext(lower)
+    if name in LOCKFILE_NAMES or extension == '.lock':
+        return LOCKFILE
+    if extension_kind(extension) == BINARY:
+        return BINARY_FILE
+    if name in ENTRY_POINT_NAMES or (stem in ENTRY_POINT_STEMS and extension in SOURCE_EXTENSIONS):
+        return ENTRY_POINT
+    if extension in DATA_EXTENSIONS or lower.endswith(DATA_SUFFIXES):
+        return DATA
+    if extension in SOURCE_EXTENSIONS:
+        if (lower.startswith('test_') or stem.endswith(('_test', '.test', '.spec'))
+                or TEST_DIRECTORIES.intersection(entry.parts[:-1])):
+            return TEST
+        return SOURCE
+    if extension in DOCS_EXTENSIONS:
+        return DOCS
+    if extension in CONFIG_EXTENSIONS or not extension:
+        return CONFIG
+    return DATA
+
+
+def estimate_tokens(entry: ScanEntry, category: str, max_file_bytes: int = DEFAULT_MAX_FILE_BYTES) -> int:
+    """
+    Estimate the tokens a file takes in a capture from its size.
+
+    Binary files only get a placeholder, and text files over the size cap
+    are reduced to their head and tail.
+    """
+    if category == BINARY_FILE:
+        return FILE_OVERHEAD_TOKENS
+    size = min(entry.size, max_file_bytes)
+    return FILE_OVERHEAD_TOKENS + int(size / BYTES_PER_TOKEN[category] + 0.5)
+
+
+def estimate_tree_tokens(snapshot: ScanSnapshot) -> int:
+    """Estimate the tokens of the directory tree"""
+    names = snapshot._names
+    depths = snapshot._depths
+    size = sum(len(names[index]) + 4 * depths[index] + 5 for index in range(len(names)))
+    return int(size / TREE_BYTES_PER_TOKEN + 0.5)
+
+
+class CapturePlanner:
+    """
+    Picks the files of a capture that fit a token budget.
+
+    Files are ranked by category, recency, depth and the preferred and
+    avoided patterns, then taken greedily: a file that does not fit is
+    skipped and smaller, lower-ranked files may still be taken. The
+    directory tree and the notes of skipped files count against the budget.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        priorities: PlanPriorities = PlanPriorities(),
+        prefer: Iterable[str] = (),
+        avoid: Iterable[str] = (),
+    ):
+        """
+        Configure the planner.
+
+        Args:
+            budget: Target size of the capture in tokens
+            priorities: Weights used to rank files
+            prefer: Gitignore-style patterns of files to keep first
+            avoid: Gitignore-style patterns of files to skip first
+        """
+        self.budget = budget
+        self.priorities = priorities
+        self.prefer = IgnoreRules(prefer)
+        self.avoid = IgnoreRules(avoid)
+
+    def score(self, entry: ScanEntry, category: str, recency: float) -> float:
+        """
+        Rank a file; higher is kept first.
+
+        Args:
+            entry: The file
+            category: Its category from classify_file
+            recency: 1.0 for the most recently modified file down to 0.0 for the oldest
+        """
+        priorities = self.priorities
+        score = getattr(priorities, category) + priorities.recency * recency
+        score -= priorities.depth * (entry.depth - 1)
+        if self.prefer or self.avoid:
+            rel_path = '/'.join(entry.parts)
+            if self.prefer.match(rel_path, entry.name, False):
+                score += priorities.pattern
+            if self.avoid.match(rel_path, entry.name, False):
+                score -= priorities.pattern
+        return score
+
+    def plan(
+        self,
+        snapshot: ScanSnapshot,
+        max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+        files: Optional[List[ScanEntry]] = None,
+    ) -> CapturePlan:
+        """
+        Select the files of a snapshot to capture.
+
+        Args:
+            snapshot: The scanned entries
+            max_file_bytes: Size cap above which text files are truncated
+            files: Candidate files in snapshot order, all files if None
+        """
+        if files is None:
+            files = snapshot.files()
+        by_age = sorted(files, key=lambda entry: entry.mtime)
+        recency = {entry.index: rank / max(1, len(files) - 1) for rank, entry in enumerate(by_age)}
+
+        ranked = []
+        for entry in files:
+            category = classify_file(entry)
+            tokens = estimate_tokens(entry, category, max_file_bytes)
+            ranked.append((-self.score(entry, category, recency[entry.index]), tokens, entry.index,
+                           entry, category))
+        ranked.sort(key=lambda item: item[:3])
+
+        # Start from every file skipped, then swap notes for contents by rank
+        used = estimate_tree_tokens(snapshot) + SKIPPED_NOTE_TOKENS * len(files)
+        selected = set()
+        notes = {}
+        for _, tokens, index, entry, category in ranked:
+            if used + tokens - SKIPPED_NOTE_TOKENS <= self.budget:
+                used += tokens - SKIPPED_NOTE_TOKENS
+                selected.add(index)
+            else:
+                notes[index] = (f"[skipped: {format_size(entry.size)}, ~{format_tokens(tokens)} tokens, "
+                                f"{category.replace('_', ' ')}]")
+
+        return CapturePlan(
+            budget=self.budget,
+            files=[entry for entry in files if entry.index in selected],
+            notes=notes,
+            tokens=used,
+        )
@@ -0,0 +1,114 @@
+"""
+Progress reporting and cancellation for ConTextCap.
+
+Scans and captures report progress through a ProgressThrottle, which only
+passes updates on when the percentage moved and enough time has passed, so
+a GUI thread is not flooded with millions of cross-thread signals. Long
+running work checks a CancelToken between items and stops with
+CaptureCancelled.
+"""
+
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+
+class CaptureCancelled(Exception):
+    """Raised when a scan or capture is cancelled"""
+
+
+class CancelToken:
+    """Thread-safe flag used to ask a scan or capture to stop"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Request cancellation"""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """
+        Stop the current operation if cancellation was requested.
+
+        Raises:
+            CaptureCancelled: If cancel() has been called
+        """
+        if self._event.is_set():
+            raise CaptureCancelled()
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration as H:MM:SS or M:SS"""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class ProgressInfo(NamedTuple):
+    """A progress update"""
+    percent: int
+    done: int
+    total: int
+    elapsed: float
+    rate: float  # items per second
+    eta: Optional[float]  # seconds left, None until it can be estimated
+    unit: str = 'items'
+
+    def describe(self) -> str:
+        """Return e.g. '120/500 files, 35 files/s, 0:11 left'"""
+        text = f"{self.done}/{self.total} {self.unit}"
+        if self.rate:
+            text += f", {self.rate:.0f} {self.unit}/s"
+        if self.eta is not None and self.done < self.total:
+            text += f", {format_duration(self.eta)} left"
+        return text
+
+
+class ProgressThrottle:
+    """
+    Coalesces progress updates.
+
+    An update is passed on when the percentage changed and at least
+    `interval` seconds passed since the last one; the first and final
+    updates always are.
+    """
+
+    def __init__(
+        self,
+        callback: Optional[Callable[[ProgressInfo], None]],
+        total: int,
+        unit: str = 'items',
+        interval: float = 0.1,
+    ):
+        self.callback = callback
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._last_time: Optional[float] = None
+        self._last_percent = -1
+
+    def update(self, done: int):
+        """Report that `done` of `total` items are finished"""
+        if self.callback is None:
+            return
+        percent = int(done * 100 / self.total) if self.total else 100
+        now = time.perf_counter()
+        final = done >= self.total
+        if not final and self._last_time is not None and (
+                percent == self._last_percent or now - self._last_time < self.interval):
+            return
+        self._last_time = now
+        self._last_percent = percent
+
+        elapsed = now - self.started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - done) / rate if rate > 0 else None
+        self.callback(ProgressInfo(percent, done, self.total, elapsed, rate, eta, self.unit))
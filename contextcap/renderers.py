@@ -0,0 +1,265 @@
+"""
+Output formats for ConTextCap.
+
+A Renderer receives the directory tree once and then every file in snapshot
+order. The streaming renderers here (Markdown, plain text and JSONL) write
+each file straight to disk as it arrives, so memory use does not grow with
+the size of the codebase. The PDF renderer lives in contextcap.pdf.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from .content import BINARY, DUPLICATE, GENERATED, NEAR_DUPLICATE, TEXT, FileContent
+from .progress import CancelToken
+from .scanner import ScanEntry, ScanSnapshot
+
+FileResult = Union[FileContent, Exception]
+
+# Markdown code fence languages for common extensions
+FENCE_LANGUAGES = {
+    '.py': 'python', '.js': 'javascript', '.jsx': 'jsx', '.ts': 'typescript', '.tsx': 'tsx',
+    '.json': 'json', '.md': 'markdown', '.yml': 'yaml', '.yaml': 'yaml', '.toml': 'toml',
+    '.sh': 'bash', '.go': 'go', '.rs': 'rust', '.java': 'java', '.c': 'c', '.h': 'c',
+    '.cpp': 'cpp', '.hpp': 'cpp', '.cs': 'csharp', '.rb': 'ruby', '.php': 'php',
+    '.html': 'html', '.css': 'css', '.xml': 'xml', '.sql': 'sql', '.ini': 'ini',
+}
+
+
+def generate_tree_structure(
+    root_name: str,
+    snapshot: ScanSnapshot,
+    notes: Optional[Dict[int, str]] = None,
+) -> Iterator[str]:
+    """
+    Generate a clean tree structure for a capture, one line at a time.
+
+    Lines are produced as the renderer writes them, so a tree of millions
+    of entries is never held in memory.
+
+    Args:
+        root_name: First line of the tree
+        snapshot: Entries to list
+        notes: Text appended to some entries' lines, by snapshot index
+    """
+    yield root_name
+    for entry in snapshot:
+        line = "    " * entry.depth + "└── " + entry.name
+        if notes and entry.index in notes:
+            line += "  " + notes[entry.index]
+        yield line
+
+
+def format_size(file_size: int) -> str:
+    """Format a file size the way captures show it"""
+    return f"{file_size / 1024:.2f} KB" if file_size > 1024 else f"{file_size} bytes"
+
+
+def describe_content(entry: ScanEntry, content: FileResult) -> Optional[str]:
+    """
+    Return the placeholder shown instead of a file's contents.
+
+    Returns:
+        The placeholder text, or None for text files whose lines are shown
+    """
+    if isinstance(content, Exception):
+        return f"[Error reading file: {str(content)}]"
+    if content.kind == TEXT:
+        return None
+    if content.kind == BINARY:
+        return f"[Binary file - Size: {format_size(entry.size)}]"
+    if content.kind == GENERATED:
+        return f"[Generated or minified file - Size: {format_size(entry.size)}]"
+    if content.kind == DUPLICATE:
+        return f"[Duplicate of {content.duplicate_of}]"
+    if content.kind == NEAR_DUPLICATE:
+        return f"[Same as {content.duplicate_of} apart from whitespace]"
+    return "[Binary file contents not shown]"
+
+
+def display_lines(lines: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Drop the empty line that follows a file's final newline"""
+    if lines and lines[-1] == '':
+        return lines[:-1]
+    return lines
+
+
+def remove_file(path: str):
+    """Delete a file if it exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class Renderer:
+    """
+    Base class for capture output formats.
+
+    The capture calls begin() once, write_file() for every file in snapshot
+    order and finish() at the end.
+    """
+
+    # Format name used on the command line
+    name = ''
+
+    def __init__(self, output_path: str):
+        """Initialize the renderer for the given output path."""
+        self.output_path = output_path
+        self.cancel: Optional[CancelToken] = None  # set by the capture while it runs
+
+    @property
+    def volumes(self) -> Tuple[str, ...]:
+        """Paths of the separate parts written, if the output was split"""
+        return ()
+
+    @property
+    def pages(self) -> int:
+        """Pages produced so far, for paged formats"""
+        return 0
+
+    def begin(self, title: str, created: datetime, tree: Iterable[str]):
+        """Start the output with its title, timestamp and directory tree, whose lines can be read once"""
+        raise NotImplementedError
+
+    def write_file(self, entry: ScanEntry, rel_path: str, content: FileResult):
+        """Add one file, or the error raised while loading it"""
+        raise NotImplementedError
+
+    def finish(self) -> str:
+        """Complete the output and return the path of the main output file"""
+        raise NotImplementedError
+
+    def abort(self):
+        """Discard a capture that did not finish, removing any partial output"""
+
+
+class StreamRenderer(Renderer):
+    """Renderer that writes UTF-8 text to its output as files arrive"""
+
+    def __init__(self, output_path: str):
+        super().__init__(output_path)
+        self._out = None
+
+    def begin(self, title: str, created: datetime, tree: Iterable[str]):
+        self._out = open(self.output_path, 'w', encoding='utf-8', newline='\n')
+
+    def finish(self) -> str:
+        self._out.close()
+        self._out = None
+        return self.output_path
+
+    def abort(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+            remove_file(self.output_path)
+
+
+class MarkdownRenderer(StreamRenderer):
+    """Writes the capture as a Markdown document with fenced code blocks"""
+
+    name = 'md'
+
+    def begin(self, title: str, created: datetime, tree: Iterable[str]):
+        super().begin(title, created, tree)
+        self._out.write(f"# Codebase Capture: {title}\n\n")
+        self._out.write(f"Generated on: {created.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        self._out.write("## Directory Structure\n\n```text\n")
+        for line in tree:
+            self._out.write(line + '\n')
+        self._out.write("```\n")
+
+    def write_file(self, entry: ScanEntry, rel_path: str, content: FileResult):
+        out = self._out
+        out.write(f"\n## File: {rel_path}\n\n")
+        placeholder = describe_content(entry, content)
+        if placeholder is not None:
+            out.write(placeholder + '\n')
+            return
+
+        # Use a fence longer than any backtick run inside the file
+        lines = display_lines(content.lines)
+        longest = max((len(line) - len(line.lstrip('`')) for line in lines), default=0)
+        fence = '`' * max(3, longest + 1)
+        language = FENCE_LANGUAGES.get(os.path.splitext(entry.name)[1].lower(), '')
+        out.write(f"{fence}{language}\n")
+        for line in lines:
+            out.write(line + '\n')
+        out.write(f"{fence}\n")
+
+
+class TextRenderer(StreamRenderer):
+    """Writes the capture as plain text with a header line per file"""
+
+    name = 'txt'
+
+    def begin(self, title: str, created: datetime, tree: Iterable[str]):
+        super().begin(title, created, tree)
+        self._out.write(f"Codebase Capture: {title}\n")
+        self._out.write(f"Generated on: {created.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        self._out.write("Directory Structure:\n")
+        for line in tree:
+            self._out.write(line + '\n')
+
+    def write_file(self, entry: ScanEntry, rel_path: str, content: FileResult):
+        out = self._out
+        out.write(f"\n==== File: {rel_path} ====\n")
+        placeholder = describe_content(entry, content)
+        if placeholder is not None:
+            out.write(placeholder + '\n')
+            return
+        for line in display_lines(content.lines):
+            out.write(line + '\n')
+
+
+class JSONLRenderer(StreamRenderer):
+    """Writes one JSON record per file, for machine ingestion"""
+
+    name = 'jsonl'
+
+    def write_file(self, entry: ScanEntry, rel_path: str, content: FileResult):
+        record = {'path': rel_path.replace(os.sep, '/'), 'size': entry.size}
+        if isinstance(content, Exception):
+            record.update(kind='error', content=None, error=str(content))
+        elif content.kind == TEXT:
+            record.update(kind=TEXT, content='\n'.join(content.lines))
+        elif content.duplicate_of:
+            record.update(kind=content.kind, content=None,
+                          duplicate_of=content.duplicate_of.replace(os.sep, '/'))
+        else:
+            record.update(kind=content.kind, content=None)
+        self._out.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+# Streaming renderers by format name; 'pdf' is added by renderer_for
+RENDERERS = {
+    renderer.name: renderer for renderer in (MarkdownRenderer, TextRenderer, JSONLRenderer)
+}
+
+FORMATS = ('pdf',) + tuple(RENDERERS)
+
+
+def format_for_path(output_path: str) -> str:
+    """Guess the output format from a file extension, defaulting to PDF"""
+    extension = os.path.splitext(output_path)[1].lower().lstrip('.')
+    if extension == 'markdown':
+        extension = 'md'
+    return extension if extension in RENDERERS else 'pdf'
+
+
+def renderer_for(output_format: str, output_path: str, **pdf_options) -> Renderer:
+    """
+    Create the renderer for a format name.
+
+    Args:
+        output_format: One of FORMATS
+        output_path: File to write
+        **pdf_options: Passed to PDFRenderer (volume budget, monospace)
+    """
+    if output_format == 'pdf':
+        from .pdf import PDFRenderer
+        return PDFRenderer(output_path, **pdf_options)
+    return RENDERERS[output_format](output_path)
@@ -0,0 +1,730 @@
+"""
+Directory scanning for ConTextCap.
+
+Walks a codebase once and records the allowed files and directories in an
+immutable snapshot shared by the tree view and the capture renderers.
+
+The snapshot is a compact columnar index: names are interned and every other
+attribute lives in an array indexed by entry number, so a tree of millions of
+entries costs tens of bytes per entry. ScanEntry objects are lightweight
+views created on demand. A snapshot is never modified; rescan_directory
+returns a new one with a single directory's listing refreshed.
+"""
+
+import os
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .ignore import IGNORE_FILES, ExcludeFilter, IgnoreRules
+from .metrics import CaptureMetrics
+from .progress import CancelToken, ProgressInfo, ProgressThrottle
+
+# Filter used when no patterns are given
+DEFAULT_FILTER = ExcludeFilter()
+
+
+def is_allowed_file(file_path: Path) -> bool:
+    """
+    Filter files based on extension or other criteria.
+
+    Args:
+        file_path: Path object to check
+
+    Returns:
+        bool: True if the file should be included, False otherwise
+    """
+    # Always allow directories
+    if file_path.is_dir():
+        return True
+
+    # Check the containing directories and the file itself against the defaults
+    rules = DEFAULT_FILTER.base_rules
+    if any(ExcludeFilter.is_excluded(rules, part, part, True) for part in file_path.parts[:-1]):
+        return False
+    return not ExcludeFilter.is_excluded(rules, file_path.name, file_path.name, False)
+
+
+# Bits of ScanSnapshot flags
+IS_FILE = 0x1
+IS_SYMLINK = 0x2
+
+
+class ScanEntry:
+    """View of a single file or directory in a ScanSnapshot"""
+    __slots__ = ('snapshot', 'index')
+
+    def __init__(self, snapshot: 'ScanSnapshot', index: int):
+        self.snapshot = snapshot
+        self.index = index
+
+    def __repr__(self) -> str:
+        return f"ScanEntry({self.rel_path!r})"
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, ScanEntry)
+            and other.snapshot is self.snapshot
+            and other.index == self.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.snapshot), self.index))
+
+    @property
+    def name(self) -> str:
+        return self.snapshot._names[self.index]
+
+    @property
+    def is_file(self) -> bool:
+        return bool(self.snapshot._flags[self.index] & IS_FILE)
+
+    @property
+    def is_symlink(self) -> bool:
+        return bool(self.snapshot._flags[self.index] & IS_SYMLINK)
+
+    @property
+    def size(self) -> int:
+        return self.snapshot._sizes[self.index]
+
+    @property
+    def mtime(self) -> float:
+        return self.snapshot._mtimes[self.index]
+
+    @property
+    def depth(self) -> int:
+        """Nesting level below the scan root (1 for direct children)"""
+        return self.snapshot._depths[self.index]
+
+    @property
+    def parts(self) -> Tuple[str, ...]:
+        """Path components relative to the scan root"""
+        names = self.snapshot._names
+        parents = self.snapshot._parents
+        parts = []
+        index = self.index
+        while index >= 0:
+            parts.append(names[index])
+            index = parents[index]
+        return tuple(reversed(parts))
+
+    @property
+    def rel_path(self) -> str:
+        """Path relative to the scan root"""
+        return os.path.join(*self.parts)
+
+    @property
+    def path(self) -> str:
+        """Path including the scan root"""
+        return os.path.join(self.snapshot.root, *self.parts)
+
+    @property
+    def parent(self) -> Optional['ScanEntry']:
+        """The containing directory, or None for top-level entries"""
+        parent = self.snapshot._parents[self.index]
+        return ScanEntry(self.snapshot, parent) if parent >= 0 else None
+
+    def children(self) -> Iterator['ScanEntry']:
+        """Iterate over the direct children of a directory, sorted by name"""
+        return self.snapshot.children(self.index)
+
+
+class ScanSnapshot:
+    """
+    Immutable result of a single directory walk.
+
+    Entries are numbered depth-first with siblings sorted by name, which is
+    the same order as sorted(Path(root).rglob('*')). Each entry's subtree
+    occupies the index range [index, end), which makes child iteration cheap
+    without storing child lists.
+    """
+    __slots__ = (
+        'root', '_names', '_parents', '_depths', '_ends', '_flags', '_sizes', '_mtimes',
+        '_lookup', 'scanned_at', 'ignore_dirs',
+    )
+
+    def __init__(
+        self,
+        root: str,
+        names: List[str],
+        parents: array,
+        depths: array,
+        ends: array,
+        flags: array,
+        sizes: array,
+        mtimes: array,
+        scanned_at: float = 0.0,
+        ignore_dirs: FrozenSet[str] = frozenset(),
+    ):
+        """
+        Wrap the columns built by scan_directory.
+
+        Args:
+            root: The scanned directory
+            names: Interned entry names
+            parents: Index of each entry's parent, -1 for top-level entries
+            depths: Nesting level of each entry
+            ends: End of each entry's subtree range
+            flags: IS_FILE / IS_SYMLINK bits
+            sizes: File sizes in bytes (0 for directories)
+            mtimes: Modification times (0 for directories)
+            scanned_at: Time the walk started
+            ignore_dirs: '/'-separated paths of the directories that had an
+                ignore file, '' for the root
+        """
+        self.root = root
+        self._names = names
+        self._parents = parents
+        self._depths = depths
+        self._ends = ends
+        self._flags = flags
+        self._sizes = sizes
+        self._mtimes = mtimes
+        self._lookup: Dict[int, Dict[str, int]] = {}  # child name maps, built on demand
+        self.scanned_at = scanned_at
+        self.ignore_dirs = ignore_dirs
+
+    def __iter__(self) -> Iterator[ScanEntry]:
+        return (ScanEntry(self, index) for index in range(len(self._names)))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __getitem__(self, index: int) -> ScanEntry:
+        if not 0 <= index < len(self._names):
+            raise IndexError(index)
+        return ScanEntry(self, index)
+
+    def files(self) -> List[ScanEntry]:
+        """Return the file entries in snapshot order"""
+        flags = self._flags
+        return [ScanEntry(self, index) for index in range(len(flags)) if flags[index] & IS_FILE]
+
+    def directories(self) -> List[ScanEntry]:
+        """Return the directory entries that were descended into, in snapshot order"""
+        flags = self._flags
+        return [ScanEntry(self, index) for index in range(len(flags)) if flags[index] == 0]
+
+    def parent_index(self, index: int) -> int:
+        """Return the index of an entry's parent, -1 for top-level entries"""
+        return self._parents[index]
+
+    def child_indexes(self, index: int = -1) -> Iterator[int]:
+        """Iterate over the indexes of an entry's children (-1 for the root)"""
+        ends = self._ends
+        if index < 0:
+            child, end = 0, len(ends)
+        else:
+            child, end = index + 1, ends[index]
+        while child < end:
+            yield child
+            child = ends[child]
+
+    def children(self, index: int = -1) -> Iterator[ScanEntry]:
+        """Iterate over an entry's children (-1 for the root), sorted by name"""
+        return (ScanEntry(self, child) for child in self.child_indexes(index))
+
+    def find(self, rel_path: str) -> Optional[ScanEntry]:
+        """
+        Look up an entry by its path relative to the root.
+
+        Returns:
+            The entry, or None if the path is not part of the snapshot
+        """
+        index = -1
+        for part in Path(rel_path).parts:
+            names = self._lookup.get(index)
+            if names is None:
+                names = {self._names[child]: child for child in self.child_indexes(index)}
+                self._lookup[index] = names
+            index = names.get(part, -2)
+            if index == -2:
+                return None
+        return ScanEntry(self, index) if index >= 0 else None
+
+    def subtree_end(self, index: int) -> int:
+        """Return the end of an entry's subtree range (-1 for the whole snapshot)"""
+        return self._ends[index] if index >= 0 else len(self._names)
+
+
+def _sorted_children(dir_path: str) -> List[os.DirEntry]:
+    """List a directory with os.scandir, sorted by name"""
+    with os.scandir(dir_path) as it:
+        return sorted(it, key=lambda entry: entry.name)
+
+
+class _SnapshotBuilder:
+    """Accumulates the columns of a ScanSnapshot"""
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.parents = array('i')
+        self.depths = array('H')
+        self.ends = array('i')
+        self.flags = array('B')
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.ignore_dirs: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def directory_rules(
+        self,
+        exclude: ExcludeFilter,
+        dir_path: str,
+        rel_dir: str,
+        child_names: Iterable[str],
+        inherited: Tuple[IgnoreRules, ...],
+    ) -> Tuple[IgnoreRules, ...]:
+        """Extend the rules with a directory's ignore files, noting that it has some"""
+        child_names = list(child_names)
+        if exclude.use_ignore_files and any(name in child_names for name in IGNORE_FILES):
+            self.ignore_dirs.add(rel_dir)
+        return exclude.directory_rules(dir_path, rel_dir, child_names, inherited)
+
+    def add(
+        self,
+        child: os.DirEntry,
+        rel_path: str,
+        rules: Tuple[IgnoreRules, ...],
+        exclude: ExcludeFilter,
+        parent: int,
+        depth: int,
+    ) -> int:
+        """
+        Record a directory entry unless it is filtered out.
+
+        Returns:
+            The new entry's index, or -1 if it was skipped
+
+        Raises:
+            OSError: If the entry cannot be inspected
+        """
+        is_dir = child.is_dir()
+        if not is_dir and not child.is_file():
+            # Broken symlinks, sockets and other special files
+            return -1
+        if exclude.is_excluded(rules, rel_path, child.name, is_dir):
+            return -1
+        if is_dir:
+            size, mtime = 0, 0.0
+        else:
+            stat = child.stat()
+            size, mtime = stat.st_size, stat.st_mtime
+        is_symlink = child.is_symlink()
+
+        index = len(self.names)
+        self.names.append(sys.intern(child.name))
+        self.parents.append(parent)
+        self.depths.append(depth)
+        self.ends.append(index + 1)
+        self.flags.append((0 if is_dir else IS_FILE) | (IS_SYMLINK if is_symlink else 0))
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+        return index
+
+    def walk(
+        self,
+        stack: list,
+        exclude: ExcludeFilter,
+        error_callback: Optional[Callable[[str], None]] = None,
+        progress: Optional[ProgressThrottle] = None,
+        cancel: Optional[CancelToken] = None,
+    ):
+        """
+        Walk depth-first from the directories on the stack.
+
+        Each stack frame is (parent index, children iterator, '/'-separated
+        relative path, rules in force, depth of the children). Progress is
+        reported per entry of the first frame.
+
+        Raises:
+            CaptureCancelled: If the cancel token is triggered
+        """
+        done_top_level = 0
+        while stack:
+            parent, children, rel_dir, rules, depth = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if parent >= 0:
+                    self.ends[parent] = len(self.names)
+                continue
+
+            if len(stack) == 1:
+                if progress is not None:
+                    progress.update(done_top_level)
+                    done_top_level += 1
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+
+            try:
+                rel_path = f"{rel_dir}/{child.name}" if rel_dir else child.name
+                index = self.add(child, rel_path, rules, exclude, parent, depth)
+                # Symlinked directories are listed but not followed, like rglob
+                if index >= 0 and self.flags[index] == 0:
+                    if cancel is not None:
+                        cancel.raise_if_cancelled()
+                    listing = _sorted_children(child.path)
+                    child_rules = self.directory_rules(
+                        exclude, child.path, rel_path, [entry.name for entry in listing], rules)
+                    stack.append((index, iter(listing), rel_path, child_rules, depth + 1))
+            except OSError as e:
+                if error_callback:
+                    error_callback(f"Error processing {child.path}: {str(e)}")
+
+    def copy_range(self, snapshot: ScanSnapshot, start: int, end: int) -> int:
+        """
+        Append the entries [start, end) of another snapshot.
+
+        The range must hold whole subtrees. Links inside it are renumbered;
+        links to entries before it are kept.
+
+        Returns:
+            The offset added to the copied indexes
+        """
+        shift = len(self.names) - start
+        self.names.extend(snapshot._names[start:end])
+        self.depths.extend(snapshot._depths[start:end])
+        self.flags.extend(snapshot._flags[start:end])
+        self.sizes.extend(snapshot._sizes[start:end])
+        self.mtimes.extend(snapshot._mtimes[start:end])
+        if shift:
+            self.parents.extend(array('i', [
+                parent + shift if parent >= start else parent
+                for parent in snapshot._parents[start:end]
+            ]))
+            self.ends.extend(array('i', [e + shift for e in snapshot._ends[start:end]]))
+        else:
+            self.parents.extend(snapshot._parents[start:end])
+            self.ends.extend(snapshot._ends[start:end])
+        return shift
+
+    def build(self, root_path: str, scanned_at: float) -> ScanSnapshot:
+        return ScanSnapshot(
+            root_path, self.names, self.parents, self.depths, self.ends,
+            self.flags, self.sizes, self.mtimes, scanned_at, frozenset(self.ignore_dirs),
+        )
+
+
+def scan_directory(
+    root_path: str,
+    progress_callback: Optional[Callable[[ProgressInfo], None]] = None,
+    error_callback: Optional[Callable[[str], None]] = None,
+    exclude: Optional[ExcludeFilter] = None,
+    cancel: Optional[CancelToken] = None,
+    metrics: Optional[CaptureMetrics] = None,
+) -> ScanSnapshot:
+    """
+    Walk a directory tree once and return an immutable snapshot of it.
+
+    Excluded directories are pruned before they are descended into, and each
+    entry's type, size and mtime are read once while scanning. Ignore files are
+    compiled as their directory is entered.
+
+    Args:
+        root_path: Directory to scan
+        progress_callback: Called with throttled updates as top-level entries finish
+        error_callback: Called with a message for entries that cannot be read
+        exclude: Exclusion rules, DEFAULT_FILTER if not given
+        cancel: Token checked as directories are entered
+        metrics: Receives the scan time and entry counts if given
+
+    Returns:
+        ScanSnapshot: The allowed files and directories below root_path
+
+    Raises:
+        CaptureCancelled: If the scan was cancelled
+    """
+    if exclude is None:
+        exclude = DEFAULT_FILTER
+    scanned_at = time.time()
+    started = time.perf_counter()
+
+    top_level = _sorted_children(root_path)
+    builder = _SnapshotBuilder()
+    root_rules = builder.directory_rules(
+        exclude, root_path, '', [child.name for child in top_level], exclude.root_rules(root_path))
+    progress = ProgressThrottle(progress_callback, len(top_level), 'entries')
+    builder.walk(
+        [(-1, iter(top_level), '', root_rules, 1)], exclude, error_callback, progress, cancel,
+    )
+
+    progress.update(len(top_level))
+    snapshot = builder.build(root_path, scanned_at)
+    if metrics is not None:
+        metrics.add_phase('scan', time.perf_counter() - started)
+        metrics.count('entries', len(snapshot))
+        metrics.count('directories', len(snapshot) - len(snapshot.files()))
+    return snapshot
+
+
+class ListingEntry:
+    """
+    A file or directory listed by a source other than the file system.
+
+    Provides the parts of os.DirEntry that scanning uses, so git trees and
+    archives are filtered and recorded exactly like directories on disk.
+    `key` is whatever the source needs to find the entry's content again.
+    """
+    __slots__ = ('name', 'path', 'st_size', 'st_mtime', 'key', 'symlink', 'children')
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        size: int = 0,
+        mtime: float = 0.0,
+        key=None,
+        symlink: bool = False,
+        is_dir: bool = False,
+    ):
+        self.name = name
+        self.path = path
+        self.st_size = size
+        self.st_mtime = mtime
+        self.key = key
+        self.symlink = symlink
+        self.children: Optional[Dict[str, 'ListingEntry']] = {} if is_dir else None
+
+    def is_dir(self) -> bool:
+        return self.children is not None
+
+    def is_file(self) -> bool:
+        return self.children is None
+
+    def is_symlink(self) -> bool:
+        return self.symlink
+
+    def stat(self) -> 'ListingEntry':
+        return self
+
+    def add(self, rel_path: str, **attributes) -> 'ListingEntry':
+        """
+        Add an entry below this directory, creating missing parent directories.
+
+        Args:
+            rel_path: '/'-separated path relative to this directory
+            **attributes: size, mtime, key, symlink and is_dir of the new entry
+
+        Returns:
+            The new entry, or the existing one if the path was already added
+        """
+        node = self
+        parts = [part for part in rel_path.split('/') if part and part != '.']
+        for depth, part in enumerate(parts):
+            child = node.children.get(part)
+            if child is None:
+                path = f"{node.path}/{part}"
+                if depth == len(parts) - 1:
+                    child = ListingEntry(part, path, **attributes)
+                else:
+                    child = ListingEntry(part, path, is_dir=True)
+                node.children[part] = child
+            elif child.children is None and depth < len(parts) - 1:
+                raise ValueError(f"{'/'.join(parts[:depth + 1])} is both a file and a directory")
+            node = child
+        if attributes.get('is_dir') and node.children is None:
+            raise ValueError(f"{rel_path} is both a file and a directory")
+        return node
+
+
+def snapshot_from_listing(
+    root: ListingEntry,
+    exclude: Optional[ExcludeFilter] = None,
+    read_lines: Optional[Callable[[ListingEntry], List[str]]] = None,
+    cancel: Optional[CancelToken] = None,
+    scanned_at: float = 0.0,
+) -> Tuple[ScanSnapshot, List[object]]:
+    """
+    Build a snapshot from a listing held in memory.
+
+    Entries are filtered and ordered as scan_directory would. Ignore files are
+    only honored if `read_lines` can read them.
+
+    Args:
+        root: Directory entry holding the listing; its path becomes the snapshot root
+        exclude: Exclusion rules, DEFAULT_FILTER if not given
+        read_lines: Returns the lines of an ignore file in the listing
+        cancel: Token checked as top-level entries are recorded
+        scanned_at: Time the listing was taken
+
+    Returns:
+        The snapshot and the key of each of its entries, by snapshot index
+
+    Raises:
+        CaptureCancelled: If the scan was cancelled
+    """
+    if exclude is None:
+        exclude = DEFAULT_FILTER
+
+    def rules_for(directory: ListingEntry, rel_dir: str, inherited: Tuple[IgnoreRules, ...]):
+        if read_lines is None:
+            return inherited
+        return exclude.listing_rules(
+            rel_dir, directory.children, inherited, lambda name: read_lines(directory.children[name]))
+
+    def sorted_children(directory: ListingEntry) -> Iterator[ListingEntry]:
+        return iter(sorted(directory.children.values(), key=lambda entry: entry.name))
+
+    builder = _SnapshotBuilder()
+    keys: List[object] = []
+    stack = [(-1, sorted_children(root), '', rules_for(root, '', exclude.base_rules), 1)]
+    while stack:
+        parent, children, rel_dir, rules, depth = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            if parent >= 0:
+                builder.ends[parent] = len(builder)
+            continue
+        if cancel is not None and len(stack) == 1:
+            cancel.raise_if_cancelled()
+
+        rel_path = f"{rel_dir}/{child.name}" if rel_dir else child.name
+        index = builder.add(child, rel_path, rules, exclude, parent, depth)
+        if index < 0:
+            continue
+        keys.append(child.key)
+        if child.children is not None and not child.symlink:
+            stack.append((index, sorted_children(child), rel_path, rules_for(child, rel_path, rules), depth + 1))
+
+    return builder.build(root.path, scanned_at), keys
+
+
+class SnapshotPatch(NamedTuple):
+    """Result of rescanning one directory of a snapshot"""
+    snapshot: ScanSnapshot
+    index: int  # the rescanned directory, -1 for the root
+    moves: List[Tuple[int, int, int]]  # (start, end, offset) of old entries carried over
+    added: List[Tuple[int, int]]  # [start, end) ranges of freshly scanned entries
+
+    def new_index(self, old_index: int) -> int:
+        """Map an index of the old snapshot to the new one, -1 if it is gone"""
+        position = bisect_right(self.moves, (old_index, sys.maxsize, 0)) - 1
+        if position >= 0:
+            start, end, offset = self.moves[position]
+            if start <= old_index < end:
+                return old_index + offset
+        return -1
+
+
+def _directory_rules(
+    snapshot: ScanSnapshot,
+    parts: Tuple[str, ...],
+    exclude: ExcludeFilter,
+) -> Tuple[IgnoreRules, ...]:
+    """Rebuild the rules in force inside a directory from the root down"""
+    rules = exclude.root_rules(snapshot.root)
+    path, rel_path = snapshot.root, ''
+    for part in parts:
+        rules = exclude.directory_rules(path, rel_path, os.listdir(path), rules)
+        path = os.path.join(path, part)
+        rel_path = f"{rel_path}/{part}" if rel_path else part
+    return rules
+
+
+def rescan_directory(
+    snapshot: ScanSnapshot,
+    index: int,
+    exclude: Optional[ExcludeFilter] = None,
+    error_callback: Optional[Callable[[str], None]] = None,
+) -> SnapshotPatch:
+    """
+    Refresh the listing of one directory without walking the whole tree.
+
+    Files in the directory are stat'ed again. Subdirectories that still exist
+    keep their scanned contents, and new ones are walked. Unless an ignore file
+    in the directory changed or was deleted since the snapshot was taken, in
+    which case the whole subtree is walked again.
+
+    Args:
+        snapshot: Snapshot to refresh
+        index: Index of the directory, -1 for the root
+        exclude: Exclusion rules used for the original scan
+        error_callback: Called with a message for entries that cannot be read
+
+    Returns:
+        SnapshotPatch: The new snapshot and how old indexes map into it
+
+    Raises:
+        OSError: If the directory can no longer be listed
+    """
+    if exclude is None:
+        exclude = DEFAULT_FILTER
+    parts = snapshot[index].parts if index >= 0 else ()
+    dir_path = os.path.join(snapshot.root, *parts)
+    rel_dir = '/'.join(parts)
+
+    listing = _sorted_children(dir_path)
+    child_names = [child.name for child in listing]
+    builder = _SnapshotBuilder()
+    # Directories below keep their entry unless they are walked again
+    builder.ignore_dirs.update(snapshot.ignore_dirs)
+    builder.ignore_dirs.discard(rel_dir)
+    rules = builder.directory_rules(
+        exclude, dir_path, rel_dir, child_names, _directory_rules(snapshot, parts, exclude))
+    # An ignore file that was deleted no longer prunes anything
+    rules_changed = rel_dir in snapshot.ignore_dirs and rel_dir not in builder.ignore_dirs
+    for name in IGNORE_FILES:
+        if name in child_names:
+            try:
+                rules_changed |= os.stat(os.path.join(dir_path, name)).st_mtime >= snapshot.scanned_at
+            except OSError:
+                rules_changed = True
+
+    start = index + 1
+    end = snapshot.subtree_end(index)
+    depth = snapshot._depths[index] + 1 if index >= 0 else 1
+    old_children = {snapshot._names[child]: child for child in snapshot.child_indexes(index)}
+
+    builder.copy_range(snapshot, 0, start)
+    moves = [(0, start, 0)] if start else []
+    added: List[Tuple[int, int]] = []
+
+    for child in listing:
+        rel_path = f"{rel_dir}/{child.name}" if rel_dir else child.name
+        old = old_children.get(child.name, -1)
+        try:
+            if (old >= 0 and snapshot._flags[old] == 0 and not rules_changed
+                    and child.is_dir() and not child.is_symlink()
+                    and not exclude.is_excluded(rules, rel_path, child.name, True)):
+                # Unchanged subdirectory: carry its subtree over as is
+                old_end = snapshot._ends[old]
+                moves.append((old, old_end, builder.copy_range(snapshot, old, old_end)))
+                continue
+
+            new = builder.add(child, rel_path, rules, exclude, index, depth)
+            if new < 0:
+                continue
+            if builder.flags[new] & IS_FILE and old >= 0 and snapshot._flags[old] & IS_FILE:
+                moves.append((old, old + 1, new - old))
+                continue
+            if builder.flags[new] == 0:
+                sub_listing = _sorted_children(child.path)
+                child_rules = builder.directory_rules(
+                    exclude, child.path, rel_path, [entry.name for entry in sub_listing], rules)
+                builder.walk(
+                    [(new, iter(sub_listing), rel_path, child_rules, depth + 1)],
+                    exclude, error_callback,
+                )
+            added.append((new, len(builder)))
+        except OSError as e:
+            if error_callback:
+                error_callback(f"Error processing {child.path}: {str(e)}")
+
+    delta = len(builder) - end
+    if end < len(snapshot):
+        moves.append((end, len(snapshot), builder.copy_range(snapshot, end, len(snapshot))))
+
+    # The directory and its ancestors grow or shrink by the same amount
+    ancestor = index
+    while ancestor >= 0:
+        builder.ends[ancestor] += delta
+        ancestor = builder.parents[ancestor]
+
+    return SnapshotPatch(builder.build(snapshot.root, snapshot.scanned_at), index, moves, added)
@@ -0,0 +1,483 @@
+"""
+Capture service for ConTextCap.
+
+A long-running process that accepts capture requests over a Unix socket or
+a localhost HTTP port, so frequent small captures do not each pay for
+Python startup, imports and a full directory walk. Between requests it
+keeps:
+
+- scan snapshots, brought up to date by polling directory mtimes and
+  rescanning only the directories that changed, as the GUI's watcher does
+- decoded file contents in memory, in front of the on-disk content cache
+
+An asyncio front end parses requests and dispatches captures to a thread
+pool. Captures of the same root run one at a time, at most max_captures run
+at once, and a request identical to one already running waits for that
+capture instead of starting another.
+
+The protocol is plain HTTP/1.1 with JSON bodies, one request per
+connection:
+
+    GET  /status    counters, warm snapshots and cache sizes
+    POST /capture   a job as in batch manifests: root, output and capture
+                    options; paths must be absolute
+    POST /shutdown  stop the service
+
+The Unix socket is only accessible to the user running the service. A TCP
+port is open to every local user, so requests to it must carry the
+service's random token, which is written to a file only that user can read:
+
+    Authorization: Bearer <token>
+
+Usage:
+    python -m contextcap serve --socket /tmp/contextcap.sock
+    curl --unix-socket /tmp/contextcap.sock -H 'Content-Type: application/json' \\
+        -d '{"root": "/src/app", "output": "/tmp/app.md"}' http://localhost/capture
+"""
+
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import stat
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from .batch import ManifestError, job_parser, parse_job_options
+from .cache import default_cache_dir
+from .ignore import ExcludeFilter
+from .scanner import ScanSnapshot, rescan_directory, scan_directory
+
+# Captures run at once by default
+DEFAULT_MAX_CAPTURES = min(4, os.cpu_count() or 1)
+
+# Scan snapshots kept warm; the least recently used is dropped beyond this
+MAX_WARM_SNAPSHOTS = 32
+
+# Largest request body accepted
+MAX_REQUEST_BYTES = 1024 * 1024
+
+# Directory mtimes this close to a scan are not trusted, since file system
+# timestamps are coarser than the clock; such directories are checked again
+MTIME_SLACK = 2.0
+
+# Host names a localhost HTTP request may carry, guarding against DNS rebinding
+LOCAL_HOSTS = frozenset({'localhost', '127.0.0.1', '[::1]'})
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large', 415: 'Unsupported Media Type',
+    500: 'Internal Server Error',
+}
+
+
+class RequestError(Exception):
+    """Raised for a request the service cannot handle, with the HTTP status to answer"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def default_token_file(port: int) -> str:
+    """Return where a service listening on a TCP port writes its token by default"""
+    return os.path.join(default_cache_dir(), f'serve-{port}.token')
+
+
+def write_token(path: str, token: str):
+    """Write a token to a new file that only the current user can read"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.lexists(path):
+        os.remove(path)  # An existing file would keep its permissions
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w', encoding='ascii') as f:
+        f.write(token + '\n')
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return -1.0
+
+
+class WarmSnapshot:
+    """
+    A scan kept between captures.
+
+    Directory mtimes change when entries are added, removed or renamed, so
+    stat'ing the directories finds what needs rescanning without walking
+    the tree. Files edited in place keep their directory's mtime: their
+    contents are still read fresh, but the sizes shown for them in
+    placeholders may lag until their directory changes.
+    """
+
+    def __init__(self, root: str, exclude: ExcludeFilter):
+        self.root = root
+        self.exclude = exclude
+        started = time.time()
+        self.snapshot: ScanSnapshot = scan_directory(root, exclude=exclude)
+        self._mtimes: Dict[str, Optional[float]] = {}
+        self._record([root] + [entry.path for entry in self.snapshot.directories()], started)
+
+    def _record(self, paths, started: float):
+        """Remember directory mtimes, marking those too close to started for another check"""
+        for path in paths:
+            mtime = _mtime(path)
+            self._mtimes[path] = mtime if mtime < started - MTIME_SLACK else None
+
+    def refresh(self) -> bool:
+        """
+        Rescan the directories that changed since the last scan.
+
+        Returns:
+            Whether anything was rescanned
+
+        Raises:
+            OSError: If the root can no longer be listed
+        """
+        started = time.time()
+        changed = sorted(path for path, mtime in self._mtimes.items() if _mtime(path) != mtime)
+        for path in changed:
+            rel_path = os.path.relpath(path, self.root)
+            if rel_path == '.':
+                index = -1
+            else:
+                entry = self.snapshot.find(rel_path)
+                if entry is None or entry.is_file or entry.is_symlink:
+                    del self._mtimes[path]  # Removed or now excluded
+                    continue
+                index = entry.index
+            mtime = _mtime(path)  # taken before listing, so later changes are seen next time
+            try:
+                patch = rescan_directory(self.snapshot, index, self.exclude)
+            except OSError:
+                if index < 0:
+                    raise
+                del self._mtimes[path]  # Removed; its parent reports the change
+                continue
+            self.snapshot = patch.snapshot
+            self._mtimes[path] = mtime if mtime < started - MTIME_SLACK else None
+            self._record([
+                self.snapshot[added].path
+                for start, end in patch.added
+                for added in range(start, end)
+                if not self.snapshot[added].is_file and not self.snapshot[added].is_symlink
+            ], started)
+        return bool(changed)
+
+
+class CaptureService:
+    """
+    Runs capture requests with warm snapshots and caches.
+
+    The coroutines run on the service's event loop; captures themselves run
+    on a pool of max_captures threads, so the loop keeps accepting requests.
+    """
+
+    def __init__(self, cache=None, max_captures: int = DEFAULT_MAX_CAPTURES, workers: Optional[int] = None):
+        """
+        Args:
+            cache: Content cache shared by all captures, e.g. a MemoryCache
+            max_captures: Captures run at once
+            workers: Ingestion threads per capture, unless a request sets its own
+        """
+        self.cache = cache
+        self.max_captures = max_captures
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_captures)
+        self.stats = Counter()
+        self.started = time.time()
+        self._parser = job_parser()
+        self._slots: Optional[asyncio.Semaphore] = None  # created on the event loop
+        self._root_locks: Dict[str, asyncio.Lock] = {}
+        self._root_users = Counter()  # requests holding or waiting for each root lock
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._snapshots: 'OrderedDict[tuple, WarmSnapshot]' = OrderedDict()
+        self._snapshots_lock = threading.Lock()
+
+    def status(self) -> dict:
+        """Describe the service's counters and warm state"""
+        return {
+            'status': 'ok',
+            'uptime': time.time() - self.started,
+            'max_captures': self.max_captures,
+            'running': len(self._in_flight),
+            'counters': dict(self.stats),
+            'snapshots': {warm.root: len(warm.snapshot) for warm in list(self._snapshots.values())},
+            'cached_files': len(self.cache) if hasattr(self.cache, '__len__') else None,
+            'cached_bytes': getattr(self.cache, 'nbytes', None),
+        }
+
+    async def capture(self, spec: dict) -> Tuple[int, dict]:
+        """
+        Run a capture request, joining an identical one already running.
+
+        Returns:
+            The HTTP status and the capture summary
+        """
+        if not isinstance(spec, dict) or 'root' not in spec or 'output' not in spec:
+            raise RequestError(400, "A capture needs a root and an output")
+        if not (os.path.isabs(str(spec['root'])) and os.path.isabs(str(spec['output']))):
+            raise RequestError(400, "The root and output must be absolute paths")
+        try:
+            args = parse_job_options(spec, self._parser)
+        except ManifestError as e:
+            raise RequestError(400, str(e))
+
+        identity = json.dumps(vars(args), sort_keys=True)
+        future = self._in_flight.get(identity)
+        coalesced = future is not None
+        if coalesced:
+            self.stats['coalesced'] += 1
+        else:
+            future = asyncio.ensure_future(self._run(args))
+            self._in_flight[identity] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(identity, None))
+        # Shielded, so a client that goes away does not cancel a capture others wait for
+        status, result = await asyncio.shield(future)
+        return status, dict(result, coalesced=coalesced)
+
+    async def _run(self, args) -> Tuple[int, dict]:
+        from .cli import check_capture_args
+
+        problem = check_capture_args(args)
+        if problem is not None:
+            self.stats['failed'] += 1
+            return 400, {'status': 'failed', 'error': problem}
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_captures)
+        root = os.path.realpath(args.directory)
+        lock = self._root_locks.setdefault(root, asyncio.Lock())
+        self._root_users[root] += 1
+        try:
+            async with lock:
+                async with self._slots:
+                    loop = asyncio.get_event_loop()
+                    return await loop.run_in_executor(self.executor, self._capture, args)
+        finally:
+            # Locks of roots nobody is capturing are dropped, so they do not pile up
+            self._root_users[root] -= 1
+            if not self._root_users[root]:
+                del self._root_users[root]
+                del self._root_locks[root]
+
+    def _warm_snapshot(self, args) -> Tuple[ScanSnapshot, str]:
+        """Return an up-to-date snapshot for a directory capture and how it was obtained"""
+        root = os.path.abspath(args.directory)
+        key = (root, tuple(args.exclude), args.no_ignore_files)
+        with self._snapshots_lock:
+            warm = self._snapshots.get(key)
+            if warm is not None:
+                self._snapshots.move_to_end(key)
+        if warm is not None:
+            try:
+                state = 'updated' if warm.refresh() else 'reused'
+                self.stats[f'snapshots_{state}'] += 1
+                return warm.snapshot, state
+            except OSError:
+                pass  # The root went away; the fresh scan reports it
+
+        warm = WarmSnapshot(root, ExcludeFilter(args.exclude, use_ignore_files=not args.no_ignore_files))
+        self.stats['snapshots_scanned'] += 1
+        with self._snapshots_lock:
+            self._snapshots[key] = warm
+            while len(self._snapshots) > MAX_WARM_SNAPSHOTS:
+                self._snapshots.popitem(last=False)
+        return warm.snapshot, 'scanned'
+
+    def _capture(self, args) -> Tuple[int, dict]:
+        """Run one capture on a pool thread"""
+        from .cli import build_capture, open_source
+
+        source = None
+        try:
+            source = open_source(args)
+            snapshot, state = None, None
+            if source is None:
+                snapshot, state = self._warm_snapshot(args)
+            summary = build_capture(args, self.cache, source, self.workers, snapshot).run()
+        except Exception as e:
+            self.stats['failed'] += 1
+            return 500, {'status': 'failed', 'error': str(e)}
+        finally:
+            if source is not None:
+                source.close()
+            if self.cache is not None:
+                self.cache.flush()
+
+        self.stats['captures'] += 1
+        result = summary.to_dict()
+        result['status'] = 'partial' if summary.errors else 'ok'
+        result['snapshot'] = state
+        return 200, result
+
+    def close(self):
+        """Wait for running captures and release the pool"""
+        self.executor.shutdown(wait=True)
+
+
+class CaptureServer:
+    """Speaks HTTP/1.1 over a Unix socket or localhost TCP for a CaptureService"""
+
+    def __init__(self, service: CaptureService, check_host: bool = False, token: Optional[str] = None):
+        """
+        Args:
+            service: The service requests are passed to
+            check_host: Require a local Host header and no Origin header, so
+                web pages cannot reach a TCP listener through the browser
+            token: Require this bearer token, so other local users cannot
+                use a TCP listener
+        """
+        self.service = service
+        self.check_host = check_host
+        self.token = token
+        self.stopped: Optional[asyncio.Event] = None  # created on the event loop
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer one request and close the connection"""
+        try:
+            status, payload = await self._respond(reader)
+        except RequestError as e:
+            status, payload = e.status, {'status': 'error', 'error': str(e)}
+        except (ValueError, asyncio.IncompleteReadError):
+            status, payload = 400, {'status': 'error', 'error': 'Malformed request'}
+        except Exception as e:
+            print("contextcap: error: unexpected failure while handling a request", file=sys.stderr)
+            traceback.print_exc()
+            status, payload = 500, {'status': 'error', 'error': str(e) or type(e).__name__}
+        body = json.dumps(payload).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n")
+        try:
+            writer.write(head.encode('ascii') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass  # The client went away
+        finally:
+            writer.close()
+
+    async def _respond(self, reader: asyncio.StreamReader) -> Tuple[int, dict]:
+        method, target, _ = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > MAX_REQUEST_BYTES:
+            raise RequestError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b''
+
+        if self.check_host:
+            host = headers.get('host', '')
+            if host.rsplit(':', 1)[0] not in LOCAL_HOSTS and host not in LOCAL_HOSTS:
+                raise RequestError(403, "Only local requests are served")
+            if 'origin' in headers:
+                raise RequestError(403, "Requests from web pages are not served")
+        if self.token is not None:
+            scheme, _, credentials = headers.get('authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(
+                    credentials.strip().encode('latin-1'), self.token.encode('ascii')):
+                raise RequestError(401, "Send the service's token as Authorization: Bearer <token>")
+
+        path = target.split('?', 1)[0]
+        if path == '/status':
+            if method != 'GET':
+                raise RequestError(405, "Use GET for /status")
+            return 200, self.service.status()
+        if path not in ('/capture', '/shutdown'):
+            raise RequestError(404, f"No such endpoint: {path}")
+        if method != 'POST':
+            raise RequestError(405, f"Use POST for {path}")
+        if headers.get('content-type', '').split(';')[0].strip() != 'application/json':
+            raise RequestError(415, "Send a JSON body with Content-Type: application/json")
+        if path == '/shutdown':
+            self.stopped.set()
+            return 200, {'status': 'stopping'}
+        try:
+            spec = json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise RequestError(400, "The body is not valid JSON")
+        return await self.service.capture(spec)
+
+
+def serve(
+    service: CaptureService,
+    socket_path: Optional[str] = None,
+    port: Optional[int] = None,
+    ready_callback=None,
+    token_file: Optional[str] = None,
+):
+    """
+    Serve requests until /shutdown is requested or the process is interrupted.
+
+    Raises:
+        OSError: If the socket or port cannot be listened on, or the token
+            file cannot be written
+
+    Args:
+        service: The service to run requests on
+        socket_path: Unix socket to listen on, readable by the current user only
+        port: Localhost TCP port to listen on instead; 0 picks a free port
+        ready_callback: Called with the address and, for a TCP port, the
+            token file once the server accepts requests
+        token_file: Where a TCP listener writes the token requests must
+            carry; default_token_file(port) if not given. Removed on exit.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    token = secrets.token_urlsafe(32) if socket_path is None else None
+    server = CaptureServer(service, check_host=socket_path is None, token=token)
+    server.stopped = asyncio.Event()
+    token_written = False
+    try:
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                    raise OSError(f"Not a socket, refusing to replace it: {socket_path}")
+                os.remove(socket_path)  # Left over from a service that did not stop cleanly
+            # Created owner-only; a chmod after binding would leave a window open to others
+            umask = os.umask(0o177)
+            try:
+                listener = loop.run_until_complete(asyncio.start_unix_server(server.handle, socket_path))
+            finally:
+                os.umask(umask)
+            address = socket_path
+        else:
+            listener = loop.run_until_complete(asyncio.start_server(server.handle, '127.0.0.1', port or 0))
+            port = listener.sockets[0].getsockname()[1]
+            address = f"http://127.0.0.1:{port}"
+            token_file = token_file or default_token_file(port)
+            try:
+                write_token(token_file, token)
+                token_written = True
+            except OSError:
+                listener.close()
+                raise
+        if ready_callback:
+            ready_callback(address, token_file if token_written else None)
+        try:
+            loop.run_until_complete(server.stopped.wait())
+        finally:
+            listener.close()
+            loop.run_until_complete(listener.wait_closed())
+            service.close()
+    finally:
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+        if token_written and os.path.exists(token_file):
+            os.remove(token_file)
+        loop.close()
@@ -0,0 +1,72 @@
+"""
+Capture sources for ConTextCap.
+
+By default a capture walks a directory and reads files from disk. A
+CaptureSource replaces both steps, so the same renderers can capture a git
+ref straight from the object database (contextcap.git) without a checkout.
+"""
+
+from typing import Callable, Dict, List, Optional
+
+from .content import DEFAULT_MAX_FILE_BYTES, FileContent
+from .ignore import ExcludeFilter
+from .metrics import CaptureMetrics
+from .progress import CancelToken
+from .scanner import ScanEntry, ScanSnapshot
+
+
+class CaptureSource:
+    """
+    Base class for where a capture's entries and file contents come from.
+
+    scan() is called once per capture. load() is called from the ingestion
+    threads, concurrently, for entries of the snapshot scan() returned.
+    Sources hold resources such as subprocesses or open files; use them as
+    context managers or call close().
+    """
+
+    @property
+    def title(self) -> str:
+        """Name shown at the top of the capture"""
+        raise NotImplementedError
+
+    def scan(
+        self,
+        exclude: Optional[ExcludeFilter] = None,
+        error_callback: Optional[Callable[[str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+        metrics: Optional[CaptureMetrics] = None,
+    ) -> ScanSnapshot:
+        """List the source's files and directories, applying the exclusion rules"""
+        raise NotImplementedError
+
+    def files(self, snapshot: ScanSnapshot) -> List[ScanEntry]:
+        """Return the files whose contents are captured, in snapshot order"""
+        return snapshot.files()
+
+    def notes(self, snapshot: ScanSnapshot) -> Dict[int, str]:
+        """Return text shown next to entries in the directory tree, by snapshot index"""
+        return {}
+
+    def load(
+        self,
+        entry: ScanEntry,
+        cache=None,
+        max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+    ) -> FileContent:
+        """
+        Classify a file and load its lines, like load_file_content.
+
+        Raises:
+            OSError: If the file cannot be read
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the source's resources"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
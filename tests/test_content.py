@@ -0,0 +1,53 @@
+"""Tests for classifying and loading file contents"""
+
+import io
+
+import pytest
+
+from contextcap.content import (
+    BINARY, SNIFF_SIZE, TEXT, content_from_bytes, content_from_stream, load_file_content,
+)
+from contextcap.scanner import scan_directory
+
+
+def test_a_file_of_exactly_the_sample_size_is_complete(tmp_path):
+    # A cut-off character is invalid at the end of a file, but not at the end of a partial sample
+    data = b'a\n' * (SNIFF_SIZE // 2 - 1) + b'a\xc3'
+    assert len(data) == SNIFF_SIZE
+    (tmp_path / 'exact.txt').write_bytes(data)
+    (tmp_path / 'longer.txt').write_bytes(data + b'\xa9\n')
+    files = {entry.name: entry for entry in scan_directory(str(tmp_path)).files()}
+
+    assert load_file_content(files['exact.txt']).kind == BINARY
+    assert content_from_bytes('exact.txt', data).kind == BINARY
+    assert load_file_content(files['longer.txt']).kind == TEXT
+
+
+def test_short_complete_file_is_text(tmp_path):
+    (tmp_path / 'short.txt').write_bytes(b'line\n' * 10)
+    entry = scan_directory(str(tmp_path)).files()[0]
+
+    content = load_file_content(entry)
+
+    assert content.kind == TEXT
+    assert content.lines[:2] == ('line', 'line')
+
+
+@pytest.mark.parametrize('size', [0, 100, SNIFF_SIZE, SNIFF_SIZE + 1, 50_000, 300_000])
+@pytest.mark.parametrize('max_bytes', [1000, 20_000, 1024 * 1024])
+@pytest.mark.parametrize('seekable', [False, True])
+def test_stream_matches_bytes(size, max_bytes, seekable):
+    data = b''.join(b'line %d\n' % number for number in range(size))[:size]
+    stream = io.BytesIO(data + b'rest of the stream')
+    skip = (lambda count: stream.seek(count, io.SEEK_CUR)) if seekable else None
+
+    content = content_from_stream('file.txt', stream.read, len(data), max_bytes, skip)
+
+    assert content == content_from_bytes('file.txt', data, max_bytes)
+    if content.kind == TEXT:
+        assert stream.read() == b'rest of the stream'
+
+
+def test_truncated_stream_raises():
+    with pytest.raises(EOFError):
+        content_from_stream('file.txt', io.BytesIO(b'short\n').read, 100)
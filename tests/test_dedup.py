@@ -0,0 +1,90 @@
+"""Tests for duplicate detection"""
+
+from contextcap.content import DUPLICATE, NEAR_DUPLICATE, TEXT, load_file_content
+from contextcap.dedup import EXACT, MIN_DUPLICATE_BYTES, WHITESPACE, Deduplicator
+from contextcap.scanner import scan_directory
+
+
+def resolve_all(root, mode=EXACT, min_bytes=MIN_DUPLICATE_BYTES):
+    """Dedup every file of a directory in snapshot order, returning the kinds by name"""
+    dedup = Deduplicator(mode, min_bytes)
+    files = scan_directory(str(root)).files()
+    contents = [load_file_content(entry) for entry in files]
+    for entry, content in zip(files, contents):
+        dedup.digest(entry, content)
+    return {entry.name: dedup.resolve(entry, content) for entry, content in zip(files, contents)}, dedup
+
+
+def text_of_size(size):
+    line = 'value = 1\n'
+    return (line * (size // len(line) + 1))[:size - 1] + '\n'
+
+
+def test_files_below_min_bytes_are_kept(tmp_path):
+    small = text_of_size(MIN_DUPLICATE_BYTES - 1)
+    (tmp_path / 'a.py').write_text(small)
+    (tmp_path / 'b.py').write_text(small)
+
+    results, dedup = resolve_all(tmp_path)
+
+    assert results['b.py'].kind == TEXT
+    assert dedup.duplicates == 0
+
+
+def test_files_of_min_bytes_are_deduplicated(tmp_path):
+    text = text_of_size(MIN_DUPLICATE_BYTES)
+    (tmp_path / 'a.py').write_text(text)
+    (tmp_path / 'b.py').write_text(text)
+
+    results, dedup = resolve_all(tmp_path)
+
+    assert results['a.py'].kind == TEXT
+    assert results['b.py'].kind == DUPLICATE
+    assert results['b.py'].duplicate_of == 'a.py'
+    assert dedup.duplicates == 1
+    assert dedup.saved_bytes == MIN_DUPLICATE_BYTES
+
+
+def test_custom_threshold(tmp_path):
+    (tmp_path / 'a.py').write_text('x = 1\n')
+    (tmp_path / 'b.py').write_text('x = 1\n')
+
+    results, _ = resolve_all(tmp_path, min_bytes=1)
+
+    assert results['b.py'].kind == DUPLICATE
+
+
+def test_whitespace_mode(tmp_path):
+    text = text_of_size(2 * MIN_DUPLICATE_BYTES)
+    (tmp_path / 'a.py').write_text(text)
+    (tmp_path / 'b.py').write_text(text)
+    (tmp_path / 'c.py').write_text(text.replace(' = ', '  =  ') + '\n\n')
+
+    exact, _ = resolve_all(tmp_path, EXACT)
+    assert exact['c.py'].kind == TEXT
+
+    loose, dedup = resolve_all(tmp_path, WHITESPACE)
+    assert loose['b.py'].kind == DUPLICATE
+    assert loose['c.py'].kind == NEAR_DUPLICATE
+    assert loose['c.py'].duplicate_of == 'a.py'
+    assert dedup.duplicates == 2
+
+
+def test_truncated_files_are_never_deduplicated(tmp_path):
+    # Same size, head and tail, but different middles that the size cap leaves out
+    head = ''.join(f'head {number}\n' for number in range(5000))
+    tail = ''.join(f'tail {number}\n' for number in range(5000))
+    (tmp_path / 'x.txt').write_text(head + 'a' * 1000 + '\n' + tail)
+    (tmp_path / 'y.txt').write_text(head + 'b' * 1000 + '\n' + tail)
+    max_bytes = 64 * 1024
+    dedup = Deduplicator(EXACT, max_bytes=max_bytes)
+    files = scan_directory(str(tmp_path)).files()
+    contents = [load_file_content(entry, max_bytes=max_bytes) for entry in files]
+    for entry, content in zip(files, contents):
+        dedup.digest(entry, content)
+
+    results = [dedup.resolve(entry, content) for entry, content in zip(files, contents)]
+
+    assert all(entry.size > max_bytes for entry in files)
+    assert [content.kind for content in results] == [TEXT, TEXT]
+    assert dedup.duplicates == 0
@@ -0,0 +1,102 @@
+"""Tests for gitignore-style matching and the exclusion rules of a scan"""
+
+import pytest
+
+from contextcap.ignore import ExcludeFilter, IgnoreRules
+from contextcap.scanner import scan_directory
+
+
+def match(patterns, rel_path, is_dir=False, base=''):
+    return IgnoreRules(patterns, base).match(rel_path, rel_path.rsplit('/', 1)[-1], is_dir)
+
+
+def scanned_paths(root, exclude=None):
+    return {entry.rel_path.replace('\\', '/') for entry in scan_directory(str(root), exclude=exclude)}
+
+
+def write(root, rel_path, text=''):
+    path = root.joinpath(*rel_path.split('/'))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+@pytest.mark.parametrize('rel_path, expected', [
+    ('debug.log', True),
+    ('src/debug.log', True),
+    ('keep.log', False),
+    ('src/keep.log', False),
+    ('keep.txt', None),
+])
+def test_negation_reincludes(rel_path, expected):
+    assert match(['*.log', '!keep.log'], rel_path) is expected
+
+
+def test_last_matching_pattern_wins():
+    assert match(['!keep.log', '*.log'], 'keep.log') is True
+
+
+@pytest.mark.parametrize('patterns, rel_path, expected', [
+    (['/build'], 'build', True),
+    (['/build'], 'src/build', None),
+    (['build'], 'src/build', True),
+    (['src/*.py'], 'src/a.py', True),
+    (['src/*.py'], 'lib/src/a.py', None),  # a slash anchors the pattern
+    (['src/*.py'], 'src/x/a.py', None),  # * does not cross directories
+])
+def test_anchoring(patterns, rel_path, expected):
+    assert match(patterns, rel_path) is expected
+
+
+@pytest.mark.parametrize('rel_path, expected', [
+    ('sub/out', True),
+    ('out', None),
+    ('sub/x/out', None),
+])
+def test_anchoring_is_relative_to_the_ignore_file(rel_path, expected):
+    assert match(['/out'], rel_path, base='sub') is expected
+
+
+@pytest.mark.parametrize('patterns, rel_path, expected', [
+    (['**/tmp'], 'tmp', True),
+    (['**/tmp'], 'a/b/tmp', True),
+    (['**/tmp'], 'tmpx', None),
+    (['docs/**/*.md'], 'docs/a.md', True),
+    (['docs/**/*.md'], 'docs/x/y/a.md', True),
+    (['docs/**/*.md'], 'other/docs/a.md', None),
+    (['a/**'], 'a/b/c', True),
+    (['a/**'], 'a', None),
+    (['a/**/b'], 'a/b', True),
+    (['a/**/b'], 'a/x/y/b', True),
+])
+def test_double_star(patterns, rel_path, expected):
+    assert match(patterns, rel_path) is expected
+
+
+def test_directory_only_patterns():
+    assert match(['logs/'], 'logs', is_dir=True) is True
+    assert match(['logs/'], 'logs', is_dir=False) is None
+
+
+def test_scan_honors_nested_ignore_files(tmp_path):
+    write(tmp_path, '.gitignore', '*.log\n/build/\n')
+    write(tmp_path, 'app.log')
+    write(tmp_path, 'build/out.txt')
+    write(tmp_path, 'src/build/gen.txt')
+    write(tmp_path, 'src/.gitignore', '!keep.log\n')
+    write(tmp_path, 'src/keep.log')
+    write(tmp_path, 'src/other.log')
+    write(tmp_path, 'src/main.py')
+
+    assert scanned_paths(tmp_path) == {
+        'src', 'src/build', 'src/build/gen.txt', 'src/keep.log', 'src/main.py',
+    }
+
+
+def test_user_patterns_and_hidden_files(tmp_path):
+    write(tmp_path, 'main.py')
+    write(tmp_path, 'notes.md')
+    write(tmp_path, '.env')
+    write(tmp_path, 'node_modules/pkg/index.js')
+
+    assert scanned_paths(tmp_path, ExcludeFilter(['*.md'])) == {'main.py'}
+    assert scanned_paths(tmp_path, ExcludeFilter(['!.env'])) == {'main.py', 'notes.md', '.env'}
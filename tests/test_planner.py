@@ -0,0 +1,88 @@
+"""Tests for fitting a capture into a token budget"""
+
+from contextcap.planner import (
+    FILE_OVERHEAD_TOKENS, SKIPPED_NOTE_TOKENS, CapturePlanner, classify_file, estimate_tokens,
+    estimate_tree_tokens,
+)
+from contextcap.scanner import scan_directory
+
+
+def make_tree(root):
+    (root / 'src').mkdir()
+    (root / 'main.py').write_text('import src\n' * 40)
+    (root / 'src' / 'core.py').write_text('def f():\n    pass\n' * 30)
+    (root / 'src' / 'util.py').write_text('x = 1\n' * 10)
+    (root / 'yarn.lock').write_text('lock\n' * 200)
+    return scan_directory(str(root))
+
+
+def full_cost(snapshot, max_file_bytes=1024 * 1024):
+    """Tokens of capturing every file"""
+    return estimate_tree_tokens(snapshot) + sum(
+        estimate_tokens(entry, classify_file(entry), max_file_bytes) for entry in snapshot.files())
+
+
+def test_budget_that_fits_everything(tmp_path):
+    snapshot = make_tree(tmp_path)
+    budget = full_cost(snapshot)
+
+    plan = CapturePlanner(budget).plan(snapshot)
+
+    assert plan.skipped == 0
+    assert plan.files == snapshot.files()
+    assert plan.tokens == budget
+
+
+def test_one_token_short_skips_the_lowest_ranked_file(tmp_path):
+    snapshot = make_tree(tmp_path)
+    budget = full_cost(snapshot) - 1
+
+    plan = CapturePlanner(budget).plan(snapshot)
+
+    lockfile = snapshot.find('yarn.lock')
+    assert list(plan.notes) == [lockfile.index]
+    assert lockfile not in plan.files
+    assert plan.tokens <= budget
+
+
+def test_budget_below_the_tree_keeps_no_files(tmp_path):
+    snapshot = make_tree(tmp_path)
+    files = snapshot.files()
+
+    plan = CapturePlanner(1).plan(snapshot)
+
+    assert plan.files == []
+    assert plan.skipped == len(files)
+    assert plan.tokens == estimate_tree_tokens(snapshot) + SKIPPED_NOTE_TOKENS * len(files)
+
+
+def test_smaller_files_fill_the_space_a_large_one_leaves(tmp_path):
+    snapshot = make_tree(tmp_path)
+    main = snapshot.find('main.py')
+    util = snapshot.find('src/util.py')
+    # Room for the small utility module but not for main.py, which ranks higher
+    budget = (estimate_tree_tokens(snapshot) + SKIPPED_NOTE_TOKENS * (len(snapshot.files()) - 1)
+              + estimate_tokens(util, classify_file(util)))
+
+    plan = CapturePlanner(budget).plan(snapshot)
+
+    assert estimate_tokens(main, classify_file(main)) > estimate_tokens(util, classify_file(util))
+    assert plan.files == [util]
+    assert plan.tokens == budget
+
+
+def test_size_cap_limits_the_estimate(tmp_path):
+    snapshot = make_tree(tmp_path)
+    lockfile = snapshot.find('yarn.lock')
+
+    assert estimate_tokens(lockfile, classify_file(lockfile), max_file_bytes=10) == FILE_OVERHEAD_TOKENS + 4
+    assert CapturePlanner(full_cost(snapshot, 10)).plan(snapshot, max_file_bytes=10).skipped == 0
+
+
+def test_avoided_files_are_skipped_first(tmp_path):
+    snapshot = make_tree(tmp_path)
+    budget = full_cost(snapshot) - 1
+
+    plan = CapturePlanner(budget, avoid=['src/core.py']).plan(snapshot)
+
+    assert list(plan.notes) == [snapshot.find('src/core.py').index]
@@ -0,0 +1,132 @@
+"""Tests for rescanning a directory of a snapshot"""
+
+import os
+
+from contextcap.ignore import ExcludeFilter
+from contextcap.scanner import rescan_directory, scan_directory
+
+
+def listing(snapshot):
+    """Everything a snapshot records about its entries, in order"""
+    return [
+        (entry.rel_path, entry.depth, entry.is_file, entry.is_symlink, entry.size, entry.mtime)
+        for entry in snapshot
+    ]
+
+
+def write(root, rel_path, text=''):
+    path = root.joinpath(*rel_path.split('/'))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def make_tree(root):
+    write(root, 'README.md', 'readme\n')
+    write(root, 'src/main.py', 'print(1)\n')
+    write(root, 'src/util.py', 'x = 1\n')
+    write(root, 'src/pkg/mod.py', 'y = 2\n')
+    write(root, 'src/pkg/deep/leaf.py', 'z = 3\n')
+    write(root, 'docs/guide.md', 'guide\n')
+
+
+def rescan(snapshot, rel_dir, exclude=None):
+    index = -1 if rel_dir == '' else snapshot.find(rel_dir).index
+    return rescan_directory(snapshot, index, exclude)
+
+
+def test_rescan_after_adding_and_removing_files(tmp_path):
+    make_tree(tmp_path)
+    snapshot = scan_directory(str(tmp_path))
+
+    write(tmp_path, 'src/new.py', 'new\n')
+    os.remove(tmp_path / 'src' / 'util.py')
+    write(tmp_path, 'src/main.py', 'print(1)\nprint(2)\n')
+    write(tmp_path, 'src/added/inner.py', 'inner\n')
+
+    patch = rescan(snapshot, 'src')
+
+    assert listing(patch.snapshot) == listing(scan_directory(str(tmp_path)))
+
+
+def test_rescan_after_removing_a_subdirectory(tmp_path):
+    make_tree(tmp_path)
+    snapshot = scan_directory(str(tmp_path))
+
+    os.remove(tmp_path / 'src' / 'pkg' / 'deep' / 'leaf.py')
+    os.rmdir(tmp_path / 'src' / 'pkg' / 'deep')
+
+    patch = rescan(snapshot, 'src/pkg')
+
+    assert listing(patch.snapshot) == listing(scan_directory(str(tmp_path)))
+    assert patch.new_index(snapshot.find('src/pkg/deep').index) == -1
+
+
+def test_rescan_of_the_root(tmp_path):
+    make_tree(tmp_path)
+    snapshot = scan_directory(str(tmp_path))
+
+    write(tmp_path, 'CHANGELOG.md', 'changes\n')
+    write(tmp_path, 'lib/helper.py', 'helper\n')
+
+    patch = rescan(snapshot, '')
+
+    assert listing(patch.snapshot) == listing(scan_directory(str(tmp_path)))
+    old_main = snapshot.find('src/main.py')
+    assert patch.snapshot[patch.new_index(old_main.index)].rel_path == old_main.rel_path
+
+
+def test_rescan_after_an_ignore_file_changes(tmp_path):
+    make_tree(tmp_path)
+    exclude = ExcludeFilter()
+    snapshot = scan_directory(str(tmp_path), exclude=exclude)
+
+    write(tmp_path, 'src/.gitignore', 'pkg/\n')
+
+    patch = rescan(snapshot, 'src', exclude)
+
+    assert listing(patch.snapshot) == listing(scan_directory(str(tmp_path), exclude=exclude))
+    assert patch.snapshot.find('src/pkg') is None
+
+
+def test_rescan_honors_user_patterns(tmp_path):
+    make_tree(tmp_path)
+    exclude = ExcludeFilter(['*.md'])
+    snapshot = scan_directory(str(tmp_path), exclude=exclude)
+
+    write(tmp_path, 'docs/extra.md', 'extra\n')
+    write(tmp_path, 'docs/conf.py', 'conf\n')
+
+    patch = rescan(snapshot, 'docs', exclude)
+
+    assert listing(patch.snapshot) == listing(scan_directory(str(tmp_path), exclude=exclude))
+
+
+def test_rescan_after_an_ignore_file_is_deleted(tmp_path):
+    make_tree(tmp_path)
+    write(tmp_path, '.gitignore', '*.log\n')
+    write(tmp_path, 'src/pkg/debug.log', 'log\n')
+    exclude = ExcludeFilter()
+    snapshot = scan_directory(str(tmp_path), exclude=exclude)
+    assert snapshot.find('src/pkg/debug.log') is None
+
+    os.remove(tmp_path / '.gitignore')
+
+    patch = rescan(snapshot, '', exclude)
+
+    assert listing(patch.snapshot) == listing(scan_directory(str(tmp_path), exclude=exclude))
+    assert patch.snapshot.find('src/pkg/debug.log') is not None
+
+
+def test_rescan_after_a_nested_ignore_file_is_deleted(tmp_path):
+    make_tree(tmp_path)
+    write(tmp_path, 'src/.ignore', 'deep/\n')
+    exclude = ExcludeFilter()
+    snapshot = scan_directory(str(tmp_path), exclude=exclude)
+    assert snapshot.find('src/pkg/deep') is None
+
+    os.remove(tmp_path / 'src' / '.ignore')
+
+    patch = rescan(snapshot, 'src', exclude)
+
+    assert listing(patch.snapshot) == listing(scan_directory(str(tmp_path), exclude=exclude))
+    assert patch.snapshot.find('src/pkg/deep/leaf.py') is not None